@@ -0,0 +1,124 @@
+import json
+import platform
+import time
+from datetime import datetime
+
+import numpy
+
+# 每個計數器保留最近的耗時樣本數，用來計算 p50/p99
+SAMPLE_WINDOW = 1024
+# 相同的除錯訊息在這段時間（秒）內只記錄一次
+DEBUG_LOG_INTERVAL = 10.0
+
+
+class TimingCounter:
+    """Call count, total and maximum time of one code path plus its most recent durations"""
+
+    def __init__(self, window=SAMPLE_WINDOW):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._samples = numpy.zeros(window, dtype=numpy.float64)
+
+    def add(self, seconds):
+        self._samples[self.count % len(self._samples)] = seconds
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def summary(self):
+        """Statistics in milliseconds, percentiles over the recent samples"""
+        recent = self._samples[:min(self.count, len(self._samples))] * 1000.0
+        if not len(recent):
+            return {"count": 0, "total_ms": 0.0, "mean_ms": 0.0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000.0, 3),
+            "mean_ms": round(self.total * 1000.0 / self.count, 4),
+            "p50_ms": round(float(numpy.percentile(recent, 50)), 4),
+            "p99_ms": round(float(numpy.percentile(recent, 99)), 4),
+            "max_ms": round(self.max * 1000.0, 4),
+        }
+
+
+class _Measurement:
+    """with diagnostics.measure(name): ..."""
+
+    __slots__ = ("_diagnostics", "_name", "_start")
+
+    def __init__(self, diagnostics, name):
+        self._diagnostics = diagnostics
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._diagnostics.record(self._name, time.perf_counter() - self._start)
+        return False
+
+
+class Diagnostics:
+    """Timing counters of the hot paths and rate limited debug logging
+
+    Counters are only updated from the GUI thread. log is called as
+    log(level, message) with the UM.Logger levels; debugLog() passes each
+    key at most once per DEBUG_LOG_INTERVAL unless verbose is set.
+    """
+
+    def __init__(self, log=None, debug_interval=DEBUG_LOG_INTERVAL):
+        self.verbose = False
+        self._log = log
+        self._debug_interval = debug_interval
+        self._debug_state = {}  # key -> (上次記錄時間, 略過的次數)
+        self._counters = {}
+        self._started = datetime.now()
+
+    def measure(self, name):
+        return _Measurement(self, name)
+
+    def record(self, name, seconds):
+        counter = self._counters.get(name)
+        if counter is None:
+            counter = self._counters[name] = TimingCounter()
+        counter.add(seconds)
+
+    def summary(self):
+        """{counter name: statistics}"""
+        return {name: counter.summary() for name, counter in self._counters.items()}
+
+    def reset(self):
+        self._counters = {}
+        self._started = datetime.now()
+
+    def toDict(self):
+        return {
+            "started": self._started.isoformat(timespec="seconds"),
+            "exported": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "counters": self.summary(),
+        }
+
+    def exportJson(self, file_path):
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump(self.toDict(), f, indent=2)
+
+    def debugLog(self, key, message):
+        """Debug message written on every tick, repeats of key are suppressed for a while"""
+        if self._log is None:
+            return
+        if self.verbose:
+            self._log("d", message)
+            return
+        now = time.monotonic()
+        last, suppressed = self._debug_state.get(key, (None, 0))
+        if last is not None and now - last < self._debug_interval:
+            self._debug_state[key] = (last, suppressed + 1)
+            return
+        if suppressed:
+            message = "{} ({} similar messages suppressed)".format(message, suppressed)
+        self._debug_state[key] = (now, 0)
+        self._log("d", message)
@@ -0,0 +1,106 @@
+import bisect
+import difflib
+import threading
+from collections import OrderedDict
+
+# 兩個檔案中該層的行數合計超過此值時不做逐行比對，difflib 在大量不同的行上會很慢
+MAX_DIFF_LINES = 60000
+# 保留的逐行比對結果數
+LINE_DIFF_CACHE_SIZE = 16
+
+CHANGED = "changed"
+ADDED = "only in this file"
+REMOVED = "only in the other file"
+
+
+class LayerDiff:
+    """Layers that differ between two loaded GcodeEngines, with line diffs made on demand
+
+    compare() matches layers by number and compares the CRC32 fingerprints
+    of their text, so an unchanged layer costs one checksum and is never
+    read again. lineDiff() runs difflib on a single layer the first time it
+    is asked for and keeps the last LINE_DIFF_CACHE_SIZE results; it may
+    run in a worker thread.
+    """
+
+    def __init__(self, engine, other):
+        self.engine = engine
+        self.other = other
+        self.changes = {}  # 圖層編號 -> CHANGED / ADDED / REMOVED
+        self.layer_count = 0  # 兩個檔案中所有圖層編號的數量
+        self._changed_layers = []  # 排序後的 changes 鍵
+        self._line_diffs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compare(self, is_cancelled=None):
+        """Find the differing layers, returns self.changes"""
+        mine = self.engine.layerFingerprints(is_cancelled)
+        theirs = self.other.layerFingerprints(is_cancelled)
+        changes = {}
+        for layer_num, crc in mine.items():
+            other_crc = theirs.get(layer_num)
+            if other_crc is None:
+                changes[layer_num] = ADDED
+            elif other_crc != crc:
+                changes[layer_num] = CHANGED
+        for layer_num in theirs.keys() - mine.keys():
+            changes[layer_num] = REMOVED
+        self.changes = changes
+        self.layer_count = len(mine.keys() | theirs.keys())
+        self._changed_layers = sorted(changes)
+        return changes
+
+    def changedLayers(self):
+        return self._changed_layers
+
+    def isChanged(self, layer_num):
+        return layer_num in self.changes
+
+    def nextChange(self, layer_num, direction=1):
+        """The changed layer after (direction 1) or before (-1) layer_num, None at the end"""
+        layers = self._changed_layers
+        if direction > 0:
+            i = bisect.bisect_right(layers, layer_num)
+            return layers[i] if i < len(layers) else None
+        i = bisect.bisect_left(layers, layer_num) - 1
+        return layers[i] if i >= 0 else None
+
+    def lineDiff(self, layer_num, context=3):
+        """Unified diff lines of a layer, from the other file to this one"""
+        with self._lock:
+            lines = self._line_diffs.get((layer_num, context))
+            if lines is not None:
+                self._line_diffs.move_to_end((layer_num, context))
+                return lines
+        lines = self._lineDiff(layer_num, context)
+        with self._lock:
+            self._line_diffs[(layer_num, context)] = lines
+            while len(self._line_diffs) > LINE_DIFF_CACHE_SIZE:
+                self._line_diffs.popitem(last=False)
+        return lines
+
+    def _lineDiff(self, layer_num, context):
+        if layer_num not in self.changes:
+            return []
+        theirs = self.other.layerLines(layer_num) if self.other.hasLayer(layer_num) else []
+        mine = self.engine.layerLines(layer_num) if self.engine.hasLayer(layer_num) else []
+        if len(theirs) + len(mine) > MAX_DIFF_LINES:
+            return ["Layer {} has {} lines in the other file and {} here, too many for a line diff".format(
+                layer_num, len(theirs), len(mine))]
+        # 區段標頭的行號換算成檔案中的行號
+        lines = []
+        other_first = self.other.layerRange(layer_num)[0] if theirs else 0
+        first = self.engine.layerRange(layer_num)[0] if mine else 0
+        matcher = difflib.SequenceMatcher(None, theirs, mine)
+        for group in matcher.get_grouped_opcodes(context):
+            other_start, other_end = group[0][1], group[-1][2]
+            start, end = group[0][3], group[-1][4]
+            lines.append("@@ -{},{} +{},{} @@".format(
+                other_first + other_start + 1, other_end - other_start, first + start + 1, end - start))
+            for tag, i1, i2, j1, j2 in group:
+                if tag == "equal":
+                    lines.extend(" " + line for line in mine[j1:j2])
+                    continue
+                lines.extend("-" + line for line in theirs[i1:i2])
+                lines.extend("+" + line for line in mine[j1:j2])
+        return lines
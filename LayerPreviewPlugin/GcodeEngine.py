@@ -0,0 +1,331 @@
+"""GCODE loading and layer/step lookups without Qt or Cura
+
+The preview widget and the command line inspector (python -m
+LayerPreviewPlugin) both go through GcodeEngine, so they read the same
+line indexes from the same index cache.
+"""
+
+import bisect
+import os
+
+import numpy
+
+from .GcodeLineStore import GcodeLineStore, LoadCancelled, commandCode, defaultIndexWorkers, openGcodeStore
+from .GcodeSearch import CommandIndex, MAX_SEARCH_RESULTS, compileQuery, filterCodes
+from .GcodeIndexCache import GcodeIndexCache
+from .LayerStats import LayerStats
+
+# 索引快取目錄，與 GCODE_temp 同樣放在插件目錄下
+INDEX_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "GCODE_cache")
+DEFAULT_INDEX_CACHE_SIZE_MB = 512
+
+
+def _ignoreLog(level, message):
+    pass
+
+
+def defaultIndexCache(max_mb=DEFAULT_INDEX_CACHE_SIZE_MB):
+    """The index cache the plugin uses"""
+    return GcodeIndexCache(INDEX_CACHE_DIR, max_mb * 1024 * 1024)
+
+
+class GcodeEngine:
+    """Indexes an IndexedGcodeLines and answers layer and step queries
+
+    load() restores the index from the index cache when the file is
+    unchanged, otherwise builds it and stores it in the cache. It may run
+    in a worker thread; queries made meanwhile only see completed layers.
+    log is called as log(level, message) with the UM.Logger levels.
+    workers is the number of indexing and move parsing processes for
+    large files, None picks defaultIndexWorkers().
+
+    After loading a file, every layer (and the header before the first
+    layer) gets a CRC32 fingerprint. load(previous=engine of the old
+    version) uses them to keep the index of layers that are unchanged at
+    the start and at the end of the file and only scans the rest.
+    """
+
+    def __init__(self, store, index_cache=None, log=None, workers=None):
+        self.store = store
+        self.workers = defaultIndexWorkers() if workers is None else max(1, int(workers))
+        self.file_path = store.file_path  # None for the current slice
+        self.from_cache = False  # index restored from the GcodeIndexCache
+        self.reindexed_bytes = None  # bytes scanned by an incremental load, None after a full one
+        self.layer_stats = None  # LayerStats once buildLayerStats() finished
+        self._command_index = None  # CommandIndex, built on first use
+        self._layer_starts = None  # ([第一行], [最後一行], [圖層編號])，依行號排序
+        self._regions = None  # [(第一行, 起始位置, 結束位置, CRC32)]，依檔案順序
+        self._layer_fingerprints = None  # 圖層編號 -> CRC32，比對檔案時才計算
+        self._index_cache = index_cache if store.file_path else None
+        self._log = log or _ignoreLog
+
+    @classmethod
+    def openFile(cls, file_path, index_cache=None, log=None, progress_callback=None, is_cancelled=None, workers=None):
+        """Open and index a GCODE file, plain or gzip-compressed"""
+        engine = cls(openGcodeStore(file_path), index_cache, log, workers)
+        try:
+            engine.load(progress_callback, is_cancelled)
+        except BaseException:
+            engine.close()
+            raise
+        return engine
+
+    @property
+    def layer_index(self):
+        """layer number -> (first line, last line)"""
+        return self.store.layer_index
+
+    def load(self, progress_callback=None, is_cancelled=None, previous=None):
+        """Index the store, returns True when the index came from the cache
+
+        previous is a loaded engine of an earlier version of the same file;
+        unchanged layers keep its index instead of being scanned again.
+        """
+        identity = self._loadCachedIndex()
+        if self.from_cache:
+            # 壓縮檔需要重新建立解壓縮檢查點
+            self.store.prepareRandomAccess(progress_callback, is_cancelled)
+        else:
+            if previous is None or not self._spliceFrom(previous, is_cancelled):
+                self.store.buildIndex(progress_callback, is_cancelled, self.workers)
+            self._saveCachedIndex(identity)
+        self._fingerprintRegions()
+        return self.from_cache
+
+    def _fingerprintRegions(self):
+        """每個圖層（以及第一層之前的檔頭）的 CRC32"""
+        self._regions = None
+        if not isinstance(self.store, GcodeLineStore):
+            return
+        line_count = len(self.store)
+        ranges = sorted(self.store.layer_index.values())
+        # 重複的圖層編號會讓範圍不連續，這種檔案每次都完整重建索引
+        for (_, last), (next_first, _) in zip(ranges, ranges[1:]):
+            if last + 1 != next_first:
+                return
+        if ranges and ranges[-1][1] != line_count - 1:
+            return
+        starts = [first for first, _ in ranges]
+        if not starts or starts[0] > 0:
+            starts.insert(0, 0)
+        offsets = self.store.exportIndex()[0]
+        regions = []
+        for first_line, next_line in zip(starts, starts[1:] + [line_count]):
+            start, end = int(offsets[first_line]), int(offsets[next_line])
+            regions.append((first_line, start, end, self.store.rangeFingerprint(start, end)))
+        self._regions = regions
+
+    def layerFingerprints(self, is_cancelled=None):
+        """{layer number: CRC32 of the layer's text}, computed on first use from a finished index"""
+        if self._layer_fingerprints is None:
+            # 載入時已算好的區域指紋與圖層範圍相同，直接沿用
+            known = {first_line: crc for first_line, _, _, crc in self._regions or ()}
+            offsets = self.store.exportIndex()[0]
+            fingerprints = {}
+            for layer_num, (first_line, last_line) in self.store.layer_index.items():
+                if is_cancelled is not None and is_cancelled():
+                    raise LoadCancelled()
+                crc = known.get(first_line)
+                if crc is None:
+                    crc = self.store.rangeFingerprint(int(offsets[first_line]), int(offsets[last_line + 1]))
+                fingerprints[layer_num] = crc
+            self._layer_fingerprints = fingerprints
+        return self._layer_fingerprints
+
+    def layerLines(self, layer_num):
+        """Every line of a layer without newlines, comments included"""
+        first_line, last_line = self.store.layer_index[layer_num]
+        return self.store.getLines(first_line, last_line)
+
+    def _spliceFrom(self, previous, is_cancelled):
+        """Reuse the index of unchanged leading and trailing layers, False when nothing matches"""
+        regions = previous._regions
+        if not regions or not isinstance(self.store, GcodeLineStore):
+            return False
+        store = self.store
+        size = store.getSize()
+        byte_shift = size - previous.store.getSize()
+        count = len(regions)
+
+        # 開頭沒變的區域；最後一個區域可能只是被附加了內容，一律重新掃描
+        prefix = 0
+        while prefix < count - 1:
+            _, start, end, crc = regions[prefix]
+            if end > size or store.rangeFingerprint(start, end) != crc:
+                break
+            prefix += 1
+        prefix_end = regions[prefix][1]
+
+        # 結尾沒變的區域，位置依檔案大小的差異平移
+        suffix = 0
+        while prefix + suffix < count:
+            _, start, end, crc = regions[count - 1 - suffix]
+            if start + byte_shift < prefix_end or store.rangeFingerprint(start + byte_shift, end + byte_shift) != crc:
+                break
+            suffix += 1
+        suffix_start = regions[count - suffix][1] + byte_shift if suffix else size
+        if suffix and suffix_start > 0 and store.readBytes(suffix_start - 1, suffix_start) != b"\n":
+            suffix, suffix_start = 0, size
+
+        if prefix_end == 0 and suffix_start == size:
+            return False
+        line_count = len(previous.store)
+        suffix_lines = line_count - regions[count - suffix][0] if suffix else 0
+        store.spliceIndex(previous.store, regions[prefix][0], suffix_lines, is_cancelled)
+        self.reindexed_bytes = suffix_start - prefix_end
+        self._log("d", "Re-indexed {} of {} bytes of {}".format(self.reindexed_bytes, size, self.file_path))
+        return True
+
+    def _loadCachedIndex(self):
+        """Restore the index from the cache, returns the file identity for saving it afterwards"""
+        if self._index_cache is None:
+            return None
+        try:
+            identity = self._index_cache.fileIdentity(self.file_path)
+        except OSError as e:
+            self._log("w", "Cannot identify {} for the index cache: {}".format(self.file_path, e))
+            return None
+        if identity[1] != self.store.getFileSize():
+            # 檔案在開啟後被修改
+            return None
+        try:
+            self.from_cache = self._index_cache.load(identity, self.store)
+        except Exception as e:
+            # 損壞的項目已被刪除，重新索引後會再寫入
+            self._log("w", "Ignoring index cache entry of {}: {}".format(self.file_path, e))
+        return identity
+
+    def _saveCachedIndex(self, identity):
+        if identity is None:
+            return
+        try:
+            # 索引期間檔案被修改時不寫入快取
+            stat = os.stat(self.file_path)
+            if (stat.st_size, stat.st_mtime_ns) == identity[1:3]:
+                self._index_cache.save(identity, self.store.exportIndex())
+        except Exception as e:
+            self._log("w", "Cannot write index cache of {}: {}".format(self.file_path, e))
+
+    def buildLayerStats(self, progress_callback=None, is_cancelled=None):
+        """Parse every move once and compute the per-layer statistics, needs a finished index"""
+        self.layer_stats = LayerStats.fromLines(self.store, progress_callback, is_cancelled, self.workers)
+        return self.layer_stats
+
+    def hasLayer(self, layer_num):
+        return layer_num in self.store.layer_index
+
+    def layerRange(self, layer_num):
+        """(first line, last line) of a layer, None when there is no such layer marker"""
+        return self.store.layer_index.get(layer_num)
+
+    def layerRanges(self):
+        """[(layer number, first line, last line)] sorted by layer number"""
+        return sorted((layer_num, first, last) for layer_num, (first, last) in self.store.layer_index.items())
+
+    def stepLines(self, layer_num):
+        """Line number of every SimulationView path of a layer"""
+        return self.store.stepLines(layer_num)
+
+    def stepCount(self, layer_num):
+        return len(self.store.stepLines(layer_num))
+
+    def stepLineRange(self, layer_num, step, step_lines=None):
+        """(previous path line, path line) of a step, see IndexedGcodeLines.stepLineRange()"""
+        return self.store.stepLineRange(layer_num, step, step_lines)
+
+    def commandLines(self, layer_num, step_num=0):
+        """Line numbers of the G/M commands of a layer, or only of one step when step_num > 0"""
+        first_line, last_line = self.store.layer_index[layer_num]
+        command_lines = self.store.commandLines(first_line, last_line)
+        if step_num > 0:
+            step_range = self.store.stepLineRange(layer_num, step_num)
+            if step_range is not None:
+                command_lines = command_lines[(command_lines > step_range[0]) & (command_lines <= step_range[1])]
+        return command_lines
+
+    def layerCommands(self, layer_num, step_num=0):
+        """[(line number, command)] of a layer or of one step, without trailing newlines"""
+        return [(int(i), self.store.getLine(int(i)).strip()) for i in self.commandLines(layer_num, step_num)]
+
+    def stepText(self, layer_num, step):
+        """[(line number, text)] of every line a step covers, comments included"""
+        step_range = self.store.stepLineRange(layer_num, step)
+        if step_range is None:
+            return []
+        return [(i, self.store.getLine(i).rstrip("\r\n")) for i in range(step_range[0] + 1, step_range[1] + 1)]
+
+    def filteredLines(self, layer_num, view_filter="commands"):
+        """Line numbers of a layer shown by a GcodeSearch.VIEW_FILTERS key"""
+        first_line, last_line = self.store.layer_index[layer_num]
+        if view_filter == "all":
+            return numpy.arange(first_line, last_line + 1, dtype=numpy.int64)
+        if view_filter == "content":
+            return self.store.contentLines(first_line, last_line)
+        codes = filterCodes(view_filter)
+        if codes is None:
+            return self.store.commandLines(first_line, last_line)
+        return numpy.flatnonzero(numpy.isin(self.store.commandCodes(first_line, last_line), codes)) + first_line
+
+    def commandIndex(self):
+        """CommandIndex of the finished index"""
+        if self._command_index is None:
+            self._command_index = CommandIndex(self.store.commandCodes(0, len(self.store) - 1))
+        return self._command_index
+
+    def layerOfLine(self, line_number):
+        """Layer number containing a line, None outside every layer"""
+        if self._layer_starts is None:
+            ranges = sorted((first, last, layer_num) for layer_num, (first, last) in self.store.layer_index.items())
+            self._layer_starts = ([r[0] for r in ranges], [r[1] for r in ranges], [r[2] for r in ranges])
+        firsts, lasts, layer_numbers = self._layer_starts
+        i = bisect.bisect_right(firsts, line_number) - 1
+        if i < 0 or line_number > lasts[i]:
+            return None
+        return layer_numbers[i]
+
+    def search(self, text, use_regex=False, ignore_case=True, is_cancelled=None, max_results=MAX_SEARCH_RESULTS):
+        """Yield arrays of matching line numbers in file order, at most max_results lines in total
+
+        A plain G/M/T code such as "M104" is answered from the command
+        index; everything else is a text or regular expression search over
+        the whole file.
+        """
+        code = None if use_regex else commandCode(text)
+        if code is not None:
+            batches = iter([self.commandIndex().lines(code)])
+        else:
+            pattern, flags = compileQuery(text, use_regex, ignore_case)
+            batches = self.store.searchLines(pattern, flags, is_cancelled)
+        remaining = max_results
+        for lines in batches:
+            if len(lines):
+                yield lines[:remaining]
+                remaining -= min(len(lines), remaining)
+            if remaining <= 0:
+                return
+
+    def getMemoryBreakdown(self):
+        """{category: bytes} held by the engine, see MemoryBudget.CATEGORIES"""
+        caches = self.getCacheMemoryUsage()
+        return {
+            "text": self.store.getTextMemoryUsage() + caches["text"],
+            "index": self.store.getMemoryUsage() + caches["index"],
+            "moves": self.layer_stats.getMemoryUsage() if self.layer_stats is not None else 0,
+        }
+
+    def getCacheMemoryUsage(self):
+        """{category: bytes} that releaseCaches() frees"""
+        command_index = self._command_index
+        return {"text": self.store.getTextCacheMemoryUsage(),
+                "index": command_index.getMemoryUsage() if command_index is not None else 0}
+
+    def releaseCaches(self):
+        """Free the decompressed text blocks and the command index, both are rebuilt on demand"""
+        self._command_index = None
+        self.store.releaseTextCache()
+
+    def getMemoryUsage(self):
+        return sum(self.getMemoryBreakdown().values())
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import struct
+import zlib
+
+import numpy
+
+# 格式變更時遞增，舊版本的快取會被視為無效並刪除
+INDEX_CACHE_VERSION = 2
+
+_MAGIC = b"LPGIDX\x00\x00"
+_HEADER = struct.Struct("<8sII")  # magic, version, metadata length
+_ENTRY_SUFFIX = ".idx"
+
+# 內容雜湊只讀取檔案的幾個片段，大檔案也只需要幾毫秒
+_SAMPLE_SIZE = 64 * 1024
+_SAMPLE_COUNT = 16
+
+_ARRAY_NAMES = ("offsets", "first_codes", "motion_lines", "command_codes")
+
+
+def contentHash(file_path, size):
+    """Fast hash of a file: its size plus evenly spaced samples including the start and the end"""
+    digest = hashlib.blake2b(str(size).encode("ascii"), digest_size=16)
+    with open(file_path, "rb") as f:
+        if size <= _SAMPLE_SIZE * _SAMPLE_COUNT:
+            digest.update(f.read())
+        else:
+            step = (size - _SAMPLE_SIZE) // (_SAMPLE_COUNT - 1)
+            for i in range(_SAMPLE_COUNT):
+                f.seek(i * step)
+                digest.update(f.read(_SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+class GcodeIndexCache:
+    """Sidecar files holding the line index of GCODE files, keyed by file identity
+
+    An entry is only used when the path, size, modification time and
+    content hash of the file all match. Entries are evicted least recently
+    used first once the directory grows past max_bytes. Unreadable, stale
+    or corrupt entries are deleted so the file gets indexed again.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self._max_bytes = max(0, int(max_bytes))
+
+    def setMaxBytes(self, max_bytes):
+        self._max_bytes = max(0, int(max_bytes))
+        self._evict()
+
+    def getMaxBytes(self):
+        return self._max_bytes
+
+    def fileIdentity(self, file_path):
+        """(path, size, mtime_ns, content hash) of a file"""
+        file_path = os.path.normcase(os.path.abspath(file_path))
+        stat = os.stat(file_path)
+        return file_path, stat.st_size, stat.st_mtime_ns, contentHash(file_path, stat.st_size)
+
+    def _entryPath(self, identity):
+        key = hashlib.sha1("|".join(str(part) for part in identity).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + _ENTRY_SUFFIX)
+
+    def load(self, identity, store):
+        """Restore the index of store from the cache, returns False on a miss
+
+        A stale or corrupt entry is deleted and the error is re-raised.
+        """
+        entry_path = self._entryPath(identity)
+        if not os.path.exists(entry_path):
+            return False
+        try:
+            with open(entry_path, "rb") as f:
+                magic, version, metadata_length = _HEADER.unpack(f.read(_HEADER.size))
+                if magic != _MAGIC or version != INDEX_CACHE_VERSION:
+                    raise ValueError("unsupported index cache version {}".format(version))
+                metadata = json.loads(f.read(metadata_length).decode("utf-8"))
+                if metadata["identity"] != list(identity):
+                    raise ValueError("index cache entry belongs to another file")
+                arrays = {}
+                checksum = 0
+                for name, dtype, length in metadata["arrays"]:
+                    array = numpy.fromfile(f, dtype=numpy.dtype(dtype), count=length)
+                    if len(array) != length:
+                        raise ValueError("truncated index cache entry")
+                    checksum = zlib.crc32(array, checksum)
+                    arrays[name] = array
+                if checksum != metadata["checksum"]:
+                    raise ValueError("index cache checksum mismatch")
+            layer_index = {layer_num: (first, last) for layer_num, first, last in metadata["layers"]}
+            store.restoreIndex(arrays["offsets"], arrays["first_codes"], arrays["motion_lines"], arrays["command_codes"], layer_index)
+        except Exception:
+            self._remove(entry_path)
+            raise
+        # 更新修改時間，作為 LRU 的最近使用時間
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        return True
+
+    def save(self, identity, index):
+        """Store an index returned by IndexedGcodeLines.exportIndex()"""
+        offsets, first_codes, motion_lines, command_codes, layer_index = index
+        arrays = dict(zip(_ARRAY_NAMES, (offsets, first_codes, motion_lines, command_codes)))
+        checksum = 0
+        for name in _ARRAY_NAMES:
+            checksum = zlib.crc32(numpy.ascontiguousarray(arrays[name]), checksum)
+        metadata = json.dumps({
+            "identity": list(identity),
+            "arrays": [[name, arrays[name].dtype.str, len(arrays[name])] for name in _ARRAY_NAMES],
+            "layers": [[layer_num, first, last] for layer_num, (first, last) in layer_index.items()],
+            "checksum": checksum,
+        }).encode("utf-8")
+        entry_size = _HEADER.size + len(metadata) + sum(array.nbytes for array in arrays.values())
+        if entry_size > self._max_bytes:
+            return False
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry_path = self._entryPath(identity)
+        # 先寫到暫存檔再替換，中途中斷也不會留下寫了一半的快取
+        temp_path = "{}.{}.tmp".format(entry_path, os.getpid())
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, INDEX_CACHE_VERSION, len(metadata)))
+                f.write(metadata)
+                for name in _ARRAY_NAMES:
+                    numpy.ascontiguousarray(arrays[name]).tofile(f)
+            os.replace(temp_path, entry_path)
+        except Exception:
+            self._remove(temp_path)
+            raise
+        self._evict()
+        return True
+
+    def _entries(self):
+        """[(最近使用時間, 大小, 路徑)]"""
+        entries = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(_ENTRY_SUFFIX):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self):
+        """刪除最久未使用的項目，直到總大小不超過上限"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self._max_bytes:
+                break
+            if self._remove(path):
+                total -= size
+
+    def getUsage(self):
+        """快取目錄目前佔用的位元組數"""
+        return sum(size for _, size, _ in self._entries())
+
+    def clear(self):
+        for _, _, path in self._entries():
+            self._remove(path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
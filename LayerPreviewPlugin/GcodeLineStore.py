@@ -0,0 +1,1059 @@
+import bisect
+import collections
+import concurrent.futures
+import mmap
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import zlib
+
+import numpy
+
+# Cura 圖層標記，例如 ";LAYER:12"、"; LAYER:-1"
+LAYER_MARKER_PATTERN = re.compile(r"[ \t]*;[ \t]*LAYER:[ \t]*(-?\d+)")
+
+# 移動指令 G0-G3（含 G00-G03），group(1) 為註解之前的參數
+MOTION_COMMAND_PATTERN = re.compile(r"\s*G0?[0-3](?![0-9.])([^;\n]*)")
+
+# 每次掃描換行符號的區塊大小
+SCAN_CHUNK_SIZE = 16 * 1024 * 1024
+
+# 檔案超過此大小才值得啟動工作行程平行建立索引
+PARALLEL_INDEX_MIN_SIZE = 128 * 1024 * 1024
+MAX_INDEX_WORKERS = 8
+# 每個工作行程排隊中的區塊數，限制尚未合併的結果所佔的記憶體
+_PARALLEL_QUEUE_DEPTH = 2
+# 等待工作行程時檢查取消的間隔（秒）
+_CANCEL_POLL_INTERVAL = 0.1
+
+# gzip 檔案：檢查點的初始間隔（解壓縮後的位元組）與數量上限，超過上限時間隔加倍
+GZIP_CHECKPOINT_SPACING = 1024 * 1024
+MAX_GZIP_CHECKPOINTS = 256
+# 隨機讀取時每次解壓縮的區塊大小，以及保留的區塊數
+GZIP_BLOCK_SIZE = 256 * 1024
+GZIP_BLOCK_CACHE_SIZE = 32
+_GZIP_MAGIC = b"\x1f\x8b"
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+_GZIP_READ_SIZE = 64 * 1024
+# deflate 的最大壓縮比，用來判斷解壓縮後是否可能超過 4GB
+_MAX_DEFLATE_RATIO = 1032
+# 一個檢查點（decompressobj 的複本：32KB 視窗加上解壓縮狀態）大約佔用的記憶體
+_GZIP_CHECKPOINT_BYTES = 40 * 1024
+
+# 指令代碼：G n、M n、T n（n < 10000）編成 uint16，0 表示不是指令
+COMMAND_CODE_BASES = {"G": 1, "M": 10001, "T": 20001}
+MAX_COMMAND_NUMBER = 9999
+_COMMAND_CODE_LETTERS = numpy.zeros(256, dtype=numpy.uint16)
+for _letter, _base in COMMAND_CODE_BASES.items():
+    _COMMAND_CODE_LETTERS[ord(_letter)] = _base
+del _letter, _base
+COMMAND_CODE_PATTERN = re.compile(r"\s*([GMT])(\d{1,4})(?!\d)")
+
+# 行首字元可能是空白（含非 ASCII 字元）時，需要解碼後才能判斷
+_AMBIGUOUS_FIRST_CODES = numpy.zeros(256, dtype=bool)
+_AMBIGUOUS_FIRST_CODES[[9, 10, 11, 12, 13, 28, 29, 30, 31, 32]] = True
+_AMBIGUOUS_FIRST_CODES[0x80:] = True
+
+
+class LoadCancelled(Exception):
+    """Raised by IndexedGcodeLines.buildIndex() when the caller cancels indexing"""
+    pass
+
+
+def _findMotionLines(codes, starts, ends, first, line_text):
+    """區段內有 X 或 Y 參數的 G0-G3 指令的相對行號（向量化判斷）"""
+    segment_size = len(codes)
+
+    def codeAt(position):
+        # 每一行第 position 個字元，超出該行時為 0
+        index = starts + position
+        return numpy.where(index < ends, codes[numpy.minimum(index, segment_size - 1)], 0)
+
+    def isNumberCode(value):
+        return ((value >= 48) & (value <= 57)) | (value == 46)
+
+    second, third, fourth = codeAt(1), codeAt(2), codeAt(3)
+    short_code = (second >= 48) & (second <= 51) & ~isNumberCode(third)
+    long_code = (second == 48) & (third >= 48) & (third <= 51) & ~isNumberCode(fourth)
+    candidates = numpy.flatnonzero((first == 71) & (short_code | long_code))
+
+    # 只算註解（;）之前的 X/Y 參數
+    axis_positions = numpy.flatnonzero((codes == 88) | (codes == 89))
+    axis_lines = numpy.searchsorted(starts, axis_positions, side="right") - 1
+    semicolons = numpy.flatnonzero(codes == 59)
+    first_semicolon = numpy.searchsorted(semicolons, starts[axis_lines])
+    comment_start = numpy.append(semicolons, segment_size)[first_semicolon]
+    # searchsorted 的結果已排序，相鄰去重即可，不需要 numpy.unique 再排序一次
+    lines_with_axis = axis_lines[axis_positions < comment_start]
+    lines_with_axis = lines_with_axis[numpy.diff(lines_with_axis, prepend=-1) != 0]
+    motion_lines = candidates[numpy.isin(candidates, lines_with_axis, assume_unique=True)]
+
+    # 行首有空白的行很少見，解碼後用正規表示式判斷
+    indented = numpy.flatnonzero((first == 32) | (first == 9))
+    if len(indented):
+        extra = []
+        for line in indented:
+            match = MOTION_COMMAND_PATTERN.match(line_text(int(starts[line]), int(ends[line])))
+            if match and ("X" in match.group(1) or "Y" in match.group(1)):
+                extra.append(line)
+        if extra:
+            motion_lines = numpy.union1d(motion_lines, extra)
+    return motion_lines
+
+
+def commandCode(name):
+    """'M104' -> command code, None when name is not a G/M/T command"""
+    match = COMMAND_CODE_PATTERN.fullmatch(name.strip().upper())
+    if match is None:
+        return None
+    return COMMAND_CODE_BASES[match.group(1)] + int(match.group(2))
+
+
+def commandName(code):
+    """command code -> 'M104', None for 0"""
+    for letter, base in sorted(COMMAND_CODE_BASES.items(), key=lambda item: -item[1]):
+        if code >= base:
+            return "{}{}".format(letter, code - base)
+    return None
+
+
+def _findCommandCodes(codes, starts, ends, first, line_text):
+    """每一行的指令代碼（向量化解析字母後最多 4 位數字）"""
+    segment_size = len(codes)
+    base = _COMMAND_CODE_LETTERS[numpy.minimum(first, 255)].astype(numpy.int64)
+    number = numpy.zeros(len(starts), dtype=numpy.int64)
+    digits = numpy.zeros(len(starts), dtype=numpy.int64)
+    active = base > 0
+    # 讀到第 5 位數字才知道編號是否超過 4 位數（這種行不是指令）
+    for position in range(1, 6):
+        index = starts + position
+        value = numpy.where(index < ends, codes[numpy.minimum(index, segment_size - 1)], 0).astype(numpy.int64) - 48
+        active = active & (value >= 0) & (value <= 9)
+        number = numpy.where(active, number * 10 + value, number)
+        digits += active
+    command_codes = numpy.where((digits >= 1) & (digits <= 4), base + number, 0)
+
+    # 行首有空白的行很少見，解碼後判斷
+    for line in numpy.flatnonzero((first == 32) | (first == 9)):
+        match = COMMAND_CODE_PATTERN.match(line_text(int(starts[line]), int(ends[line])))
+        if match:
+            command_codes[line] = COMMAND_CODE_BASES[match.group(1)] + int(match.group(2))
+    return command_codes.astype(numpy.uint16)
+
+
+def _scanSegment(codes, line_text):
+    """掃描一個從行首開始、以完整的行結束的區段
+
+    codes holds the character codes of the segment (bytes or code points)
+    and line_text(start, end) decodes part of it. Returns the newline
+    positions, the first code and the command code of every line, the
+    motion lines and the layer markers as (line, layer number), all
+    relative to the segment.
+    """
+    segment_size = len(codes)
+    newlines = numpy.flatnonzero(codes == 10)
+    starts = numpy.concatenate(([0], newlines + 1))
+    starts = starts[starts < segment_size]
+    ends = numpy.append(starts[1:], segment_size)
+    if not len(starts):
+        return newlines, numpy.zeros(0, dtype=numpy.uint8), numpy.zeros(0, dtype=numpy.uint16), numpy.zeros(0, dtype=numpy.int64), []
+
+    first = codes[starts]
+    motion_lines = _findMotionLines(codes, starts, ends, first, line_text)
+
+    # 圖層標記只會出現在 ";L"、"; " 或縮排開頭的行，只有這些行需要解碼
+    second = numpy.where(starts + 1 < ends, codes[numpy.minimum(starts + 1, segment_size - 1)], 0)
+    marker_candidates = ((first == 59) & ((second == 76) | (second == 32) | (second == 9))) | (first == 32) | (first == 9)
+    markers = []
+    for line in numpy.flatnonzero(marker_candidates):
+        match = LAYER_MARKER_PATTERN.match(line_text(int(starts[line]), int(ends[line])))
+        if match:
+            markers.append((int(line), int(match.group(1))))
+
+    command_codes = _findCommandCodes(codes, starts, ends, first, line_text)
+    return newlines, numpy.minimum(first, 255).astype(numpy.uint8), command_codes, motion_lines, markers
+
+
+def _scanFileRange(file_path, start, end, scan=_scanSegment):
+    """Worker process entry point: scan(codes, line_text) of the complete lines in [start, end) of a file"""
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    def lineText(line_start, line_end):
+        return data[line_start:line_end].decode("utf-8", errors="ignore")
+
+    return scan(numpy.frombuffer(data, dtype=numpy.uint8), lineText)
+
+
+def _foldLayerMarkers(markers, line_count):
+    """[(line, layer number)] in line order -> layer index, like buildIndex() the first marker of a layer wins"""
+    layer_index = {}
+    current_layer = None
+    current_start = 0
+    for line_number, layer_num in markers:
+        if current_layer is not None and current_layer not in layer_index:
+            layer_index[current_layer] = (current_start, line_number - 1)
+        current_layer = layer_num
+        current_start = line_number
+    if current_layer is not None and current_layer not in layer_index:
+        layer_index[current_layer] = (current_start, line_count - 1)
+    return layer_index
+
+
+def isGzipFile(file_path):
+    with open(file_path, "rb") as f:
+        return f.read(2) == _GZIP_MAGIC
+
+
+def openGcodeStore(file_path):
+    """GcodeGzipStore for a gzip-compressed file (detected by its content), GcodeLineStore otherwise"""
+    if isGzipFile(file_path):
+        return GcodeGzipStore(file_path)
+    return GcodeLineStore(file_path)
+
+
+def isFrozen():
+    """True inside a frozen build such as Cura.exe, where starting a worker process starts the application again"""
+    return bool(getattr(sys, "frozen", False))
+
+
+def defaultIndexWorkers():
+    """Worker processes for buildIndex(): 1 unless processes can be started safely
+
+    Spawned workers re-import the __main__ script of the host. That is only
+    known to be harmless when it runs as "python -m package" (the command
+    line inspector); inside Cura it would start Cura again, so the plugin
+    indexes in a single process there.
+    """
+    if isFrozen():
+        return 1
+    main_spec = getattr(sys.modules.get("__main__"), "__spec__", None)
+    if main_spec is None or not main_spec.name.endswith("__main__"):
+        return 1
+    return max(1, min(os.cpu_count() or 1, MAX_INDEX_WORKERS))
+
+
+class IndexedGcodeLines:
+    """GCODE text with a line index, lines are decoded only when accessed
+
+    Subclasses provide the text through iterSegments() and _readRange().
+    After buildIndex() it behaves like the list returned by readlines():
+    len(), indexing, slicing and iteration all return decoded lines
+    including the trailing newline.
+
+    buildIndex() may run in a worker thread. While it runs, layer_index only
+    holds completed layers and every line of those layers is readable.
+    """
+
+    def __init__(self, size):
+        self.file_path = None
+        self.layer_index = {}  # layer number -> (first line, last line)
+        self._size = size
+        # 小於 4GB 時使用 uint32，每行只佔 4 bytes
+        self._offsets_dtype = numpy.uint32 if size < 2 ** 32 else numpy.uint64
+        # 行起始位置陣列，最後一個元素是總長度；索引完成前為 None
+        self._offsets = None
+        # 每一行的第一個字元（大於 255 時記為 255），用來快速篩選指令行
+        self._first_codes = None
+        # SimulationView 的每個路徑（有 X/Y 的移動指令）所在的行號，依檔案順序
+        self._motion_lines = None
+        # 每一行的指令代碼（commandCode()），搜尋與篩選用
+        self._command_codes = None
+        # 索引進行中已完成的區段：(行起始位置, 累計行數, 行首字元, 路徑行號, 指令代碼)，整個 tuple 一次替換
+        self._partial = ([], [], [], [], [])
+
+    def getDisplayName(self):
+        return self.file_path
+
+    def getSize(self):
+        """總長度（檔案為位元組數，切片為字元數）"""
+        return self._size
+
+    def getFileSize(self):
+        """Size of the file on disk, the same as getSize() unless it is compressed"""
+        return self._size
+
+    def iterSegments(self):
+        """依序產生 (起始位置, 結束位置, 字元碼陣列, line_text)，每個區段只包含完整的行"""
+        raise NotImplementedError()
+
+    def _readRange(self, start, end):
+        """解碼 [start, end) 範圍的文字"""
+        raise NotImplementedError()
+
+    def buildIndex(self, progress_callback=None, is_cancelled=None, workers=1):
+        """單次掃描建立行位置、圖層索引與路徑行號
+
+        progress_callback(fraction) is called after every segment and
+        is_cancelled() is polled before every segment. Stores that support
+        it scan segments in up to `workers` processes; the segments are
+        merged in file order, so the index is the same as with one.
+        """
+        parts = [numpy.zeros(1, dtype=self._offsets_dtype)]
+        counts = [1]
+        first_parts = []
+        motion_parts = []
+        code_parts = []
+        layer_index = {}
+        current_layer = None
+        current_start = 0
+
+        for segment_start, segment_end, scanned in self.mapSegments(_scanSegment, is_cancelled, workers):
+            newlines, first_codes, command_codes, motion_lines, markers = scanned
+
+            # 區段第一行的行號（區段總是從行首開始）
+            line_base = counts[-1] - 1
+            for local_line, layer_num in markers:
+                line_number = line_base + local_line
+                if current_layer is not None and current_layer not in layer_index:
+                    layer_index[current_layer] = (current_start, line_number - 1)
+                current_layer = layer_num
+                current_start = line_number
+
+            parts.append((newlines + (segment_start + 1)).astype(self._offsets_dtype))
+            counts.append(counts[-1] + len(newlines))
+            first_parts.append(first_codes)
+            motion_parts.append((motion_lines + line_base).astype(self._offsets_dtype))
+            code_parts.append(command_codes)
+            # 發佈目前的進度：只替換參考，讀取端不需要加鎖；圖層索引最後發佈
+            self._partial = (list(parts), list(counts), list(first_parts), list(motion_parts), list(code_parts))
+            self.layer_index = dict(layer_index)
+
+            if progress_callback:
+                progress_callback(segment_end / self._size)
+
+        offsets = numpy.concatenate(parts)
+        # 以換行結尾時，最後一個起點就是結尾，不算一行
+        if offsets[-1] != self._size:
+            offsets = numpy.append(offsets, numpy.array([self._size], dtype=self._offsets_dtype))
+        self._offsets = offsets
+        self._first_codes = numpy.concatenate(first_parts) if first_parts else numpy.zeros(0, dtype=numpy.uint8)
+        self._motion_lines = numpy.concatenate(motion_parts) if motion_parts else numpy.zeros(0, dtype=self._offsets_dtype)
+        self._command_codes = numpy.concatenate(code_parts) if code_parts else numpy.zeros(0, dtype=numpy.uint16)
+        self._partial = ([], [], [], [], [])
+
+        # 最後一層延伸到結尾
+        if current_layer is not None and current_layer not in layer_index:
+            layer_index[current_layer] = (current_start, len(self) - 1)
+        self.layer_index = layer_index
+
+    def mapSegments(self, scan, is_cancelled=None, workers=1):
+        """(start, end, scan(codes, line_text)) of every segment, in file order
+
+        scan must be a module-level function returning picklable results;
+        stores that support it run it in up to `workers` processes.
+        is_cancelled() is polled before every segment.
+        """
+        for segment_start, segment_end, codes, line_text in self.iterSegments():
+            if is_cancelled and is_cancelled():
+                raise LoadCancelled()
+            scanned = scan(codes, line_text)
+            del codes
+            yield segment_start, segment_end, scanned
+
+    def prepareRandomAccess(self, progress_callback=None, is_cancelled=None):
+        """Make lines readable after restoreIndex(), nothing to do unless a store needs it"""
+        pass
+
+    def exportIndex(self):
+        """(offsets, first codes, motion lines, command codes, layer index) of a finished index"""
+        return self._offsets, self._first_codes, self._motion_lines, self._command_codes, dict(self.layer_index)
+
+    def restoreIndex(self, offsets, first_codes, motion_lines, command_codes, layer_index):
+        """Use an index from exportIndex() instead of calling buildIndex()"""
+        line_count = len(offsets) - 1
+        if (line_count < 0 or int(offsets[-1]) != self._size or len(first_codes) != line_count or
+                len(command_codes) != line_count):
+            raise ValueError("index does not match the GCODE content")
+        if len(motion_lines) and int(motion_lines[-1]) >= line_count:
+            raise ValueError("index does not match the GCODE content")
+        self._offsets = offsets.astype(self._offsets_dtype, copy=False)
+        self._first_codes = first_codes.astype(numpy.uint8, copy=False)
+        self._motion_lines = motion_lines.astype(self._offsets_dtype, copy=False)
+        self._command_codes = command_codes.astype(numpy.uint16, copy=False)
+        self._partial = ([], [], [], [], [])
+        self.layer_index = layer_index
+
+    def _indexArray(self, final, partial_parts, dtype):
+        """索引完成後的陣列，索引進行中則合併已發佈的區段"""
+        if final is not None:
+            return final
+        return numpy.concatenate(partial_parts) if partial_parts else numpy.zeros(0, dtype=dtype)
+
+    def stepLines(self, layer_num):
+        """Line number of every SimulationView path of a layer, stepLines(n)[k - 1] is step k"""
+        layer_range = self.layer_index.get(layer_num)
+        if layer_range is None:
+            return numpy.zeros(0, dtype=self._offsets_dtype)
+        # 索引進行中，已完成圖層的路徑都在已發佈的區段內
+        motion_lines = self._indexArray(self._motion_lines, self._partial[3], self._offsets_dtype)
+        # 以陣列本身的型別搜尋；Python int 會讓 numpy 把整個 uint 陣列轉成 int64
+        line_type = motion_lines.dtype.type
+        first = numpy.searchsorted(motion_lines, line_type(layer_range[0]), side="left")
+        last = numpy.searchsorted(motion_lines, line_type(layer_range[1]), side="right")
+        return motion_lines[first:last]
+
+    def stepLineRange(self, layer_num, step, step_lines=None):
+        """(previous path line, path line) of a step, the step covers lines after the first up to the second
+
+        Steps past the end of the layer map to the last path. Returns None
+        for step 0 or a layer without paths.
+        """
+        if step_lines is None:
+            step_lines = self.stepLines(layer_num)
+        if step <= 0 or not len(step_lines):
+            return None
+        step = min(step, len(step_lines))
+        line = int(step_lines[step - 1])
+        previous = int(step_lines[step - 2]) if step > 1 else self.layer_index[layer_num][0] - 1
+        return previous, line
+
+    def isIndexed(self):
+        return self._offsets is not None
+
+    def __len__(self):
+        if self._offsets is not None:
+            return len(self._offsets) - 1
+        # 索引進行中：最後一個起點的行尚未確定結尾
+        counts = self._partial[1]
+        return counts[-1] - 1 if counts else 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.getLine(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("line index out of range")
+        return self.getLine(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.getLine(i)
+
+    def _lineBounds(self, index):
+        """單行的 (起始, 結束) 位置"""
+        if self._offsets is not None:
+            return int(self._offsets[index]), int(self._offsets[index + 1])
+        parts, counts = self._partial[0], self._partial[1]
+        part = bisect.bisect_right(counts, index)
+        local = index - counts[part - 1] if part else index
+        start = int(parts[part][local])
+        if local + 1 < len(parts[part]):
+            return start, int(parts[part][local + 1])
+        return start, int(parts[part + 1][0])
+
+    def getLine(self, index):
+        """取得單行，換行方式與文字模式的 readlines() 相同"""
+        start, end = self._lineBounds(index)
+        return self._readRange(start, end).replace("\r\n", "\n")
+
+    def getLines(self, first_line, last_line):
+        """Lines first_line to last_line (inclusive) read at once, without newlines"""
+        start, end = self._lineBounds(first_line)[0], self._lineBounds(last_line)[1]
+        lines = self._readRange(start, end).replace("\r\n", "\n").split("\n")
+        if lines and not lines[-1]:
+            lines.pop()
+        return lines
+
+    def rangeFingerprint(self, start, end):
+        """CRC32 of the UTF-8 text in [start, end)"""
+        return zlib.crc32(self._readRange(start, end).encode("utf-8"))
+
+    def commandLines(self, first_line, last_line):
+        """Line numbers in [first_line, last_line] whose stripped text starts with G or M"""
+        if last_line < first_line:
+            return numpy.zeros(0, dtype=numpy.int64)
+
+        # 以行首字元向量化判斷，只有開頭是空白的行才解碼
+        first_codes = self._indexArray(self._first_codes, self._partial[2], numpy.uint8)[first_line:last_line + 1]
+        is_command = (first_codes == ord("G")) | (first_codes == ord("M"))
+        for i in numpy.flatnonzero(_AMBIGUOUS_FIRST_CODES[first_codes]):
+            is_command[i] = self.getLine(first_line + int(i)).strip()[:1] in ("G", "M")
+        return numpy.flatnonzero(is_command) + first_line
+
+    def commandCodes(self, first_line, last_line):
+        """Command code (commandCode()) of every line in [first_line, last_line], 0 for other lines"""
+        return self._indexArray(self._command_codes, self._partial[4], numpy.uint16)[first_line:last_line + 1]
+
+    def contentLines(self, first_line, last_line):
+        """Line numbers in [first_line, last_line] that are neither blank nor comments"""
+        if last_line < first_line:
+            return numpy.zeros(0, dtype=numpy.int64)
+        first_codes = self._indexArray(self._first_codes, self._partial[2], numpy.uint8)[first_line:last_line + 1]
+        is_content = (first_codes != ord(";")) & ~_AMBIGUOUS_FIRST_CODES[first_codes]
+        for i in numpy.flatnonzero(_AMBIGUOUS_FIRST_CODES[first_codes]):
+            text = self.getLine(first_line + int(i)).strip()
+            is_content[i] = bool(text) and not text.startswith(";")
+        return numpy.flatnonzero(is_content) + first_line
+
+    def lineAt(self, position):
+        """Line number containing a position of a finished index"""
+        return int(numpy.searchsorted(self._offsets, self._offsets.dtype.type(position), side="right")) - 1
+
+    def searchLines(self, pattern, flags=0, is_cancelled=None):
+        """Line numbers matching a regular expression, yielded as one array per segment in file order
+
+        Every line is reported once, even with several matches. Needs a
+        finished index.
+        """
+        regex = re.compile(pattern, flags | re.MULTILINE)
+        for segment_start, segment_end, codes, line_text in self.iterSegments():
+            del codes
+            if is_cancelled and is_cancelled():
+                raise LoadCancelled()
+            yield self._matchingLines(regex, line_text(0, segment_end - segment_start), segment_start)
+
+    def _matchingLines(self, regex, text, base, start=0, end=None):
+        """text[start:end] 內符合的行號，text 從位置 base 開始"""
+        end = len(text) if end is None else end
+        lines = []
+        position = start
+        while position < end:
+            match = regex.search(text, position, end)
+            if match is None or base + match.start() >= self._size:
+                break
+            line = self.lineAt(base + match.start())
+            lines.append(line)
+            # 從下一行繼續，同一行只回報一次
+            position = int(self._offsets[line + 1]) - base
+        return numpy.array(lines, dtype=numpy.int64)
+
+    def getMemoryUsage(self):
+        """索引陣列佔用的位元組數"""
+        if self._offsets is not None:
+            return self._offsets.nbytes + self._first_codes.nbytes + self._motion_lines.nbytes + self._command_codes.nbytes
+        parts, _, first_parts, motion_parts, code_parts = self._partial
+        return sum(part.nbytes for part in parts + first_parts + motion_parts + code_parts)
+
+    def getTextMemoryUsage(self):
+        """GCODE 文字佔用的位元組數；mmap 的檔案內容屬於系統的檔案快取，不計入"""
+        return 0
+
+    def getTextCacheMemoryUsage(self):
+        """releaseTextCache() 可釋放的位元組數"""
+        return 0
+
+    def releaseTextCache(self):
+        """Free text kept only to speed up reads, it is read again when needed"""
+
+    def close(self):
+        """釋放索引"""
+        self._offsets = numpy.zeros(1, dtype=numpy.uint32)
+        self._first_codes = numpy.zeros(0, dtype=numpy.uint8)
+        self._motion_lines = numpy.zeros(0, dtype=numpy.uint32)
+        self._command_codes = numpy.zeros(0, dtype=numpy.uint16)
+        self._partial = ([], [], [], [], [])
+        self.layer_index = {}
+        self._size = 0
+
+
+class GcodeLineStore(IndexedGcodeLines):
+    """Memory-mapped GCODE file, the file content is paged in by the OS"""
+
+    def __init__(self, file_path):
+        self._file = open(file_path, "rb")
+        super().__init__(os.fstat(self._file.fileno()).st_size)
+        self.file_path = file_path
+        # mmap 不接受空檔案
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._size else b""
+
+    def iterSegments(self, start=0, end=None):
+        """Segments of [start, end), both must be line starts or the end of the file"""
+        end = self._size if end is None else end
+        chunk_start = start
+        while chunk_start < end:
+            chunk_end = self._alignedChunkEnd(chunk_start, end)
+            chunk = numpy.frombuffer(self._buffer, dtype=numpy.uint8, count=chunk_end - chunk_start, offset=chunk_start)
+
+            def lineText(start, end, base=chunk_start):
+                return self._readRange(base + start, base + end)
+
+            yield chunk_start, chunk_end, chunk, lineText
+            del chunk
+            chunk_start = chunk_end
+
+    def mapSegments(self, scan, is_cancelled=None, workers=1):
+        """大檔案交給工作行程掃描，結果依檔案順序產生"""
+        if workers <= 1 or self._size < PARALLEL_INDEX_MIN_SIZE or isFrozen():
+            for scanned in super().mapSegments(scan, is_cancelled, workers):
+                yield scanned
+            return
+
+        executor = concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        pending = collections.deque()
+        try:
+            chunk_start = 0
+            while chunk_start < self._size:
+                chunk_end = self._alignedChunkEnd(chunk_start)
+                pending.append((chunk_start, chunk_end, self._submitRange(executor, scan, chunk_start, chunk_end)))
+                chunk_start = chunk_end
+                if len(pending) >= workers * _PARALLEL_QUEUE_DEPTH:
+                    yield self._nextScannedRange(scan, pending, is_cancelled)
+            while pending:
+                yield self._nextScannedRange(scan, pending, is_cancelled)
+        finally:
+            for _, _, future in pending:
+                if future is not None:
+                    future.cancel()
+            executor.shutdown(wait=False)
+
+    def _submitRange(self, executor, scan, chunk_start, chunk_end):
+        try:
+            return executor.submit(_scanFileRange, self.file_path, chunk_start, chunk_end, scan)
+        except concurrent.futures.process.BrokenProcessPool:
+            return None
+
+    def _nextScannedRange(self, scan, pending, is_cancelled):
+        """等待最前面的區塊完成，等待期間仍會檢查取消"""
+        chunk_start, chunk_end, future = pending[0]
+        while future is not None:
+            if is_cancelled and is_cancelled():
+                raise LoadCancelled()
+            done, _ = concurrent.futures.wait([future], timeout=_CANCEL_POLL_INTERVAL)
+            if done:
+                break
+        pending.popleft()
+        try:
+            if future is not None:
+                return chunk_start, chunk_end, future.result()
+        except concurrent.futures.process.BrokenProcessPool:
+            pass
+        # 工作行程無法啟動或意外結束時，在本行程掃描剩下的區塊
+        if is_cancelled and is_cancelled():
+            raise LoadCancelled()
+        return chunk_start, chunk_end, _scanFileRange(self.file_path, chunk_start, chunk_end, scan)
+
+    def _alignedChunkEnd(self, chunk_start, end=None):
+        """區塊結尾對齊到換行之後，讓每個區塊都只包含完整的行"""
+        end = self._size if end is None else end
+        target = chunk_start + SCAN_CHUNK_SIZE
+        if target >= end:
+            return end
+        newline = self._buffer.rfind(b"\n", chunk_start, target)
+        if newline < 0:
+            newline = self._buffer.find(b"\n", target, end)
+        return end if newline < 0 else newline + 1
+
+    def spliceIndex(self, previous, prefix_lines, suffix_lines, is_cancelled=None):
+        """Index a modified file by reusing the index of its previous version
+
+        The first prefix_lines and the last suffix_lines lines of previous
+        must be unchanged in this file, and every layer marker of previous
+        must start its own layer range. Only the lines in between are
+        scanned; the result is the same as buildIndex().
+        """
+        old_offsets, old_first_codes, old_motion_lines, old_command_codes, old_layer_index = previous.exportIndex()
+        old_line_count = len(old_offsets) - 1
+        suffix_start = old_line_count - suffix_lines
+        byte_shift = self._size - previous.getSize()
+        middle_start = int(old_offsets[prefix_lines])
+        middle_end = int(old_offsets[suffix_start]) + byte_shift
+        line_type = old_motion_lines.dtype.type
+
+        starts = [old_offsets[:prefix_lines].astype(numpy.int64)]
+        first_parts = [old_first_codes[:prefix_lines]]
+        code_parts = [old_command_codes[:prefix_lines]]
+        motion_parts = [old_motion_lines[:numpy.searchsorted(old_motion_lines, line_type(prefix_lines))].astype(numpy.int64)]
+        markers = sorted((first, layer_num) for layer_num, (first, _) in old_layer_index.items() if first < prefix_lines)
+
+        # 只掃描兩段沒變的行之間的內容
+        line_base = prefix_lines
+        for segment_start, segment_end, codes, line_text in self.iterSegments(middle_start, middle_end):
+            if is_cancelled and is_cancelled():
+                raise LoadCancelled()
+            newlines, first_codes, command_codes, motion_lines, segment_markers = _scanSegment(codes, line_text)
+            del codes
+            segment_starts = numpy.concatenate(([segment_start], newlines.astype(numpy.int64) + (segment_start + 1)))
+            segment_starts = segment_starts[segment_starts < segment_end]
+            starts.append(segment_starts)
+            first_parts.append(first_codes)
+            code_parts.append(command_codes)
+            motion_parts.append(motion_lines.astype(numpy.int64) + line_base)
+            markers.extend((line_base + local_line, layer_num) for local_line, layer_num in segment_markers)
+            line_base += len(segment_starts)
+
+        # 後段沿用舊索引，平移行號與位置
+        line_shift = line_base - suffix_start
+        starts.append(old_offsets[suffix_start:old_line_count].astype(numpy.int64) + byte_shift)
+        starts.append(numpy.array([self._size], dtype=numpy.int64))
+        first_parts.append(old_first_codes[suffix_start:])
+        code_parts.append(old_command_codes[suffix_start:])
+        motion_parts.append(old_motion_lines[numpy.searchsorted(old_motion_lines, line_type(suffix_start)):].astype(numpy.int64) + line_shift)
+        markers.extend(sorted((first + line_shift, layer_num) for layer_num, (first, _) in old_layer_index.items() if first >= suffix_start))
+
+        self._offsets = numpy.concatenate(starts).astype(self._offsets_dtype)
+        self._first_codes = numpy.concatenate(first_parts).astype(numpy.uint8)
+        self._motion_lines = numpy.concatenate(motion_parts).astype(self._offsets_dtype)
+        self._command_codes = numpy.concatenate(code_parts).astype(numpy.uint16)
+        self._partial = ([], [], [], [], [])
+        self.layer_index = _foldLayerMarkers(markers, len(self))
+
+    def searchLines(self, pattern, flags=0, is_cancelled=None):
+        """Search the mapped bytes directly, the pattern is matched as UTF-8"""
+        regex = re.compile(pattern.encode("utf-8"), flags | re.MULTILINE)
+        chunk_start = 0
+        while chunk_start < self._size:
+            if is_cancelled and is_cancelled():
+                raise LoadCancelled()
+            chunk_end = self._alignedChunkEnd(chunk_start)
+            yield self._matchingLines(regex, self._buffer, 0, chunk_start, chunk_end)
+            chunk_start = chunk_end
+
+    def rangeFingerprint(self, start, end):
+        """CRC32 of the bytes in [start, end)"""
+        with memoryview(self._buffer) as view, view[start:end] as part:
+            return zlib.crc32(part)
+
+    def readBytes(self, start, end):
+        return self._buffer[start:end]
+
+    def _readRange(self, start, end):
+        return self._buffer[start:end].decode("utf-8", errors="ignore")
+
+    def getLineBytes(self, index):
+        """取得單行的原始位元組"""
+        start, end = self._lineBounds(index)
+        return self._buffer[start:end]
+
+    def close(self):
+        """釋放 mmap 與檔案控制代碼"""
+        super().close()
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._buffer = b""
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+class GcodeGzipStore(IndexedGcodeLines):
+    """gzip-compressed GCODE file, streamed through the indexer and read through checkpoints
+
+    Offsets count uncompressed bytes. While the file is streamed, a copy
+    of the decompressor is kept every GZIP_CHECKPOINT_SPACING bytes; when
+    there would be more than MAX_GZIP_CHECKPOINTS, every other checkpoint
+    is dropped and the spacing doubles, so memory stays bounded for any
+    file size. A line is read by decompressing from the nearest checkpoint
+    before it, GZIP_BLOCK_SIZE bytes at a time into a small LRU of blocks.
+    After restoreIndex() the checkpoints are rebuilt by
+    prepareRandomAccess(), which only decompresses.
+    """
+
+    def __init__(self, file_path):
+        self._file = open(file_path, "rb")
+        self._file_size = os.fstat(self._file.fileno()).st_size
+        # 解壓縮後的大小要讀完才知道，先以 gzip 結尾記錄的大小（除以 4GB 的餘數）估計進度
+        self._file.seek(max(0, self._file_size - 4))
+        trailer = self._file.read(4)
+        super().__init__(int.from_bytes(trailer, "little") if len(trailer) == 4 else 0)
+        if self._file_size * _MAX_DEFLATE_RATIO >= 2 ** 32:
+            # 解壓縮後可能超過 4GB，索引完成後再視實際大小縮小
+            self._offsets_dtype = numpy.uint64
+        self.file_path = file_path
+        self._lock = threading.Lock()  # 隨機讀取共用檔案位置、游標與區塊快取
+        self._checkpoints = []  # [(解壓縮位置, 壓縮位置, decompressobj)]，依位置排序
+        self._checkpoint_positions = []
+        self._checkpoint_spacing = GZIP_CHECKPOINT_SPACING
+        self._checkpoints_ready = False
+        self._blocks = collections.OrderedDict()  # 區塊編號 -> 解壓縮的位元組
+        self._cursor = None  # 上次讀取停下的 (解壓縮位置, 壓縮位置, decompressobj, 已解壓縮未用完的資料)
+
+    def getFileSize(self):
+        return self._file_size
+
+    def _inflate(self, f, in_pos=0, decompressor=None):
+        """從壓縮位置 in_pos 起解壓縮，依序產生 (已讀取的壓縮位置, 解壓縮的資料, decompressobj)
+
+        Concatenated gzip members are decompressed one after another,
+        zero padding after the last member is ignored.
+        """
+        decompressor = decompressor or zlib.decompressobj(_GZIP_WBITS)
+        while True:
+            f.seek(in_pos)
+            data = f.read(_GZIP_READ_SIZE)
+            if not data:
+                if not decompressor.eof:
+                    raise EOFError("compressed file ended before the end-of-stream marker")
+                return
+            in_pos += len(data)
+            out = decompressor.decompress(data)
+            ended = False
+            while decompressor.eof and decompressor.unused_data:
+                rest = decompressor.unused_data
+                if not rest.strip(b"\0"):
+                    ended = True
+                    break
+                decompressor = zlib.decompressobj(_GZIP_WBITS)
+                out += decompressor.decompress(rest)
+            yield in_pos, out, decompressor
+            if ended:
+                return
+
+    def _addCheckpoint(self, out_pos, in_pos, decompressor):
+        """每隔 _checkpoint_spacing 保留一份解壓縮器，超過上限時減半並加倍間隔"""
+        if self._checkpoint_positions and out_pos - self._checkpoint_positions[-1] < self._checkpoint_spacing:
+            return
+        with self._lock:
+            self._checkpoints.append((out_pos, in_pos, decompressor.copy()))
+            if len(self._checkpoints) > MAX_GZIP_CHECKPOINTS:
+                self._checkpoints = self._checkpoints[::2]
+                self._checkpoint_spacing *= 2
+            self._checkpoint_positions = [checkpoint[0] for checkpoint in self._checkpoints]
+
+    def _stream(self, is_cancelled=None, progress_callback=None):
+        """解壓縮整個檔案，依序產生 (解壓縮位置, 資料, 已讀取的壓縮位置)；第一次讀完時建立檢查點"""
+        record = not self._checkpoints_ready
+        if record:
+            with self._lock:
+                self._checkpoints, self._checkpoint_positions = [], []
+                self._checkpoint_spacing = GZIP_CHECKPOINT_SPACING
+            self._addCheckpoint(0, 0, zlib.decompressobj(_GZIP_WBITS))
+        out_pos = 0
+        # 與隨機讀取分開使用自己的檔案控制代碼
+        with open(self.file_path, "rb") as f:
+            for in_pos, data, decompressor in self._inflate(f):
+                if is_cancelled and is_cancelled():
+                    raise LoadCancelled()
+                yield out_pos, data, in_pos
+                out_pos += len(data)
+                if record:
+                    self._addCheckpoint(out_pos, in_pos, decompressor)
+                if progress_callback:
+                    progress_callback(in_pos / max(self._file_size, 1))
+        self._checkpoints_ready = record or self._checkpoints_ready
+        self._size = out_pos
+
+    def _byteSegments(self, is_cancelled=None):
+        """依序產生 (起始位置, 位元組)，每個區段約 SCAN_CHUNK_SIZE 且只包含完整的行"""
+        pieces = []
+        pending = 0
+        segment_start = 0
+        for out_pos, data, in_pos in self._stream(is_cancelled):
+            pieces.append(data)
+            pending += len(data)
+            if pending < SCAN_CHUNK_SIZE:
+                continue
+            buffer = b"".join(pieces)
+            cut = buffer.rfind(b"\n") + 1
+            if not cut:
+                pieces = [buffer]
+                continue
+            if self._offsets is None:
+                # 索引進行中：依已讀取的壓縮資料比例估計解壓縮後的大小，讓進度接近實際
+                self._size = max(out_pos + len(data), (out_pos + len(data)) * self._file_size // max(in_pos, 1))
+            yield segment_start, buffer[:cut]
+            segment_start += cut
+            pieces = [buffer[cut:]]
+            pending = len(pieces[0])
+        buffer = b"".join(pieces)
+        if buffer:
+            yield segment_start, buffer
+
+    def iterSegments(self):
+        for segment_start, segment in self._byteSegments():
+            codes = numpy.frombuffer(segment, dtype=numpy.uint8)
+
+            def lineText(start, end, segment=segment):
+                return segment[start:end].decode("utf-8", errors="ignore")
+
+            yield segment_start, segment_start + len(segment), codes, lineText
+            del codes
+
+    def buildIndex(self, progress_callback=None, is_cancelled=None, workers=1):
+        """Stream the file once, building the line index and the checkpoints; always one process"""
+        super().buildIndex(progress_callback, is_cancelled, 1)
+        self._shrinkIndex()
+
+    def _shrinkIndex(self):
+        """實際大小不到 4GB 時改用 uint32 保存行位置"""
+        if self._offsets_dtype != numpy.uint32 and self._size < 2 ** 32:
+            self._offsets_dtype = numpy.uint32
+            self._offsets = self._offsets.astype(numpy.uint32)
+            self._motion_lines = self._motion_lines.astype(numpy.uint32)
+
+    def restoreIndex(self, offsets, first_codes, motion_lines, command_codes, layer_index):
+        # 解壓縮後的大小由索引得知，檔案本身已由快取的 identity 確認
+        self._size = int(offsets[-1]) if len(offsets) else 0
+        self._offsets_dtype = numpy.uint32 if self._size < 2 ** 32 else numpy.uint64
+        super().restoreIndex(offsets, first_codes, motion_lines, command_codes, layer_index)
+
+    def prepareRandomAccess(self, progress_callback=None, is_cancelled=None):
+        """Rebuild the checkpoints after restoreIndex(), one decompression pass"""
+        if self._checkpoints_ready:
+            return
+        size = self._size
+        for _ in self._stream(is_cancelled, progress_callback):
+            pass
+        if self._size != size:
+            raise ValueError("index does not match the GCODE content")
+
+    def searchLines(self, pattern, flags=0, is_cancelled=None):
+        """Search the decompressed bytes, the pattern is matched as UTF-8"""
+        regex = re.compile(pattern.encode("utf-8"), flags | re.MULTILINE)
+        for segment_start, segment in self._byteSegments(is_cancelled):
+            yield self._matchingLines(regex, segment, segment_start)
+
+    def _block(self, block):
+        """解壓縮後第 block 個 GZIP_BLOCK_SIZE 區塊，從最近的檢查點或上次的游標繼續解壓縮"""
+        data = self._blocks.get(block)
+        if data is not None:
+            self._blocks.move_to_end(block)
+            return data
+        target = block * GZIP_BLOCK_SIZE
+        checkpoint = self._checkpoints[bisect.bisect_right(self._checkpoint_positions, target) - 1]
+        if self._cursor is not None and checkpoint[0] <= self._cursor[0] <= target:
+            out_pos, in_pos, decompressor, leftover = self._cursor
+        else:
+            out_pos, in_pos, decompressor = checkpoint
+            decompressor, leftover = decompressor.copy(), b""
+        self._cursor = None
+
+        buffer = bytearray(leftover)
+        for in_pos, data, decompressor in self._inflate(self._file, in_pos, decompressor):
+            buffer += data
+            if out_pos < target:
+                skip = min(len(buffer), target - out_pos)
+                del buffer[:skip]
+                out_pos += skip
+            while out_pos >= target and len(buffer) >= GZIP_BLOCK_SIZE:
+                self._storeBlock(out_pos // GZIP_BLOCK_SIZE, bytes(buffer[:GZIP_BLOCK_SIZE]))
+                del buffer[:GZIP_BLOCK_SIZE]
+                out_pos += GZIP_BLOCK_SIZE
+            if out_pos > target:
+                # 下一次讀取通常是接下來的區塊，從這裡繼續
+                self._cursor = (out_pos, in_pos, decompressor, bytes(buffer))
+                return self._blocks[block]
+        # 最後一個不完整的區塊
+        if out_pos == target:
+            self._storeBlock(block, bytes(buffer))
+        return self._blocks.get(block, b"")
+
+    def _storeBlock(self, block, data):
+        self._blocks[block] = data
+        self._blocks.move_to_end(block)
+        while len(self._blocks) > GZIP_BLOCK_CACHE_SIZE:
+            self._blocks.popitem(last=False)
+
+    def readBytes(self, start, end):
+        with self._lock:
+            if not self._checkpoints:
+                raise ValueError("no checkpoints, call prepareRandomAccess() first")
+            pieces = []
+            while start < end:
+                block = start // GZIP_BLOCK_SIZE
+                block_start = block * GZIP_BLOCK_SIZE
+                data = self._block(block)
+                if not data:
+                    break
+                pieces.append(data[start - block_start:end - block_start])
+                start = block_start + len(data)
+                if len(data) < GZIP_BLOCK_SIZE:
+                    break
+            return pieces[0] if len(pieces) == 1 else b"".join(pieces)
+
+    def _readRange(self, start, end):
+        return self.readBytes(start, end).decode("utf-8", errors="ignore")
+
+    def rangeFingerprint(self, start, end):
+        return zlib.crc32(self.readBytes(start, end))
+
+    def getMemoryUsage(self):
+        """索引陣列與檢查點（估計值）的位元組數"""
+        return super().getMemoryUsage() + len(self._checkpoints) * _GZIP_CHECKPOINT_BYTES
+
+    def getTextCacheMemoryUsage(self):
+        """解壓縮區塊與游標的位元組數"""
+        cursor = self._cursor
+        return sum(len(data) for data in list(self._blocks.values())) + (len(cursor[3]) if cursor is not None else 0)
+
+    def releaseTextCache(self):
+        with self._lock:
+            self._blocks.clear()
+            self._cursor = None
+
+    def close(self):
+        """釋放檢查點、區塊與檔案控制代碼"""
+        super().close()
+        with self._lock:
+            self._checkpoints, self._checkpoint_positions = [], []
+            self._checkpoints_ready = False
+            self._blocks.clear()
+            self._cursor = None
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+class GcodeSliceStore(IndexedGcodeLines):
+    """GCODE chunks of the current slice (scene.gcode_dict), indexed in place
+
+    The chunk strings are shared with Cura and never joined into one string.
+    Offsets count characters across all chunks.
+    """
+
+    def __init__(self, gcode_list, display_name="Current slice"):
+        # 只保留字串的參考；Cura 重新切片時會換成新的 list
+        self._chunks = [chunk for chunk in gcode_list if chunk]
+        self._chunk_starts = numpy.zeros(len(self._chunks) + 1, dtype=numpy.int64)
+        self._chunk_starts[1:] = numpy.cumsum([len(chunk) for chunk in self._chunks], dtype=numpy.int64)
+        super().__init__(int(self._chunk_starts[-1]))
+        self._display_name = display_name
+
+    def getDisplayName(self):
+        return self._display_name
+
+    def getChunks(self):
+        return self._chunks
+
+    def getTextMemoryUsage(self):
+        """chunk 的字元數，GCODE 幾乎都是 ASCII，約等於位元組數"""
+        return int(self._chunk_starts[-1])
+
+    def iterSegments(self):
+        carry = ""
+        carry_start = 0
+        last = len(self._chunks) - 1
+        for i, chunk in enumerate(self._chunks):
+            text = carry + chunk if carry else chunk
+            segment_start = carry_start if carry else int(self._chunk_starts[i])
+            # 區段必須以完整的行結束，沒結束的行併入下一個 chunk
+            cut = len(text) if i == last else text.rfind("\n") + 1
+            if not cut:
+                carry, carry_start = text, segment_start
+                continue
+            segment = text if cut == len(text) else text[:cut]
+            carry, carry_start = text[cut:], segment_start + cut
+            try:
+                # GCODE 幾乎都是 ASCII，每個字元一個位元組
+                codes = numpy.frombuffer(segment.encode("latin-1"), dtype=numpy.uint8)
+            except UnicodeEncodeError:
+                codes = numpy.frombuffer(segment.encode("utf-32-le"), dtype=numpy.uint32)
+
+            def lineText(start, end, segment=segment):
+                return segment[start:end]
+
+            yield segment_start, segment_start + cut, codes, lineText
+            del codes
+
+    def _readRange(self, start, end):
+        if end <= start:
+            return ""
+        chunk = bisect.bisect_right(self._chunk_starts, start) - 1
+        pieces = []
+        while start < end:
+            chunk_start = int(self._chunk_starts[chunk])
+            chunk_end = int(self._chunk_starts[chunk + 1])
+            pieces.append(self._chunks[chunk][start - chunk_start:min(end, chunk_end) - chunk_start])
+            start = chunk_end
+            chunk += 1
+        return pieces[0] if len(pieces) == 1 else "".join(pieces)
+
+    def close(self):
+        """釋放索引與 chunk 的參考"""
+        super().close()
+        self._chunks = []
+        self._chunk_starts = numpy.zeros(1, dtype=numpy.int64)
@@ -0,0 +1,331 @@
+import numpy
+from numpy.lib.stride_tricks import sliding_window_view
+
+# 沒有落在任何圖層內的移動指令（開始/結束 GCODE）
+NO_LAYER = numpy.iinfo(numpy.int32).min
+
+# 向量化解析的數字長度上限（含正負號與小數點），更長的數字逐一解析
+MAX_NUMBER_LENGTH = 16
+
+# 參數字母對應的欄位：X, Y, Z, E, F
+_PARAMETER_COLUMNS = numpy.full(256, -1, dtype=numpy.int8)
+for _column, _letter in enumerate(b"XYZEF"):
+    _PARAMETER_COLUMNS[_letter] = _column
+del _column, _letter
+
+# 數字與小數點
+_IS_NUMBER = numpy.zeros(256, dtype=bool)
+_IS_NUMBER[48:58] = True
+_IS_NUMBER[46] = True
+
+
+def _toFloat(text):
+    try:
+        return float(text)
+    except ValueError:
+        return numpy.nan
+
+
+def _parseNumbers(codes, positions):
+    """Vectorized parse of the numbers starting at positions, NaN when there is no number
+
+    Each number is cut out into a fixed-width byte string and the whole
+    array is converted by NumPy at once.
+    """
+    width = MAX_NUMBER_LENGTH
+    padded = numpy.concatenate((codes, numpy.zeros(width, dtype=numpy.uint8)))
+    windows = sliding_window_view(padded, width)[positions]
+
+    # 數字到第一個非數字字元為止；正負號只會出現在第一個字元
+    is_number = ((windows - 48) <= 9) | (windows == 46)
+    has_sign = (windows[:, 0] == 45) | (windows[:, 0] == 43)
+    is_number[:, 0] |= has_sign
+    too_long = numpy.flatnonzero(is_number.all(axis=1))
+    is_number[:, -1] = False
+    lengths = is_number.argmin(axis=1)
+    windows *= numpy.arange(width) < lengths[:, None]
+
+    # 沒有數字（例如 "X"、"X-"）時視為沒有參數
+    windows[lengths <= has_sign, :3] = numpy.frombuffer(b"nan", dtype=numpy.uint8)
+    strings = windows.view("S{}".format(width)).ravel()
+    try:
+        values = strings.astype(numpy.float64)
+    except ValueError:
+        # 格式錯誤的數字（例如 "1.2.3"）很少見，逐一轉換
+        values = numpy.array([_toFloat(text) for text in strings], dtype=numpy.float64)
+    for i in too_long:
+        start = int(positions[i])
+        end = start + 1
+        while end < len(codes) and _IS_NUMBER[codes[end]]:
+            end += 1
+        values[i] = _toFloat(codes[start:end].tobytes())
+    return values
+
+
+class _SegmentMoves:
+    """Moves and modal events found in one segment, line numbers are relative to the segment until shifted"""
+
+    def __init__(self):
+        self.move_lines = None
+        self.move_types = None
+        self.values = None  # (moves, 5) X Y Z E F, NaN when missing
+        self.reset_lines = None  # G92 with E
+        self.reset_values = None
+        self.mode_lines = None  # M82 / M83
+        self.mode_relative = None
+        self.type_lines = []  # ;TYPE: markers
+        self.type_names = []
+        self.newline_count = 0
+
+    def shift(self, line_base):
+        """把區段內的相對行號換成檔案中的行號"""
+        self.move_lines = self.move_lines + line_base
+        self.reset_lines = self.reset_lines + line_base
+        self.mode_lines = self.mode_lines + line_base
+        self.type_lines = [line + line_base for line in self.type_lines]
+
+
+def _scanSegment(codes, line_text):
+    """Tokenize every G0-G3, G92, M82/M83 and ;TYPE: line of a segment
+
+    Runs in worker processes for large files, so it only uses the segment;
+    the modal state is carried across segments by _MoveTableBuilder.
+    """
+    if codes.dtype != numpy.uint8:
+        codes = numpy.minimum(codes, 255).astype(numpy.uint8)
+    segment_size = len(codes)
+    result = _SegmentMoves()
+    newlines = numpy.flatnonzero(codes == 10)
+    starts = numpy.concatenate(([0], newlines + 1))
+    starts = starts[starts < segment_size]
+    ends = numpy.append(starts[1:], segment_size)
+
+    # 指令開始的位置；行首有空白的行很少見，逐行略過空白
+    command_starts = starts.copy()
+    first = codes[starts]
+    for line in numpy.flatnonzero((first == 32) | (first == 9)):
+        text = line_text(int(starts[line]), int(ends[line]))
+        command_starts[line] += len(text) - len(text.lstrip(" \t"))
+
+    def codeAt(position):
+        index = command_starts + position
+        return numpy.where(index < ends, codes[numpy.minimum(index, segment_size - 1)], 0)
+
+    c0, c1, c2, c3 = codeAt(0), codeAt(1), codeAt(2), codeAt(3)
+    is_code_end2 = ~_IS_NUMBER[c2]
+    is_code_end3 = ~_IS_NUMBER[c3]
+    short_move = (c0 == 71) & (c1 >= 48) & (c1 <= 51) & is_code_end2
+    long_move = (c0 == 71) & (c1 == 48) & (c2 >= 48) & (c2 <= 51) & is_code_end3
+    is_move = short_move | long_move
+    is_reset = (c0 == 71) & (c1 == 57) & (c2 == 50) & is_code_end3
+    is_mode = (c0 == 77) & (c1 == 56) & ((c2 == 50) | (c2 == 51)) & is_code_end3
+
+    # 參數從指令代碼之後開始，到註解（;）之前結束
+    parameter_start = command_starts + numpy.where(long_move | is_reset, 3, 2)
+    semicolons = numpy.append(numpy.flatnonzero(codes == 59), segment_size)
+    comment_start = numpy.minimum(semicolons[numpy.searchsorted(semicolons, starts)], ends)
+
+    letter_positions = numpy.flatnonzero(((codes >= 88) & (codes <= 90)) | (codes == 69) | (codes == 70))
+    letter_lines = numpy.searchsorted(starts, letter_positions, side="right") - 1
+    has_parameters = is_move | is_reset
+    keep = (has_parameters[letter_lines] & (letter_positions >= parameter_start[letter_lines]) &
+            (letter_positions < comment_start[letter_lines]))
+    letter_positions, letter_lines = letter_positions[keep], letter_lines[keep]
+    letter_columns = _PARAMETER_COLUMNS[codes[letter_positions]]
+    letter_values = _parseNumbers(codes, letter_positions + 1)
+
+    # 只為移動與 G92 行配置參數表
+    parameter_lines = numpy.flatnonzero(has_parameters)
+    values = numpy.full((len(parameter_lines), 5), numpy.nan)
+    # 同一行重複的參數以最後一個為準，與韌體相同；沒有數值的參數忽略
+    has_value = ~numpy.isnan(letter_values)
+    rows = numpy.searchsorted(parameter_lines, letter_lines[has_value])
+    values[rows, letter_columns[has_value]] = letter_values[has_value]
+
+    move_rows = is_move[parameter_lines]
+    move_lines = parameter_lines[move_rows]
+    result.move_lines = move_lines
+    result.move_types = (numpy.where(short_move, c1, c2)[move_lines] - 48).astype(numpy.uint8)
+    result.values = values[move_rows]
+
+    reset_values = values[~move_rows, 3]
+    has_e = ~numpy.isnan(reset_values)
+    result.reset_lines = parameter_lines[~move_rows][has_e]
+    result.reset_values = reset_values[has_e]
+
+    mode_lines = numpy.flatnonzero(is_mode)
+    result.mode_lines = mode_lines
+    result.mode_relative = c2[mode_lines] == 51
+
+    # 特徵類型，例如 ";TYPE:WALL-OUTER"
+    for line in numpy.flatnonzero((c0 == 59) & (c1 == 84)):
+        text = line_text(int(command_starts[line]), int(ends[line])).strip()
+        if text.startswith(";TYPE:"):
+            result.type_lines.append(int(line))
+            result.type_names.append(text[6:].strip())
+    result.newline_count = len(newlines)
+    return result
+
+
+def _forwardFill(values, initial):
+    """把 NaN 換成前一個有值的元素，開頭的 NaN 換成 initial"""
+    has_value = ~numpy.isnan(values)
+    last = numpy.maximum.accumulate(numpy.where(has_value, numpy.arange(len(values)), -1))
+    return numpy.where(last >= 0, values[numpy.maximum(last, 0)], initial)
+
+
+def _lastBefore(event_lines, lines):
+    """每個行號之前（含）最後一個事件的索引，沒有時為 -1"""
+    return numpy.searchsorted(event_lines, lines, side="right") - 1
+
+
+class _MoveTableBuilder:
+    """Turns scanned segments into table columns, carrying the modal state across segments"""
+
+    def __init__(self, layer_index):
+        self.position = [0.0, 0.0, 0.0, 0.0]  # X Y Z F
+        self.e_position = 0.0
+        self.relative_e = False
+        self.feature = 0
+        self.feature_names = [""]
+        self._feature_codes = {}
+        self.columns = {column: [] for column in GcodeMoveTable.COLUMNS}
+
+        # 圖層：依圖層索引的範圍（與預覽顯示的範圍相同）
+        ranges = sorted((first, last, layer_num) for layer_num, (first, last) in layer_index.items())
+        self._layer_firsts = numpy.array([r[0] for r in ranges], dtype=numpy.int64)
+        self._layer_lasts = numpy.array([r[1] for r in ranges], dtype=numpy.int64)
+        self._layer_numbers = numpy.array([r[2] for r in ranges], dtype=numpy.int32)
+
+    def addSegment(self, segment):
+        lines = segment.move_lines
+        values = segment.values
+        columns = self.columns
+        columns["line"].append(lines)
+        columns["move_type"].append(segment.move_types)
+        for name, column in (("x", 0), ("y", 1), ("z", 2), ("f", 4)):
+            filled = _forwardFill(values[:, column], self.position[min(column, 3)])
+            if len(filled):
+                self.position[min(column, 3)] = filled[-1]
+            columns[name].append(filled.astype(numpy.float32))
+        columns["e"].append(self._extrusion(segment))
+        columns["feature"].append(self._features(segment))
+        columns["layer"].append(self._layers(lines))
+
+    def _extrusion(self, segment):
+        """每個移動的擠出量；絕對模式為與前一個 E 位置的差，相對模式為 E 參數本身"""
+        move_e = segment.values[:, 3]
+        has_e = ~numpy.isnan(move_e)
+        e_lines = segment.move_lines[has_e]
+        # 合併帶 E 的移動與 G92 E 事件，依行號排序（穩定排序，移動之間維持原本順序）
+        event_lines = numpy.concatenate((e_lines, segment.reset_lines))
+        event_values = numpy.concatenate((move_e[has_e], segment.reset_values))
+        is_reset = numpy.concatenate((numpy.zeros(len(e_lines), dtype=bool), numpy.ones(len(segment.reset_lines), dtype=bool)))
+        order = numpy.argsort(event_lines, kind="stable")
+        event_lines, event_values, is_reset = event_lines[order], event_values[order], is_reset[order]
+
+        mode_index = _lastBefore(segment.mode_lines, event_lines)
+        relative = numpy.where(mode_index >= 0, segment.mode_relative[numpy.maximum(mode_index, 0)] if len(segment.mode_lines) else False, self.relative_e)
+
+        # E 位置：絕對值（G92 或絕對模式的移動）是錨點，之後加上相對模式的增量
+        anchor = is_reset | ~relative
+        cumulative = numpy.cumsum(numpy.where(anchor, 0.0, event_values))
+        last_anchor = numpy.maximum.accumulate(numpy.where(anchor, numpy.arange(len(anchor)), -1))
+        safe_anchor = numpy.maximum(last_anchor, 0)
+        base = numpy.where(last_anchor >= 0, event_values[safe_anchor] - cumulative[safe_anchor], self.e_position)
+        position = base + cumulative
+        previous = numpy.concatenate(([self.e_position], position[:-1]))
+
+        e = numpy.zeros(len(move_e), dtype=numpy.float32)
+        e[has_e] = (position - previous)[~is_reset]
+        if len(position):
+            self.e_position = float(position[-1])
+        if len(segment.mode_lines):
+            self.relative_e = bool(segment.mode_relative[-1])
+        return e
+
+    def _features(self, segment):
+        """每個移動取前一個 ;TYPE: 標記"""
+        codes = [self.feature]
+        for name in segment.type_names:
+            if name not in self._feature_codes and len(self.feature_names) < 256:
+                self._feature_codes[name] = len(self.feature_names)
+                self.feature_names.append(name)
+            codes.append(self._feature_codes.get(name, 0))
+        codes = numpy.array(codes, dtype=numpy.uint8)
+        self.feature = int(codes[-1])
+        return codes[_lastBefore(numpy.array(segment.type_lines, dtype=numpy.int64), segment.move_lines) + 1]
+
+    def _layers(self, lines):
+        range_index = _lastBefore(self._layer_firsts, lines)
+        if not len(self._layer_numbers):
+            return numpy.full(len(lines), NO_LAYER, dtype=numpy.int32)
+        safe_index = numpy.maximum(range_index, 0)
+        inside = (range_index >= 0) & (lines <= self._layer_lasts[safe_index])
+        return numpy.where(inside, self._layer_numbers[safe_index], NO_LAYER).astype(numpy.int32)
+
+    def build(self, line_dtype):
+        dtypes = {"line": line_dtype, "layer": numpy.int32, "move_type": numpy.uint8, "feature": numpy.uint8}
+        arrays = {}
+        for column, parts in self.columns.items():
+            dtype = dtypes.get(column, numpy.float32)
+            arrays[column] = numpy.concatenate(parts).astype(dtype, copy=False) if parts else numpy.zeros(0, dtype=dtype)
+            parts.clear()
+        return GcodeMoveTable(feature_names=self.feature_names, **arrays)
+
+
+class GcodeMoveTable:
+    """Columnar table of every G0-G3 move of an indexed GCODE, one row per move in file order
+
+    X, Y, Z and F hold the modal values after the move (absolute
+    positioning, 0 before the first value). E is the filament extruded by
+    the move, taking M82/M83 and G92 E into account (negative for
+    retractions). feature indexes feature_names, 0 means no ;TYPE: yet.
+    """
+
+    COLUMNS = ("line", "layer", "x", "y", "z", "e", "f", "move_type", "feature")
+
+    def __init__(self, line, layer, x, y, z, e, f, move_type, feature, feature_names):
+        self.line = line  # GCODE line number
+        self.layer = layer  # layer number, NO_LAYER outside any layer
+        self.x = x
+        self.y = y
+        self.z = z
+        self.e = e
+        self.f = f
+        self.move_type = move_type  # 0-3 for G0-G3
+        self.feature = feature
+        self.feature_names = feature_names
+
+    @classmethod
+    def fromLines(cls, gcode_lines, progress_callback=None, is_cancelled=None, workers=1):
+        """Parse all moves of an indexed IndexedGcodeLines in one pass
+
+        Stores that support it tokenize segments in up to `workers`
+        processes; the modal state is then carried across the segments in
+        file order, so the table is the same as with one.
+        """
+        builder = _MoveTableBuilder(gcode_lines.layer_index)
+        line_base = 0
+        size = max(gcode_lines.getSize(), 1)
+        for segment_start, segment_end, segment in gcode_lines.mapSegments(_scanSegment, is_cancelled, workers):
+            segment.shift(line_base)
+            builder.addSegment(segment)
+            line_base += segment.newline_count
+            if progress_callback:
+                progress_callback(segment_end / size)
+        return builder.build(numpy.uint32 if len(gcode_lines) < 2 ** 32 else numpy.uint64)
+
+    def __len__(self):
+        return len(self.line)
+
+    def rowsBetween(self, first_line, last_line):
+        """Row slice of the moves between two line numbers (inclusive)"""
+        line_type = self.line.dtype.type
+        first = int(numpy.searchsorted(self.line, line_type(max(first_line, 0)), side="left"))
+        last = int(numpy.searchsorted(self.line, line_type(max(last_line, -1) + 1), side="left"))
+        return slice(first, last)
+
+    def getMemoryUsage(self):
+        """所有欄位佔用的位元組數"""
+        return sum(getattr(self, column).nbytes for column in self.COLUMNS)
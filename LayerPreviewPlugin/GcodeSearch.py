@@ -0,0 +1,71 @@
+"""Command index, line filters and search over indexed GCODE lines, without Qt"""
+
+import re
+
+import numpy
+
+from .GcodeLineStore import commandCode, commandName
+
+# 搜尋結果的上限，超過時停止搜尋
+MAX_SEARCH_RESULTS = 100000
+
+# 圖層清單的篩選方式：(key, 顯示名稱, 指令名稱)；指令名稱為 None 的篩選另外處理
+VIEW_FILTERS = (
+    ("commands", "G/M commands", None),
+    ("content", "All lines without comments", None),
+    ("all", "All lines", None),
+    ("moves", "Moves (G0/G1)", ("G0", "G1")),
+    ("arcs", "Arcs (G2/G3)", ("G2", "G3")),
+    ("resets", "Extruder resets (G92)", ("G92",)),
+    ("temperature", "Temperature (M104/M109/M140/M190)", ("M104", "M109", "M140", "M190")),
+    ("fan", "Fan (M106/M107)", ("M106", "M107")),
+    ("tool", "Tool changes (T)", tuple("T{}".format(i) for i in range(16))),
+)
+DEFAULT_VIEW_FILTER = "commands"
+
+_FILTER_CODES = {key: numpy.array([commandCode(name) for name in names], dtype=numpy.uint16)
+                 for key, _, names in VIEW_FILTERS if names}
+
+
+def filterCodes(view_filter):
+    """Command codes shown by a VIEW_FILTERS key, None for the filters without a code list"""
+    return _FILTER_CODES.get(view_filter)
+
+
+class CommandIndex:
+    """Inverted index: command code -> line numbers in file order
+
+    Built from the per-line command codes of IndexedGcodeLines with one
+    stable sort, so the lines of every code stay sorted.
+    """
+
+    def __init__(self, command_codes):
+        order = numpy.argsort(command_codes, kind="stable")
+        sorted_codes = command_codes[order]
+        self._codes, self._starts = numpy.unique(sorted_codes, return_index=True)
+        self._ends = numpy.append(self._starts[1:], len(sorted_codes))
+        # 行號小於 4G 時以 uint32 保存
+        self._lines = order.astype(numpy.uint32 if len(order) < 2 ** 32 else numpy.uint64)
+
+    def lines(self, code):
+        """Line numbers of a command code, empty when it does not occur"""
+        i = int(numpy.searchsorted(self._codes, self._codes.dtype.type(code)))
+        if i >= len(self._codes) or self._codes[i] != code:
+            return self._lines[:0]
+        return self._lines[self._starts[i]:self._ends[i]]
+
+    def counts(self):
+        """{command name: number of lines}, in code order"""
+        return {commandName(int(code)): int(end - start)
+                for code, start, end in zip(self._codes, self._starts, self._ends) if code}
+
+    def getMemoryUsage(self):
+        return self._codes.nbytes + self._starts.nbytes + self._ends.nbytes + self._lines.nbytes
+
+
+def compileQuery(text, use_regex=False, ignore_case=True):
+    """(pattern, flags) for IndexedGcodeLines.searchLines(), raises re.error for an invalid regex"""
+    pattern = text if use_regex else re.escape(text)
+    flags = re.IGNORECASE if ignore_case else 0
+    re.compile(pattern, flags)
+    return pattern, flags
@@ -0,0 +1,73 @@
+import bisect
+import time
+
+# 停止捲動超過這段時間（秒）後，視為靜止，前後預取相同數量的圖層
+IDLE_INTERVAL = 0.4
+# 速度的指數平滑係數，越大越快反應方向/速度的改變
+SPEED_SMOOTHING = 0.5
+
+
+class PrefetchPlanner:
+    """Chooses the layers to prepare in the background from the recent layer changes
+
+    observe() is called with every shown layer; it keeps a smoothed speed
+    in layers per second, positive when scrubbing upwards. plan() returns
+    the neighbouring layers nearest first: min_ahead on both sides while
+    the slider is idle, and while scrubbing up to max_ahead in the
+    direction of travel (enough for lookahead seconds at the current
+    speed) but only behind layers against it.
+    """
+
+    def __init__(self, min_ahead=2, max_ahead=16, lookahead=0.5, behind=1, clock=time.monotonic):
+        self.min_ahead = min_ahead
+        self.max_ahead = max_ahead
+        self.lookahead = lookahead
+        self.behind = behind
+        self.speed = 0.0
+        self._clock = clock
+        self._last = None  # (時間, 圖層在 layer_numbers 中的位置)
+
+    def reset(self):
+        self.speed = 0.0
+        self._last = None
+
+    def observe(self, position, now=None):
+        """Record that the layer at position (index in the sorted layer numbers) is shown"""
+        now = self._clock() if now is None else now
+        if self._last is not None:
+            last_time, last_position = self._last
+            elapsed = now - last_time
+            if position == last_position:
+                if elapsed > IDLE_INTERVAL:
+                    self.speed = 0.0
+                return
+            if elapsed > IDLE_INTERVAL:
+                # 停頓後重新開始捲動，不沿用舊的速度
+                self.speed = 0.0
+            speed = (position - last_position) / max(elapsed, 1e-3)
+            self.speed = SPEED_SMOOTHING * speed + (1.0 - SPEED_SMOOTHING) * self.speed
+        self._last = (now, position)
+
+    def distances(self, now=None):
+        """(layers to prepare above, layers to prepare below)"""
+        now = self._clock() if now is None else now
+        if self._last is None or now - self._last[0] > IDLE_INTERVAL or self.speed == 0.0:
+            return self.min_ahead, self.min_ahead
+        ahead = int(min(self.max_ahead, max(self.min_ahead, abs(self.speed) * self.lookahead + 1)))
+        return (ahead, self.behind) if self.speed > 0 else (self.behind, ahead)
+
+    def plan(self, layer_numbers, layer_num, now=None):
+        """Layer numbers to prepare around layer_num, nearest first; layer_numbers is sorted"""
+        position = bisect.bisect_left(layer_numbers, layer_num)
+        if position >= len(layer_numbers) or layer_numbers[position] != layer_num:
+            return []
+        self.observe(position, now)
+        above, below = self.distances(now)
+        # 捲動方向的圖層排在前面
+        sides = ((1, above), (-1, below)) if above >= below else ((-1, below), (1, above))
+        planned = []
+        for distance in range(1, max(above, below) + 1):
+            for step, limit in sides:
+                if distance <= limit and 0 <= position + step * distance < len(layer_numbers):
+                    planned.append(layer_numbers[position + step * distance])
+        return planned
@@ -1,26 +1,567 @@
 from UM.Extension import Extension
 from UM.Logger import Logger
 from cura.CuraApplication import CuraApplication
-from PyQt5.QtCore import QTimer, pyqtSignal, Qt
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QFrame, QFileDialog, QMessageBox, QTextEdit, QScrollBar, QCheckBox
-from PyQt5.QtGui import QFont, QTextCursor
+from PyQt5.QtCore import QObject, QTimer, QThread, QFileSystemWatcher, QAbstractListModel, QModelIndex, pyqtSignal, Qt
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QFrame, QFileDialog, QMessageBox, QTableView, QHeaderView, QAbstractItemView, QAction, QApplication, QScrollBar, QCheckBox, QComboBox, QLineEdit, QPlainTextEdit
+from PyQt5.QtGui import QFont, QColor, QBrush
 import os
+import re
 import shutil
+import threading
+import time
 from datetime import datetime
 
+import numpy
+
+from .GcodeLineStore import GcodeSliceStore, LoadCancelled, openGcodeStore
+from .GcodeIndexCache import GcodeIndexCache
+from .GcodeEngine import GcodeEngine, INDEX_CACHE_DIR, DEFAULT_INDEX_CACHE_SIZE_MB
+from .LayerRenderCache import LayerRenderCache
+from .LayerPrefetch import PrefetchPlanner
+from .PlateIndexCache import PlateIndexCache
+from .MemoryBudget import MemoryBudget
+from .SliceStepCounts import SliceStepCounts
+from .GcodeCompare import LayerDiff
+from .TempGcodeStore import TempGcodeStore, TEMP_GCODE_DIR, DEFAULT_TEMP_GCODE_SIZE_MB, DEFAULT_TEMP_GCODE_MAX_AGE_DAYS
+from .Diagnostics import Diagnostics
+from .LayerStats import formatDuration
+from .GcodeSearch import VIEW_FILTERS, DEFAULT_VIEW_FILTER, MAX_SEARCH_RESULTS, compileQuery
+
+# Cura 偏好設定
+RENDER_CACHE_SIZE_PREFERENCE = "layer_preview/render_cache_size"  # 快取的圖層數
+DEFAULT_RENDER_CACHE_SIZE = 32
+PREFETCH_MEMORY_PREFERENCE = "layer_preview/prefetch_memory_mb"  # 快取與預取圖層資料的記憶體上限
+DEFAULT_PREFETCH_MEMORY_MB = 64
+PLATE_INDEX_MEMORY_PREFERENCE = "layer_preview/plate_index_memory_mb"  # 各列印平台切片索引的記憶體上限
+DEFAULT_PLATE_INDEX_MEMORY_MB = 256
+MEMORY_LIMIT_PREFERENCE = "layer_preview/memory_limit_mb"  # 預覽視窗全部記憶體用量的上限
+DEFAULT_MEMORY_LIMIT_MB = 1024
+INDEX_CACHE_SIZE_PREFERENCE = "layer_preview/index_cache_size_mb"  # 索引快取目錄的大小上限
+TEMP_GCODE_SIZE_PREFERENCE = "layer_preview/temp_gcode_size_mb"  # GCODE_temp 目錄的大小上限
+TEMP_GCODE_AGE_PREFERENCE = "layer_preview/temp_gcode_max_age_days"  # 暫存檔的保留天數，0 表示不限
+VERBOSE_LOGGING_PREFERENCE = "layer_preview/verbose_logging"  # 每次更新都寫入除錯訊息
+
+# 診斷面板開啟時的更新間隔（毫秒）
+DIAGNOSTICS_REFRESH_INTERVAL = 1000
+
+# 預覽位置的更新最多每個畫格處理一次（毫秒），只處理最新的圖層/步驟
+FRAME_INTERVAL = 16
+# 每次更新的時間預算（秒），超過時延後狀態列等文字的更新
+FRAME_BUDGET = 0.010
+# 停止捲動這段時間（毫秒）後補上延後的文字
+SETTLE_INTERVAL = 150
+
+# 載入的檔案被修改後，等待這段時間（毫秒）沒有新的修改才重新索引
+FILE_CHANGE_DEBOUNCE_INTERVAL = 500
+
+# SimulationView 在圖層/路徑改變時發出的訊號
+SIMULATION_VIEW_SIGNALS = ("currentLayerNumChanged", "currentPathNumChanged", "maxLayersChanged", "maxPathsChanged")
+
+class LayerPreviewState(QObject):
+    """Preview position shared by the plugin and the preview window"""
+    
+    changed = pyqtSignal()
+    
+    def __init__(self):
+        super().__init__()
+        self.current_layer = 0
+        self.current_step = 0
+        self.total_layers = 0
+        self.total_steps = 0
+    
+    def update(self, current_layer, current_step, total_layers, total_steps):
+        """Store new values, emits changed only when something differs"""
+        values = (current_layer, current_step, total_layers, total_steps)
+        if values == (self.current_layer, self.current_step, self.total_layers, self.total_steps):
+            return False
+        self.current_layer, self.current_step, self.total_layers, self.total_steps = values
+        self.changed.emit()
+        return True
+
+class GcodeLoadThread(QThread):
+    """Index GCODE lines (a file or the current slice) in the background"""
+    
+    progressChanged = pyqtSignal(int)  # percent
+    loadFinished = pyqtSignal(object)  # GcodeEngine with a finished index
+    loadFailed = pyqtSignal(str)
+    loadCancelled = pyqtSignal()
+    
+    def __init__(self, store, index_cache=None, previous=None, parent=None):
+        super().__init__(parent)
+        # 行儲存在 GUI 執行緒建立，索引期間介面就能讀取已完成的圖層
+        self.store = store
+        self.engine = GcodeEngine(store, index_cache, Logger.log)
+        self.previous = previous  # GcodeEngine of the previous version of the file, for incremental indexing
+        self.file_path = store.file_path  # None for the current slice
+        self.plate = None  # (build plate, gcode list, chunk count) when indexing a slice
+        self.progress = 0
+        self._cancel_event = threading.Event()
+    
+    def cancel(self):
+        """Request cancellation, the thread stops before its next chunk"""
+        self._cancel_event.set()
+    
+    def isCancelled(self):
+        return self._cancel_event.is_set()
+    
+    @property
+    def from_cache(self):
+        """True when the index was restored from the GcodeIndexCache"""
+        return self.engine.from_cache
+    
+    def _reportProgress(self, fraction):
+        percent = int(fraction * 100)
+        if percent != self.progress:
+            self.progress = percent
+            self.progressChanged.emit(percent)
+    
+    def run(self):
+        try:
+            self.engine.load(self._reportProgress, self._cancel_event.is_set, self.previous)
+            self.loadFinished.emit(self.engine)
+        except LoadCancelled:
+            self.store.close()
+            self.loadCancelled.emit()
+        except Exception as e:
+            self.store.close()
+            self.loadFailed.emit(str(e))
+
+class LayerStatsThread(QThread):
+    """Compute the per-layer statistics of a loaded GcodeEngine in the background"""
+    
+    statsFinished = pyqtSignal(object)  # LayerStats
+    statsFailed = pyqtSignal(str)
+    
+    def __init__(self, engine, parent=None):
+        super().__init__(parent)
+        self.engine = engine
+        self.elapsed = 0.0
+        self._cancel_event = threading.Event()
+    
+    def cancel(self):
+        self._cancel_event.set()
+    
+    def run(self):
+        started = time.perf_counter()
+        try:
+            stats = self.engine.buildLayerStats(None, self._cancel_event.is_set)
+            self.elapsed = time.perf_counter() - started
+            self.statsFinished.emit(stats)
+        except LoadCancelled:
+            pass
+        except Exception as e:
+            self.statsFailed.emit(str(e))
+
+class LayerPrefetchThread(QThread):
+    """Prepare the render data of neighbouring layers in the background
+    
+    One thread serves one engine and view filter. schedule() replaces the
+    layers still waiting; each prepared layer is emitted on its own and
+    put into the render cache by the GUI thread. A schedule() round stops
+    after max_bytes of render data.
+    """
+    
+    layerPrepared = pyqtSignal(int, object, float)  # 圖層編號, (指令行號, 路徑行號), 秒數
+    prefetchFailed = pyqtSignal(str)
+    
+    def __init__(self, engine, view_filter, max_bytes, parent=None):
+        super().__init__(parent)
+        self.engine = engine
+        self.view_filter = view_filter
+        self.max_bytes = max_bytes
+        self._pending = []
+        self._round_bytes = 0
+        self._condition = threading.Condition()
+        self._cancel_event = threading.Event()
+    
+    def schedule(self, layers):
+        with self._condition:
+            self._pending = list(layers)
+            self._round_bytes = 0
+            self._condition.notify()
+    
+    def cancel(self):
+        self._cancel_event.set()
+        with self._condition:
+            self._pending = []
+            self._condition.notify()
+    
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._cancel_event.is_set():
+                    self._condition.wait()
+                if self._cancel_event.is_set():
+                    return
+                layer_num = self._pending.pop(0)
+            started = time.perf_counter()
+            try:
+                render_data = (self.engine.filteredLines(layer_num, self.view_filter), self.engine.stepLines(layer_num))
+            except Exception as e:
+                self.prefetchFailed.emit(str(e))
+                return
+            with self._condition:
+                self._round_bytes += render_data[0].nbytes + render_data[1].nbytes
+                if self._round_bytes >= self.max_bytes:
+                    # 這一輪的記憶體用完，剩下的圖層等下次換層再排
+                    self._pending = []
+            self.layerPrepared.emit(layer_num, render_data, time.perf_counter() - started)
+
+class GcodeSearchThread(QThread):
+    """Search the loaded GCODE in the background, hits are streamed per chunk"""
+    
+    resultsFound = pyqtSignal(object)  # numpy array of line numbers
+    searchFinished = pyqtSignal(int)  # total number of hits
+    searchFailed = pyqtSignal(str)
+    
+    def __init__(self, engine, text, use_regex, parent=None):
+        super().__init__(parent)
+        self.engine = engine
+        self.text = text
+        self.use_regex = use_regex
+        self._cancel_event = threading.Event()
+    
+    def cancel(self):
+        self._cancel_event.set()
+    
+    def run(self):
+        total = 0
+        try:
+            for lines in self.engine.search(self.text, self.use_regex, True, self._cancel_event.is_set):
+                total += len(lines)
+                self.resultsFound.emit(lines)
+            self.searchFinished.emit(total)
+        except LoadCancelled:
+            pass
+        except Exception as e:
+            self.searchFailed.emit(str(e))
+
+class GcodeCompareThread(QThread):
+    """Open another GCODE file and find the layers that differ from the loaded engine"""
+    
+    compareFinished = pyqtSignal(object)  # LayerDiff
+    compareFailed = pyqtSignal(str)
+    
+    def __init__(self, engine, file_path, index_cache, parent=None):
+        super().__init__(parent)
+        self.engine = engine
+        self.file_path = file_path
+        self.elapsed = 0.0
+        self._index_cache = index_cache
+        self._cancel_event = threading.Event()
+    
+    def cancel(self):
+        self._cancel_event.set()
+    
+    def run(self):
+        started = time.perf_counter()
+        other = None
+        try:
+            other = GcodeEngine.openFile(self.file_path, self._index_cache, Logger.log, is_cancelled=self._cancel_event.is_set)
+            diff = LayerDiff(self.engine, other)
+            diff.compare(self._cancel_event.is_set)
+            self.elapsed = time.perf_counter() - started
+            self.compareFinished.emit(diff)
+        except LoadCancelled:
+            if other is not None:
+                other.close()
+        except Exception as e:
+            if other is not None:
+                other.close()
+            self.compareFailed.emit(str(e))
+
+class LineDiffThread(QThread):
+    """Compute the line diff of one changed layer in the background"""
+    
+    diffReady = pyqtSignal(int, object)  # layer number, unified diff lines
+    diffFailed = pyqtSignal(str)
+    
+    def __init__(self, layer_diff, layer_num, parent=None):
+        super().__init__(parent)
+        self.layer_diff = layer_diff
+        self.layer_num = layer_num
+    
+    def run(self):
+        try:
+            self.diffReady.emit(self.layer_num, self.layer_diff.lineDiff(self.layer_num))
+        except Exception as e:
+            self.diffFailed.emit(str(e))
+
+class GcodeSaveThread(QThread):
+    """Store the GCODE chunks of a slice in the TempGcodeStore and prune it in the background"""
+    
+    saveFinished = pyqtSignal(str, bool, int)  # file path, False when the slice was already saved, files pruned
+    saveFailed = pyqtSignal(str)
+    
+    def __init__(self, temp_store, gcode_list, keep=(), parent=None):
+        super().__init__(parent)
+        self.file_path = None
+        self.label_text = None  # GCODE path label while saving
+        self._temp_store = temp_store
+        self._gcode_list = list(gcode_list)
+        self._keep = list(keep)  # files that must survive pruning
+    
+    def run(self):
+        try:
+            self.file_path, created = self._temp_store.save(self._gcode_list)
+            self._gcode_list = []
+            pruned = self._temp_store.prune(self._keep + [self.file_path])
+            self.saveFinished.emit(self.file_path, created, len(pruned))
+        except Exception as e:
+            self.saveFailed.emit(str(e))
+
+class GcodeCommandModel(QAbstractListModel):
+    """GCODE commands of one layer, rows are only decoded when the view paints them"""
+    
+    HIGHLIGHT_BACKGROUND = QBrush(QColor("#ffff00"))
+    NORMAL_BACKGROUND = QBrush(QColor("#f0f0f0"))
+    NORMAL_FOREGROUND = QBrush(QColor("#666666"))
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._store = None
+        self._layer_num = None
+        self._line_numbers = []  # 每一列對應的 GCODE 行號
+        self._messages = []  # 沒有指令可顯示時的訊息列
+        self._highlight = (0, 0)  # 高亮的列範圍 [start, end)
+        self._bold_font = QFont()
+        self._bold_font.setBold(True)
+    
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._messages) if self._messages else len(self._line_numbers)
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        if self._messages:
+            return self._messages[row] if role == Qt.DisplayRole else None
+        
+        highlighted = self._highlight[0] <= row < self._highlight[1]
+        if role == Qt.DisplayRole:
+            line_number = int(self._line_numbers[row])
+            return "( Layer {} / Step {} ) {}".format(self._layer_num, line_number + 1, self._store[line_number].strip())
+        if role == Qt.BackgroundRole:
+            return self.HIGHLIGHT_BACKGROUND if highlighted else self.NORMAL_BACKGROUND
+        if role == Qt.ForegroundRole:
+            return None if highlighted else self.NORMAL_FOREGROUND
+        if role == Qt.FontRole:
+            return self._bold_font if highlighted else None
+        return None
+    
+    def rowRange(self, after_line, last_line):
+        """Rows [start, end) whose line numbers are in (after_line, last_line]"""
+        start = int(numpy.searchsorted(self._line_numbers, after_line, side="right"))
+        end = int(numpy.searchsorted(self._line_numbers, last_line, side="right"))
+        return start, end
+    
+    def isShowingLayer(self, store, layer_num):
+        return not self._messages and self._store is store and self._layer_num == layer_num
+    
+    def shownLayer(self):
+        """(store, layer number) of the rows, (None, None) while a message is shown"""
+        return self._store, self._layer_num
+    
+    def highlightRange(self):
+        return self._highlight
+    
+    def setLayer(self, store, layer_num, line_numbers):
+        """Show the given command lines of a layer"""
+        self.beginResetModel()
+        self._store = store
+        self._layer_num = layer_num
+        self._line_numbers = line_numbers
+        self._messages = []
+        self._highlight = (0, 0)
+        self.endResetModel()
+    
+    def setMessage(self, text):
+        """Replace the rows with a plain text message"""
+        self.beginResetModel()
+        self._store = None
+        self._layer_num = None
+        self._line_numbers = []
+        self._messages = text.split("\n")
+        self._highlight = (0, 0)
+        self.endResetModel()
+    
+    def setHighlight(self, start_row, end_row):
+        """Highlight rows [start_row, end_row), only the changed rows are repainted"""
+        old_start, old_end = self._highlight
+        if (start_row, end_row) == (old_start, old_end):
+            return
+        self._highlight = (start_row, end_row)
+        for first, last in ((old_start, old_end), (start_row, end_row)):
+            if last > first:
+                self.dataChanged.emit(self.index(first), self.index(last - 1))
+
+class SearchResultModel(QAbstractListModel):
+    """Line numbers found by a search, rows are only decoded when the view paints them"""
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._engine = None
+        self._lines = numpy.zeros(0, dtype=numpy.int64)
+    
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._lines)
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        line_number = int(self._lines[index.row()])
+        layer_num = self._engine.layerOfLine(line_number)
+        return "Layer {} / Line {}: {}".format("-" if layer_num is None else layer_num, line_number + 1,
+                                              self._engine.store.getLine(line_number).strip())
+    
+    def lineAt(self, row):
+        return int(self._lines[row])
+    
+    def reset(self, engine=None):
+        """Remove all rows, new hits will be read from engine"""
+        self.beginResetModel()
+        self._engine = engine
+        self._lines = numpy.zeros(0, dtype=numpy.int64)
+        self.endResetModel()
+    
+    def appendLines(self, lines):
+        if not len(lines):
+            return
+        count = len(self._lines)
+        self.beginInsertRows(QModelIndex(), count, count + len(lines) - 1)
+        self._lines = numpy.concatenate((self._lines, lines.astype(numpy.int64)))
+        self.endInsertRows()
+
 class LayerPreviewWidget(QWidget):
     """Layer Preview Window"""
     
-    def __init__(self):
+    def __init__(self, state, diagnostics=None):
         super().__init__()
-        self.gcode_lines = []  # Store GCODE lines
+        self._state = state  # LayerPreviewState pushed by the plugin
+        self._diagnostics = diagnostics or Diagnostics(Logger.log)  # timing counters shared with the plugin
+        self._load_started = None  # perf_counter() when the running load started
+        self.gcode_lines = []  # GCODE lines, an IndexedGcodeLines once a file or slice is loaded
+        self.layer_index = {}  # layer number -> (first line, last line)
+        self._engine = None  # GcodeEngine of the loaded GCODE lines
+        self._load_thread = None  # GcodeLoadThread while a file is being indexed
+        self._refresh_thread = None  # GcodeLoadThread re-indexing the loaded file after it changed on disk
+        self._stats_thread = None  # LayerStatsThread of the loaded engine
+        self._search_thread = None  # GcodeSearchThread of the running search
+        self._search_started = None
+        self._compare_thread = None  # GcodeCompareThread opening the compared file
+        self._layer_diff = None  # GcodeCompare.LayerDiff against the compared file
+        self._line_diff_thread = None  # LineDiffThread of the opened changed layer
+        self._view_filter = DEFAULT_VIEW_FILTER  # GcodeSearch.VIEW_FILTERS key of the layer list
+        self._refresh_pending = False  # the file changed again while it was being re-indexed
+        self._refresh_started = None
+        self._engine_stale = False  # the loaded file shrank on disk, its lines must not be read any more
+        self._stale_view = None  # _captureView() from before the stale file was hidden
+        self._save_threads = []  # GcodeSaveThread writing temp files
+        self._last_drawn = None  # (store, layer, step) currently shown
+        self._frame_started = 0.0  # perf_counter() of the last coalesced update
+        self._deferred_texts = {}  # QLabel -> text skipped because an update ran over FRAME_BUDGET
+        self._update_counts = {"processed": 0, "coalesced": 0, "deferred": 0}
+        self._render_cache = LayerRenderCache(self._readIntPreference(RENDER_CACHE_SIZE_PREFERENCE, DEFAULT_RENDER_CACHE_SIZE),
+                                              self._readPrefetchBytes())
+        self._prefetch_thread = None  # LayerPrefetchThread of the loaded engine and view filter
+        self._prefetch_layers = []  # sorted layer numbers of the prefetch thread's engine
+        self._prefetch_planner = PrefetchPlanner()
+        self._plate_indexes = PlateIndexCache(self._readPlateIndexBytes())
+        self._slice_step_counts = SliceStepCounts()  # per-layer steps of Cura's LayerData
+        self._step_counts_dirty = True  # the scene changed since the counts were checked
+        self._follow_plates = False  # the current slice is shown, follow the active build plate
+        self._shown_plate = None  # build plate of the shown (or loading) slice
+        self._index_cache = GcodeIndexCache(INDEX_CACHE_DIR, self._readIndexCacheBytes())
+        self._temp_store = TempGcodeStore(TEMP_GCODE_DIR, *self._readTempGcodeLimits())
+        self._pruneTempGcode()
+        # 超過上限時依序釋放：繪製快取、其他列印平台的索引、解壓縮區塊與指令索引
+        self._memory = MemoryBudget(self._readMemoryLimitBytes(), Logger.log)
+        self._memory.add("render cache", lambda: {"render": self._render_cache.getMemoryUsage()}, self._render_cache.release, 0)
+        self._memory.add("other build plates", self._plate_indexes.getUnusedMemoryBreakdown, self._plate_indexes.release, 1)
+        self._memory.add("file caches", self._engineCacheMemoryUsage, self._releaseEngineCaches, 2)
+        self._memory.add("loaded file", self._engineMemoryUsage, value=3)
+        self._memory.add("loading file", self._loadingMemoryUsage, value=3)
+        self._memory.add("compared file", self._comparedMemoryUsage, value=3)
         self.setupUI()
         
-        # Setup timer for updates
-        self.update_timer = QTimer()
-        self.update_timer.timeout.connect(self.updatePreviewInfo)
-        self.update_timer.start(500)  # Update every 500ms
+        # 監看載入的檔案，切片軟體重新輸出時就地更新
+        self._file_watcher = QFileSystemWatcher(self)
+        self._file_watcher.fileChanged.connect(self.onGcodeFileChanged)
+        self._refresh_timer = QTimer(self)
+        self._refresh_timer.setSingleShot(True)
+        self._refresh_timer.setInterval(FILE_CHANGE_DEBOUNCE_INTERVAL)
+        self._refresh_timer.timeout.connect(self.refreshGcodeFile)
+        
+        # 由插件推送狀態變更；拖動滑桿時的連續變更合併成每個畫格一次更新
+        self._update_timer = QTimer(self)
+        self._update_timer.setSingleShot(True)
+        self._update_timer.timeout.connect(self.processPendingUpdate)
+        self._settle_timer = QTimer(self)
+        self._settle_timer.setSingleShot(True)
+        self._settle_timer.setInterval(SETTLE_INTERVAL)
+        self._settle_timer.timeout.connect(self._showDeferredTexts)
+        self._state.changed.connect(self.scheduleUpdate)
+        
+        try:
+            CuraApplication.getInstance().getMultiBuildPlateModel().activeBuildPlateChanged.connect(self._syncPlate)
+        except Exception as e:
+            Logger.log("d", "Cannot watch the active build plate: {}".format(e))
+        try:
+            CuraApplication.getInstance().getController().getScene().sceneChanged.connect(self._onSceneChanged)
+        except Exception as e:
+            Logger.log("d", "Cannot watch the scene for new slices: {}".format(e))
+        
+        try:
+            CuraApplication.getInstance().getPreferences().preferenceChanged.connect(self._onPreferenceChanged)
+        except Exception as e:
+            Logger.log("d", "Cannot watch preferences: {}".format(e))
         
+    def _readIntPreference(self, key, default):
+        """Integer value from Cura preferences"""
+        try:
+            value = CuraApplication.getInstance().getPreferences().getValue(key)
+            return int(value) if value is not None else default
+        except Exception:
+            return default
+    
+    def _readIndexCacheBytes(self):
+        return self._readIntPreference(INDEX_CACHE_SIZE_PREFERENCE, DEFAULT_INDEX_CACHE_SIZE_MB) * 1024 * 1024
+    
+    def _readTempGcodeLimits(self):
+        """(bytes, seconds) kept in GCODE_temp"""
+        return (self._readIntPreference(TEMP_GCODE_SIZE_PREFERENCE, DEFAULT_TEMP_GCODE_SIZE_MB) * 1024 * 1024,
+                self._readIntPreference(TEMP_GCODE_AGE_PREFERENCE, DEFAULT_TEMP_GCODE_MAX_AGE_DAYS) * 86400)
+    
+    def _readPrefetchBytes(self):
+        return max(1, self._readIntPreference(PREFETCH_MEMORY_PREFERENCE, DEFAULT_PREFETCH_MEMORY_MB)) * 1024 * 1024
+    
+    def _readPlateIndexBytes(self):
+        return self._readIntPreference(PLATE_INDEX_MEMORY_PREFERENCE, DEFAULT_PLATE_INDEX_MEMORY_MB) * 1024 * 1024
+    
+    def _readMemoryLimitBytes(self):
+        return max(1, self._readIntPreference(MEMORY_LIMIT_PREFERENCE, DEFAULT_MEMORY_LIMIT_MB)) * 1024 * 1024
+    
+    def _onPreferenceChanged(self, key):
+        if key == RENDER_CACHE_SIZE_PREFERENCE:
+            self._render_cache.setMaxSize(self._readIntPreference(RENDER_CACHE_SIZE_PREFERENCE, DEFAULT_RENDER_CACHE_SIZE))
+        elif key == INDEX_CACHE_SIZE_PREFERENCE:
+            self._index_cache.setMaxBytes(self._readIndexCacheBytes())
+        elif key in (TEMP_GCODE_SIZE_PREFERENCE, TEMP_GCODE_AGE_PREFERENCE):
+            self._temp_store.setLimits(*self._readTempGcodeLimits())
+            self._pruneTempGcode()
+        elif key == PREFETCH_MEMORY_PREFERENCE:
+            self._render_cache.setMaxBytes(self._readPrefetchBytes())
+            self._stopPrefetch()
+        elif key == PLATE_INDEX_MEMORY_PREFERENCE:
+            self._plate_indexes.setMaxBytes(self._readPlateIndexBytes())
+        elif key == MEMORY_LIMIT_PREFERENCE:
+            self._memory.setMaxBytes(self._readMemoryLimitBytes())
+            self._enforceMemoryBudget()
+    
     def setupUI(self):
         """Setup UI interface"""
         self.setWindowTitle("pz_cura_gcode_preview - Layer Preview Monitor")
@@ -96,6 +637,25 @@ class LayerPreviewWidget(QWidget):
         self.select_button.clicked.connect(self.selectGcodeFile)
         button_layout.addWidget(self.select_button)
         
+        self.slice_button = QPushButton("Use Current Slice")
+        self.slice_button.setStyleSheet("""
+            QPushButton {
+                background-color: #28a745; 
+                color: white; 
+                border: none; 
+                padding: 8px 16px; 
+                border-radius: 4px; 
+                font-family: 'Microsoft JhengHei', '微軟正黑體', sans-serif;
+                font-weight: bold;
+                font-size: 14px;
+            }
+            QPushButton:hover {
+                background-color: #218838;
+            }
+        """)
+        self.slice_button.clicked.connect(self.loadCurrentSlice)
+        button_layout.addWidget(self.slice_button)
+        
         self.temp_gcode_button = QPushButton("Save Temp GCODE")
         self.temp_gcode_button.setStyleSheet("""
             QPushButton {
@@ -134,12 +694,32 @@ class LayerPreviewWidget(QWidget):
         self.del_temp_button.clicked.connect(self.delTempGcodeFiles)
         button_layout.addWidget(self.del_temp_button)
         
+        self.cancel_load_button = QPushButton("Cancel Loading")
+        self.cancel_load_button.setStyleSheet("""
+            QPushButton {
+                background-color: #6c757d; 
+                color: white; 
+                border: none; 
+                padding: 8px 16px; 
+                border-radius: 4px; 
+                font-family: 'Microsoft JhengHei', '微軟正黑體', sans-serif;
+                font-weight: bold;
+                font-size: 14px;
+            }
+            QPushButton:hover {
+                background-color: #545b62;
+            }
+        """)
+        self.cancel_load_button.clicked.connect(self.cancelGcodeLoading)
+        self.cancel_load_button.setVisible(False)
+        button_layout.addWidget(self.cancel_load_button)
+        
         layout.addLayout(button_layout)
         
         # GCODE commands display area
-        gcode_commands_label = QLabel("GCODE Commands:")
-        gcode_commands_label.setStyleSheet("font-family: 'Microsoft JhengHei', '微軟正黑體', sans-serif; font-weight: bold; margin-top: 10px; font-size: 16px;")
-        layout.addWidget(gcode_commands_label)
+        self.gcode_commands_label = QLabel("GCODE Commands:")
+        self.gcode_commands_label.setStyleSheet("font-family: 'Microsoft JhengHei', '微軟正黑體', sans-serif; font-weight: bold; margin-top: 10px; font-size: 16px;")
+        layout.addWidget(self.gcode_commands_label)
         
         # Auto scroll checkbox
         checkbox_layout = QHBoxLayout()
@@ -169,14 +749,109 @@ class LayerPreviewWidget(QWidget):
         self.auto_scroll_checkbox.stateChanged.connect(self.onAutoScrollChanged)
         checkbox_layout.addWidget(self.auto_scroll_checkbox)
         checkbox_layout.addStretch()  # Push checkbox to the left
+        
+        # 圖層清單的篩選，只使用索引，不重新掃描檔案
+        filter_label = QLabel("Show:")
+        filter_label.setStyleSheet("font-family: 'Microsoft JhengHei', '微軟正黑體', sans-serif; font-size: 14px; color: #495057;")
+        checkbox_layout.addWidget(filter_label)
+        self.filter_combo = QComboBox()
+        for key, label, _ in VIEW_FILTERS:
+            self.filter_combo.addItem(label, key)
+        self.filter_combo.currentIndexChanged.connect(self.onViewFilterChanged)
+        checkbox_layout.addWidget(self.filter_combo)
         layout.addLayout(checkbox_layout)
+        
+        # 搜尋列：G/M/T 指令查詢索引，其他文字在背景搜尋整個檔案
+        search_layout = QHBoxLayout()
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("Search: M104, G92, ;TYPE:FILL, Z0.4 ...")
+        self.search_edit.setStyleSheet("font-family: 'Microsoft JhengHei', '微軟正黑體', sans-serif; font-size: 14px; padding: 4px;")
+        self.search_edit.returnPressed.connect(self.startSearch)
+        search_layout.addWidget(self.search_edit)
+        self.regex_checkbox = QCheckBox("Regex")
+        self.regex_checkbox.setStyleSheet("font-family: 'Microsoft JhengHei', '微軟正黑體', sans-serif; font-size: 14px; color: #495057;")
+        search_layout.addWidget(self.regex_checkbox)
+        search_button = QPushButton("Search")
+        search_button.clicked.connect(self.startSearch)
+        search_layout.addWidget(search_button)
+        clear_search_button = QPushButton("Clear")
+        clear_search_button.clicked.connect(self.clearSearch)
+        search_layout.addWidget(clear_search_button)
+        layout.addLayout(search_layout)
+        
+        self.search_model = SearchResultModel(self)
+        self.search_results_view = QTableView()
+        self.search_results_view.setModel(self.search_model)
+        self.search_results_view.horizontalHeader().hide()
+        self.search_results_view.horizontalHeader().setStretchLastSection(True)
+        self.search_results_view.verticalHeader().hide()
+        self.search_results_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.search_results_view.verticalHeader().setDefaultSectionSize(self.search_results_view.fontMetrics().height() + 6)
+        self.search_results_view.setShowGrid(False)
+        self.search_results_view.setWordWrap(False)
+        self.search_results_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.search_results_view.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.search_results_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.search_results_view.setStyleSheet("QTableView { background-color: #fffdf0; border: 1px solid #ccc; font-family: 'Courier New', monospace; font-size: 12px; }")
+        self.search_results_view.setMaximumHeight(160)
+        self.search_results_view.clicked.connect(self.onSearchResultClicked)
+        self.search_results_view.activated.connect(self.onSearchResultClicked)
+        self.search_results_view.setVisible(False)
+        layout.addWidget(self.search_results_view)
+        
+        # 比對模式：與另一個檔案逐層比對，變更的圖層列在下拉選單中，可前後跳轉
+        compare_layout = QHBoxLayout()
+        self.compare_button = QPushButton("Compare With...")
+        self.compare_button.clicked.connect(self.selectCompareFile)
+        compare_layout.addWidget(self.compare_button)
+        self.prev_change_button = QPushButton("◀")
+        self.prev_change_button.setToolTip("Previous changed layer")
+        self.prev_change_button.clicked.connect(lambda: self.jumpToNextChange(-1))
+        compare_layout.addWidget(self.prev_change_button)
+        self.change_combo = QComboBox()
+        self.change_combo.activated.connect(self.onChangeMarkerActivated)
+        compare_layout.addWidget(self.change_combo, 1)
+        self.next_change_button = QPushButton("▶")
+        self.next_change_button.setToolTip("Next changed layer")
+        self.next_change_button.clicked.connect(lambda: self.jumpToNextChange(1))
+        compare_layout.addWidget(self.next_change_button)
+        self.close_compare_button = QPushButton("Close Compare")
+        self.close_compare_button.clicked.connect(self.closeCompare)
+        compare_layout.addWidget(self.close_compare_button)
+        layout.addLayout(compare_layout)
+        
+        self.diff_view = QPlainTextEdit()
+        self.diff_view.setReadOnly(True)
+        self.diff_view.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.diff_view.setStyleSheet("QPlainTextEdit { background-color: #f8f9fa; border: 1px solid #ccc; font-family: 'Courier New', monospace; font-size: 12px; }")
+        self.diff_view.setMaximumHeight(200)
+        layout.addWidget(self.diff_view)
+        self._setCompareControlsVisible(False)
 
-        # Create scrollable text area
-        self.gcode_display = QTextEdit()
-        self.gcode_display.setReadOnly(True)
+        # 虛擬化清單：只為可見的列建立內容
+        # QTableView 固定列高時只查詢可見的列；QListView/QTreeView 在重設或 dataChanged 時會走訪所有列
+        self.gcode_model = GcodeCommandModel(self)
+        self.gcode_display = QTableView()
+        self.gcode_display.setModel(self.gcode_model)
+        self.gcode_display.horizontalHeader().hide()
+        self.gcode_display.horizontalHeader().setStretchLastSection(True)
+        self.gcode_display.verticalHeader().hide()
+        self.gcode_display.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.gcode_display.verticalHeader().setDefaultSectionSize(self.gcode_display.fontMetrics().height() + 8)
+        self.gcode_display.setShowGrid(False)
+        self.gcode_display.setWordWrap(False)
+        self.gcode_display.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.gcode_display.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.gcode_display.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.gcode_display.setMinimumHeight(200)  # Set minimum height
+        copy_action = QAction("Copy", self.gcode_display)
+        copy_action.setShortcut("Ctrl+C")
+        copy_action.setShortcutContext(Qt.WidgetShortcut)
+        copy_action.triggered.connect(self.copySelectedCommands)
+        self.gcode_display.addAction(copy_action)
+        self.gcode_display.setContextMenuPolicy(Qt.ActionsContextMenu)
         self.gcode_display.setStyleSheet("""
-            QTextEdit {
+            QTableView {
                 background-color: #f8f8f8; 
                 border: 1px solid #ccc; 
                 padding: 8px; 
@@ -198,7 +873,7 @@ class LayerPreviewWidget(QWidget):
                 background-color: #a0a0a0;
             }
         """)
-        self.gcode_display.setPlainText("Please select a GCODE file first")
+        self.gcode_model.setMessage("Please select a GCODE file first")
         layout.addWidget(self.gcode_display)
         
         # Status bar
@@ -206,6 +881,55 @@ class LayerPreviewWidget(QWidget):
         self.status_label.setStyleSheet("background-color: #e8f5e8; padding: 5px; border-radius: 3px; font-family: 'Microsoft JhengHei', '微軟正黑體', sans-serif; font-size: 12px; color: #2e7d32;")
         layout.addWidget(self.status_label)
         
+        self.memory_label = QLabel()
+        self.memory_label.setStyleSheet("color: #6c757d; font-size: 11px;")
+        layout.addWidget(self.memory_label)
+        
+        # 診斷面板：預設收合，展開時才定期更新
+        self.diagnostics_button = QPushButton("▸ Diagnostics")
+        self.diagnostics_button.setCheckable(True)
+        self.diagnostics_button.setStyleSheet("""
+            QPushButton {
+                background-color: transparent; 
+                color: #6c757d; 
+                border: none; 
+                padding: 2px; 
+                text-align: left;
+                font-family: 'Microsoft JhengHei', '微軟正黑體', sans-serif;
+                font-size: 12px;
+            }
+            QPushButton:hover {
+                color: #495057;
+            }
+        """)
+        self.diagnostics_button.toggled.connect(self.onDiagnosticsToggled)
+        layout.addWidget(self.diagnostics_button)
+        
+        self.diagnostics_frame = QFrame()
+        self.diagnostics_frame.setStyleSheet("QFrame { background-color: #f8f9fa; border: 1px solid #dee2e6; border-radius: 4px; }")
+        diagnostics_layout = QVBoxLayout()
+        diagnostics_layout.setContentsMargins(8, 8, 8, 8)
+        self.diagnostics_label = QLabel()
+        self.diagnostics_label.setStyleSheet("border: none; font-family: 'Courier New', monospace; font-size: 11px; color: #495057;")
+        self.diagnostics_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        diagnostics_layout.addWidget(self.diagnostics_label)
+        diagnostics_button_layout = QHBoxLayout()
+        export_diagnostics_button = QPushButton("Export JSON")
+        export_diagnostics_button.clicked.connect(self.exportDiagnostics)
+        diagnostics_button_layout.addWidget(export_diagnostics_button)
+        reset_diagnostics_button = QPushButton("Reset")
+        reset_diagnostics_button.clicked.connect(self.resetDiagnostics)
+        diagnostics_button_layout.addWidget(reset_diagnostics_button)
+        diagnostics_button_layout.addStretch()
+        diagnostics_layout.addLayout(diagnostics_button_layout)
+        self.diagnostics_frame.setLayout(diagnostics_layout)
+        self.diagnostics_frame.setVisible(False)
+        layout.addWidget(self.diagnostics_frame)
+        
+        self._diagnostics_timer = QTimer(self)
+        self._diagnostics_timer.setInterval(DIAGNOSTICS_REFRESH_INTERVAL)
+        self._diagnostics_timer.timeout.connect(self.refreshDiagnostics)
+        
         # Close button
         close_button = QPushButton("Close")
         close_button.setStyleSheet("""
@@ -228,16 +952,74 @@ class LayerPreviewWidget(QWidget):
         
         self.setLayout(layout)
         
+    def onDiagnosticsToggled(self, expanded):
+        """Expand or collapse the diagnostics panel"""
+        self.diagnostics_button.setText("▾ Diagnostics" if expanded else "▸ Diagnostics")
+        self.diagnostics_frame.setVisible(expanded)
+        if expanded:
+            self.refreshDiagnostics()
+            self._diagnostics_timer.start()
+        else:
+            self._diagnostics_timer.stop()
+    
+    def refreshDiagnostics(self):
+        """Show call counts and p50/p99 of the timing counters"""
+        if not self.isVisible():
+            return
+        summary = self._diagnostics.summary()
+        cache = self._render_cache
+        cache_text = "Render cache: {} layers, {:.1f} of {:.0f} MB, prefetched {} used / {} unused".format(
+            len(cache), cache.getMemoryUsage() / 1048576.0, cache.getMaxBytes() / 1048576.0,
+            cache.prefetch_hits, cache.prefetch_wasted)
+        if not summary:
+            self.diagnostics_label.setText("No timings recorded yet\n" + cache_text)
+            return
+        rows = ["{:<14}{:>8}{:>10}{:>10}{:>10}".format("", "calls", "p50 ms", "p99 ms", "max ms")]
+        for name, values in summary.items():
+            rows.append("{:<14}{:>8}{:>10.3f}{:>10.3f}{:>10.3f}".format(
+                name, values["count"], values["p50_ms"], values["p99_ms"], values["max_ms"]))
+        rows.append(cache_text)
+        rows.append("Memory: {}; released {:.1f} MB".format(
+            ", ".join("{} {:.1f}".format(name, size / 1048576.0) for name, size in self._memory.consumers()),
+            self._memory.released_bytes / 1048576.0))
+        if len(self._plate_indexes):
+            rows.append("Build plate indexes: {} ({:.1f} of {:.0f} MB)".format(
+                ", ".join(str(plate) for plate in self._plate_indexes.plates()),
+                self._plate_indexes.getMemoryUsage() / 1048576.0, self._plate_indexes.getMaxBytes() / 1048576.0))
+        rows.append("Updates: {processed} processed, {coalesced} coalesced, {deferred} over budget".format(
+            **self._update_counts))
+        self.diagnostics_label.setText("\n".join(rows))
+    
+    def exportDiagnostics(self):
+        """Save the timing counters to a JSON file"""
+        file_path, _ = QFileDialog.getSaveFileName(
+            self, "Export Diagnostics", "layer_preview_diagnostics_{}.json".format(datetime.now().strftime("%Y%m%d_%H%M%S")),
+            "JSON Files (*.json);;All Files (*)")
+        if not file_path:
+            return
+        try:
+            self._diagnostics.exportJson(file_path)
+            self.status_label.setText("Diagnostics exported to {}".format(file_path))
+        except Exception as e:
+            Logger.log("e", "Error exporting diagnostics: {}".format(e))
+            QMessageBox.critical(self, "Error", "Error exporting diagnostics:\n{}".format(str(e)))
+    
+    def resetDiagnostics(self):
+        self._diagnostics.reset()
+        self._update_counts = dict.fromkeys(self._update_counts, 0)
+        self.refreshDiagnostics()
+    
     def onAutoScrollChanged(self, state):
         """Handle auto scroll checkbox state change"""
         if state == Qt.Checked:
             self.status_label.setText("Auto scroll enabled - will automatically jump to current layer commands")
             Logger.log("d", "Auto scroll enabled")
             # When enabling auto scroll, trigger an immediate update
-            if self.gcode_lines:
+            # 關閉期間可能手動捲動過，強制重新定位
+            self._last_drawn = None
+            if self.hasGcode():
                 try:
-                    current_layer, current_step = self.getCurrentPreviewLayerAndStep()
-                    self.updateGcodeDisplay(current_layer, current_step)
+                    self.updateGcodeDisplay(self._state.current_layer, self._state.current_step)
                 except Exception as e:
                     Logger.log("d", "Error updating display after enabling auto scroll: {}".format(e))
         else:
@@ -254,160 +1036,223 @@ class LayerPreviewWidget(QWidget):
             except Exception as e:
                 Logger.log("d", "Error maintaining scroll position: {}".format(e))
     
-    def updatePreviewInfo(self):
-        """Update preview information"""
+    def showEvent(self, event):
+        """Catch up with changes made while the window was hidden"""
+        super().showEvent(event)
+        self.updatePreviewInfo()
+    
+    def hideEvent(self, event):
+        """Nothing is scrubbed while the window is hidden"""
+        super().hideEvent(event)
+        self._update_timer.stop()
+        self._stopPrefetch()
+    
+    def scheduleUpdate(self):
+        """Coalesce preview state changes, at most one update per FRAME_INTERVAL"""
+        if self._update_timer.isActive():
+            # 尚未處理的中間狀態直接被最新的狀態取代
+            self._update_counts["coalesced"] += 1
+            return
+        elapsed = int((time.perf_counter() - self._frame_started) * 1000)
+        self._update_timer.start(max(0, FRAME_INTERVAL - elapsed))
+    
+    def processPendingUpdate(self):
+        """Show the latest preview state within FRAME_BUDGET"""
+        self._frame_started = time.perf_counter()
+        self._update_counts["processed"] += 1
+        self.updatePreviewInfo(self._frame_started + FRAME_BUDGET)
+        if self._deferred_texts:
+            self._update_counts["deferred"] += 1
+        self._diagnostics.record("update", time.perf_counter() - self._frame_started)
+        self._enforceMemoryBudget()
+    
+    def _engineMemoryUsage(self):
+        """已載入檔案中無法釋放的部分"""
+        if self._engine is None:
+            return {}
+        usage = self._engine.getMemoryBreakdown()
+        for category, size in self._engine.getCacheMemoryUsage().items():
+            usage[category] -= size
+        return usage
+    
+    def _engineCacheMemoryUsage(self):
+        return self._engine.getCacheMemoryUsage() if self._engine is not None else {}
+    
+    def _releaseEngineCaches(self, bytes_to_free):
+        if self._engine is not None:
+            self._engine.releaseCaches()
+    
+    def _loadingMemoryUsage(self):
+        """索引中（或重新索引中）的檔案"""
+        usage = {}
+        for thread in (self._load_thread, self._refresh_thread):
+            if thread is not None:
+                for category, size in thread.engine.getMemoryBreakdown().items():
+                    usage[category] = usage.get(category, 0) + size
+        return usage
+    
+    def _comparedMemoryUsage(self):
+        return self._layer_diff.other.getMemoryBreakdown() if self._layer_diff is not None else {}
+    
+    def _enforceMemoryBudget(self):
+        """Release the least valuable memory when the preview is over its limit and show the usage"""
+        self._memory.enforce()
+        usage = self._memory.usage()
+        text = "Memory: {:.1f} of {:.0f} MB (text {:.1f}, index {:.1f}, moves {:.1f}, render {:.1f}){}".format(
+            sum(usage.values()) / 1048576.0, self._memory.getMaxBytes() / 1048576.0,
+            usage["text"] / 1048576.0, usage["index"] / 1048576.0, usage["moves"] / 1048576.0, usage["render"] / 1048576.0,
+            " - over the limit" if self._memory.over_limit else "")
+        if text != self.memory_label.text():
+            self.memory_label.setText(text)
+            self.memory_label.setStyleSheet("color: {}; font-size: 11px;".format("#c62828" if self._memory.over_limit else "#6c757d"))
+    
+    def _showText(self, label, text, deadline=None):
+        """Set a label, or leave it for after scrubbing when the update is over its deadline
+        
+        text may be a callable so that building the text is skipped as well.
+        """
+        if deadline is not None and time.perf_counter() > deadline:
+            self._deferred_texts[label] = text
+            self._settle_timer.start()
+            return
+        self._deferred_texts.pop(label, None)
+        label.setText(text() if callable(text) else text)
+    
+    def _showDeferredTexts(self):
+        texts, self._deferred_texts = self._deferred_texts, {}
+        for label, text in texts.items():
+            label.setText(text() if callable(text) else text)
+    
+    def updatePreviewInfo(self, deadline=None):
+        """Update preview information from the shared preview state
+        
+        Past deadline (a perf_counter() value) the labels are left for
+        _showDeferredTexts(); the command list and its highlight are
+        always updated.
+        """
         try:
-            app = CuraApplication.getInstance()
-            if not app:
+            # 視窗隱藏時不做任何工作，再次顯示時會同步
+            if not self.isVisible():
                 return
-                
-            # Get current layer and step
-            current_layer, current_step = self.getCurrentPreviewLayerAndStep()
-            total_layers, total_steps = self.getTotalLayersAndSteps()
             
-            # Update information display
-            info_text = "Current Layer: {}\nCurrent Step: {}\nTotal Layers: {}".format(
-                current_layer, current_step, total_layers)
-            self.info_label.setText(info_text)
+            self._syncPlate()
+            current_layer, current_step = self._state.current_layer, self._state.current_step
             
             # Update GCODE display only if auto scroll is enabled
-            if self.gcode_lines and self.auto_scroll_checkbox.isChecked():
-                self.updateGcodeDisplay(current_layer, current_step)
-            elif self.gcode_lines and not self.auto_scroll_checkbox.isChecked():
+            if self.hasGcode() and self.auto_scroll_checkbox.isChecked():
+                self.updateGcodeDisplay(current_layer, current_step, deadline)
+            elif self.hasGcode() and not self.auto_scroll_checkbox.isChecked():
                 # When auto scroll is disabled, just update status without changing display
-                self.status_label.setText("Auto scroll disabled - GCODE display frozen at current position")
+                self._showText(self.status_label, "Auto scroll disabled - GCODE display frozen at current position", deadline)
+            
+            # Update information display
+            info_text = "Current Layer: {}\nCurrent Step: {} of {}\nTotal Layers: {}".format(
+                current_layer, current_step, self.getLayerStepCount(current_layer), self._state.total_layers)
+            if self._layer_diff is not None:
+                info_text += "\nCompared file: layer {}".format(self._layer_diff.changes.get(current_layer, "unchanged"))
+            self._showText(self.info_label, lambda: info_text + self._layerStatsText(current_layer), deadline)
                 
         except Exception as e:
             Logger.log("e", "Error updating preview information: {}".format(e))
     
-    def getCurrentPreviewLayerAndStep(self):
-        """Get current preview layer and step"""
-        try:
-            app = CuraApplication.getInstance()
-            if not app:
-                return 0, 0
-                
-            # 嘗試從 SimulationView 獲取
-            try:
-                simulation_view = app.getPluginRegistry().getPluginObject("SimulationView")
-                if simulation_view:
-                    current_layer = simulation_view.getCurrentLayer()
-                    current_step = simulation_view.getCurrentPath()
-                    Logger.log("d", "從 SimulationView 獲取: 圖層={}, 步驟={}".format(current_layer, current_step))
-                    return current_layer, current_step
-            except Exception as e:
-                Logger.log("d", "從 SimulationView 獲取失敗: {}".format(e))
-            
-            # 備用方法：從 activeView 獲取
-            try:
-                active_view = app.getController().getActiveView()
-                if active_view:
-                    current_layer = active_view.getCurrentLayer()
-                    current_step = active_view.getCurrentStep()
-                    Logger.log("d", "從 activeView 獲取: 圖層={}, 步驟={}".format(current_layer, current_step))
-                    return current_layer, current_step
-            except Exception as e:
-                Logger.log("d", "從 activeView 獲取失敗: {}".format(e))
-            
-            return 0, 0
-            
-        except Exception as e:
-            Logger.log("e", "Error getting current preview layer and step: {}".format(e))
-            return 0, 0
+    def _layerStatsText(self, layer_num):
+        """統計面板的文字，取自載入後預先算好的陣列"""
+        engine = self._engine
+        if engine is None or self._engine_stale:
+            return ""
+        stats = engine.layer_stats
+        if stats is None:
+            return "\nLayer statistics: computing..." if self._stats_thread is not None else ""
+        values = stats.layerStats(layer_num)
+        if values is None:
+            return "\nNo moves in layer {}".format(layer_num)
+        lines = [
+            "Moves: {}   Est. time: {}".format(values["moves"], formatDuration(values["time_s"])),
+            "Extrusion: {:.1f} mm   Travel: {:.1f} mm".format(values["extrusion_mm"], values["travel_distance_mm"]),
+        ]
+        if values["max_feedrate"] is not None:
+            lines.append("Feedrate: {:.0f}-{:.0f} mm/min".format(values["min_feedrate"], values["max_feedrate"]))
+        if values["features"]:
+            lines.append("Features: " + ", ".join("{} {:.0%}".format(name, share) for name, share in values["features"]))
+        return "\n" + "\n".join(lines)
     
-    def getTotalLayersAndSteps(self):
-        """Get total number of layers and steps"""
-        try:
-            app = CuraApplication.getInstance()
-            if not app:
-                return 0, 0
-                
-            # 嘗試從 SimulationView 獲取
-            try:
-                simulation_view = app.getPluginRegistry().getPluginObject("SimulationView")
-                if simulation_view:
-                    total_layers = simulation_view.getMaxLayers()
-                    # 不計算總步驟數，節省運算資源
-                    total_steps = 0
-                    Logger.log("d", "從 SimulationView 獲取總數: 圖層={}, 總步驟=0 (已禁用)".format(total_layers))
-                    return total_layers, total_steps
-            except Exception as e:
-                Logger.log("d", "從 SimulationView 獲取總數失敗: {}".format(e))
-            
-            # 備用方法：從 activeView 獲取
-            try:
-                active_view = app.getController().getActiveView()
-                if active_view:
-                    total_layers = active_view.getMaxLayers()
-                    # 不計算總步驟數，節省運算資源
-                    total_steps = 0
-                    Logger.log("d", "從 activeView 獲取總數: 圖層={}, 總步驟=0 (已禁用)".format(total_layers))
-                    return total_layers, total_steps
-            except Exception as e:
-                Logger.log("d", "從 activeView 獲取總數失敗: {}".format(e))
-            
-            return 0, 0
-            
-        except Exception as e:
-            Logger.log("e", "Error getting total layers and steps: {}".format(e))
-            return 0, 0
+    def _startLayerStats(self):
+        """Compute the statistics of the loaded engine in the background"""
+        self._stopLayerStats()
+        thread = LayerStatsThread(self._engine)
+        thread.statsFinished.connect(lambda stats, thread=thread: self.onLayerStatsFinished(thread, stats))
+        thread.statsFailed.connect(lambda message, thread=thread: self.onLayerStatsFailed(thread, message))
+        thread.finished.connect(thread.deleteLater)
+        self._stats_thread = thread
+        thread.start()
+    
+    def _stopLayerStats(self):
+        """Cancel the statistics pass, it reads the store that is about to be closed"""
+        if self._stats_thread is not None:
+            thread = self._stats_thread
+            self._stats_thread = None
+            thread.cancel()
+            thread.wait()
+    
+    def onLayerStatsFinished(self, thread, stats):
+        if thread is not self._stats_thread:
+            return
+        self._stats_thread = None
+        self._diagnostics.record("layer_stats", thread.elapsed)
+        Logger.log("d", "Layer statistics of {} layers computed in {:.2f} s".format(len(stats), thread.elapsed))
+        self.updatePreviewInfo()
+        self._enforceMemoryBudget()
+    
+    def onLayerStatsFailed(self, thread, message):
+        if thread is not self._stats_thread:
+            return
+        self._stats_thread = None
+        Logger.log("w", "Cannot compute layer statistics: {}".format(message))
     
     def getLayerStepCount(self, layer_num):
-        """獲取指定圖層的步驟數"""
-        try:
-            app = CuraApplication.getInstance()
-            if not app:
-                return 0
-                
-            # 方法1：從 SimulationView 獲取該層的步驟數
-            try:
-                simulation_view = app.getPluginRegistry().getPluginObject("SimulationView")
-                if simulation_view:
-                    # 先設置到指定圖層
-                    simulation_view.setLayer(layer_num)
-                    # 獲取該層的最大路徑數（步驟數）
-                    max_paths = simulation_view.getMaxPaths()
-                    Logger.log("d", "從 SimulationView 獲取圖層 {} 的步驟數: {}".format(layer_num, max_paths))
-                    return max_paths
-            except Exception as e:
-                Logger.log("d", "從 SimulationView 獲取圖層步驟數失敗: {}".format(e))
-            
-            # 方法2：從場景中的切片數據獲取
-            try:
-                scene = app.getController().getScene()
-                for node in scene.getRoot().getChildren():
-                    if hasattr(node, 'callDecoration'):
-                        layer_data = node.callDecoration("getLayerData")
-                        if layer_data:
-                            layer = layer_data.getLayer(layer_num)
-                            if layer and hasattr(layer, 'lineMeshElementCount'):
-                                step_count = layer.lineMeshElementCount()
-                                Logger.log("d", "從切片數據獲取圖層 {} 的步驟數: {}".format(layer_num, step_count))
-                                return step_count
-            except Exception as e:
-                Logger.log("d", "從切片數據獲取圖層步驟數失敗: {}".format(e))
-            
-            # 方法3：從 GCODE 分析獲取（備用方法）
+        """獲取指定圖層的步驟數：優先使用切片資料，其次是 GCODE 索引；不會改變 SimulationView 的狀態"""
+        with self._diagnostics.measure("step_count"):
+            if self._step_counts_dirty:
+                self._step_counts_dirty = False
+                self._refreshSliceStepCounts()
+            step_count = self._slice_step_counts.stepCount(layer_num)
+            if step_count is not None:
+                return step_count
+            
+            # 沒有切片資料時（例如開啟的 GCODE 檔案）從 GCODE 索引獲取
             try:
-                if self.gcode_lines:
-                    # 尋找該層的 GCODE 指令
-                    layer_commands = self.findLayerCommands(layer_num, 0)
-                    if layer_commands:
-                        # 根據指令類型估算步驟數
-                        # 通常每個 G1 指令代表一個移動步驟
-                        g1_commands = [cmd for cmd in layer_commands if cmd.strip().startswith('G1')]
-                        step_count = len(g1_commands)
-                        Logger.log("d", "從 GCODE 分析獲取圖層 {} 的步驟數: {}".format(layer_num, step_count))
-                        return step_count
+                if self.hasGcode():
+                    engine, message = self._layerSource(layer_num)
+                    if not message and engine.hasLayer(layer_num):
+                        return engine.stepCount(layer_num)
             except Exception as e:
-                Logger.log("d", "從 GCODE 分析獲取圖層步驟數失敗: {}".format(e))
-            
-            return 0
-            
-        except Exception as e:
-            Logger.log("e", "獲取圖層 {} 步驟數時發生錯誤: {}".format(layer_num, e))
+                self._diagnostics.debugLog("step_count.gcode_failed", "從 GCODE 分析獲取圖層步驟數失敗: {}".format(e))
             return 0
     
+    def _onSceneChanged(self, *args):
+        # 新的切片會換掉場景中的 LayerData，下次查詢時再比對
+        self._step_counts_dirty = True
+    
+    def _refreshSliceStepCounts(self):
+        """Re-read the step counts when the active build plate has other LayerData than the cached counts"""
+        try:
+            app = CuraApplication.getInstance()
+            plate = app.getMultiBuildPlateModel().activeBuildPlate
+            layer_datas = []
+            for node in app.getController().getScene().getRoot().getChildren():
+                # 與 SimulationView 相同，只使用目前列印平台的 LayerData
+                if not hasattr(node, "callDecoration") or node.callDecoration("getBuildPlateNumber") != plate:
+                    continue
+                layer_data = node.callDecoration("getLayerData")
+                if layer_data:
+                    layer_datas.append(layer_data)
+            started = time.perf_counter()
+            if self._slice_step_counts.update(layer_datas):
+                self._diagnostics.debugLog("step_count.layer_data", "從切片數據讀取 {} 個圖層的步驟數，耗時 {:.1f} ms".format(
+                    len(self._slice_step_counts), (time.perf_counter() - started) * 1000))
+        except Exception as e:
+            self._slice_step_counts.clear()
+            self._diagnostics.debugLog("step_count.layer_data_failed", "從切片數據獲取圖層步驟數失敗: {}".format(e))
     
     def selectGcodeFile(self):
         """Select GCODE file"""
@@ -416,14 +1261,13 @@ class LayerPreviewWidget(QWidget):
                 self, 
                 "Select GCODE File", 
                 "", 
-                "GCODE Files (*.gcode);;All Files (*)"
+                "GCODE Files (*.gcode *.gcode.gz);;All Files (*)"
             )
             
             if file_path:
                 self.loadGcodeFile(file_path)
                 self.gcode_path_label.setText("GCODE File Path: {}".format(file_path))
-                self.status_label.setText("GCODE file loaded")
-                Logger.log("i", "Loaded GCODE file: {}".format(file_path))
+                Logger.log("i", "Loading GCODE file: {}".format(file_path))
             else:
                 self.status_label.setText("No file selected")
                 
@@ -431,66 +1275,115 @@ class LayerPreviewWidget(QWidget):
             Logger.log("e", "Error selecting GCODE file: {}".format(e))
             QMessageBox.critical(self, "Error", "Error selecting GCODE file:\n{}".format(str(e)))
     
-    def tempGcodeFile(self):
-        """Save current Cura GCODE file as temporary"""
+    def _currentSliceGcode(self):
+        """(active build plate, its GCODE chunks), None (after warning the user) when there are none"""
+        # Get current Cura application
+        app = CuraApplication.getInstance()
+        if not app:
+            QMessageBox.warning(self, "Warning", "Cannot connect to Cura application")
+            return None
+        
+        # Get scene and GCODE content
+        scene = app.getController().getScene()
+        if not hasattr(scene, "gcode_dict"):
+            QMessageBox.warning(self, "Warning", "No GCODE content available, please slice first")
+            return None
+        
+        # Get current build plate GCODE
+        active_build_plate = app.getMultiBuildPlateModel().activeBuildPlate
+        gcode_dict = getattr(scene, "gcode_dict")
+        gcode_list = gcode_dict.get(active_build_plate, None)
+        
+        if not gcode_list:
+            QMessageBox.warning(self, "Warning", "Current build plate has no GCODE content, please slice first")
+            return None
+        return active_build_plate, gcode_list
+    
+    def _activePlateGcode(self):
+        """(active build plate, its GCODE chunks or None) without warning the user"""
+        app = CuraApplication.getInstance()
+        plate = app.getMultiBuildPlateModel().activeBuildPlate
+        gcode_dict = getattr(app.getController().getScene(), "gcode_dict", None) or {}
+        return plate, gcode_dict.get(plate)
+    
+    def loadCurrentSlice(self):
+        """Index the current slice directly from Cura's memory, nothing is written to disk"""
         try:
-            # Get current Cura application
-            app = CuraApplication.getInstance()
-            if not app:
-                QMessageBox.warning(self, "Warning", "Cannot connect to Cura application")
+            current = self._currentSliceGcode()
+            if current is None:
                 return
+            plate, gcode_list = current
+            self._showPlate(plate, gcode_list)
+            Logger.log("i", "Showing the slice of build plate {}, {} chunks".format(plate, len(gcode_list)))
             
-            # Get scene and GCODE content
-            scene = app.getController().getScene()
-            if not hasattr(scene, "gcode_dict"):
-                QMessageBox.warning(self, "Warning", "No GCODE content available, please slice first")
-                return
-            
-            # Get current build plate GCODE
-            active_build_plate = app.getMultiBuildPlateModel().activeBuildPlate
-            gcode_dict = getattr(scene, "gcode_dict")
-            gcode_list = gcode_dict.get(active_build_plate, None)
-            
-            if not gcode_list:
-                QMessageBox.warning(self, "Warning", "Current build plate has no GCODE content, please slice first")
+        except Exception as e:
+            Logger.log("e", "Error loading current slice: {}".format(e))
+            QMessageBox.critical(self, "Error", "Error loading current slice:\n{}".format(str(e)))
+    
+    def tempGcodeFile(self):
+        """Save current Cura GCODE file as temporary"""
+        try:
+            current = self._currentSliceGcode()
+            if current is None:
                 return
-            
-            # Create GCODE_temp folder
-            plugin_dir = os.path.dirname(os.path.abspath(__file__))
-            temp_dir = os.path.join(plugin_dir, "GCODE_temp")
-            if not os.path.exists(temp_dir):
-                os.makedirs(temp_dir)
-                Logger.log("i", "Created GCODE_temp folder: {}".format(temp_dir))
-            
-            # Generate filename with timestamp
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            temp_filename = "GCODE_temp_{}.gcode".format(timestamp)
-            temp_file_path = os.path.join(temp_dir, temp_filename)
-            
-            # Save GCODE content to file
-            with open(temp_file_path, 'w', encoding='utf-8') as f:
-                for line in gcode_list:
-                    f.write(line)
-            
-            Logger.log("i", "Successfully saved temporary GCODE file: {}".format(temp_file_path))
-            
-            # Automatically load the temporary file
-            self.loadGcodeFile(temp_file_path)
-            self.gcode_path_label.setText("GCODE File Path: {}".format(temp_file_path))
-            self.status_label.setText("Temporary GCODE file saved and loaded")
-            
-            QMessageBox.information(self, "Success", "GCODE file saved to:\n{}".format(temp_file_path))
+            plate, gcode_list = current
+            
+            # 雜湊與寫檔在背景執行，預覽直接索引記憶體中的切片，不必等檔案寫完再讀回來
+            # 檔名是內容的雜湊，相同的切片只會存一份
+            thread = GcodeSaveThread(self._temp_store, gcode_list, [self._loadedFilePath()])
+            thread.saveFinished.connect(lambda file_path, created, pruned, thread=thread:
+                                        self.onTempGcodeSaved(thread, file_path, created, pruned))
+            thread.saveFailed.connect(self.onTempGcodeSaveFailed)
+            thread.finished.connect(lambda thread=thread: self._save_threads.remove(thread))
+            thread.finished.connect(thread.deleteLater)
+            self._save_threads.append(thread)
+            thread.start()
+            
+            self._showPlate(plate, gcode_list)
+            thread.label_text = "GCODE File Path: Current slice (saving to {})".format(self._temp_store.temp_dir)
+            self.gcode_path_label.setText(thread.label_text)
             
         except Exception as e:
             Logger.log("e", "Error saving temporary GCODE file: {}".format(e))
             QMessageBox.critical(self, "Error", "Error saving temporary GCODE file:\n{}".format(str(e)))
     
+    def onTempGcodeSaved(self, thread, temp_file_path, created, pruned):
+        """Background save of the temporary file finished"""
+        if created:
+            Logger.log("i", "Successfully saved temporary GCODE file: {}".format(temp_file_path))
+            message = "GCODE file saved to:\n{}".format(temp_file_path)
+        else:
+            Logger.log("i", "Slice is already saved as {}".format(temp_file_path))
+            message = "This slice is already saved as:\n{}".format(temp_file_path)
+        if pruned:
+            Logger.log("i", "Removed {} old temporary GCODE files".format(pruned))
+            message += "\n\nRemoved {} old temporary GCODE files.".format(pruned)
+        if self.gcode_path_label.text() == thread.label_text:
+            self.gcode_path_label.setText("GCODE File Path: Current slice (saved to {})".format(temp_file_path))
+        QMessageBox.information(self, "Success", message)
+    
+    def _loadedFilePath(self):
+        """File shown or being loaded, None for a slice"""
+        if self._load_thread is not None:
+            return self._load_thread.file_path
+        return getattr(self.gcode_lines, "file_path", None)
+    
+    def _pruneTempGcode(self):
+        """Delete temporary GCODE files past the retention limits, except the one shown"""
+        removed = self._temp_store.prune([self._loadedFilePath()])
+        if removed:
+            Logger.log("i", "Removed {} old temporary GCODE files".format(len(removed)))
+    
+    def onTempGcodeSaveFailed(self, message):
+        """Background save of the temporary file failed"""
+        Logger.log("e", "Error saving temporary GCODE file: {}".format(message))
+        QMessageBox.critical(self, "Error", "Error saving temporary GCODE file:\n{}".format(message))
+    
     def delTempGcodeFiles(self):
         """Delete temporary GCODE files"""
         try:
             # Get the temp directory path
-            plugin_dir = os.path.dirname(os.path.abspath(__file__))
-            temp_dir = os.path.join(plugin_dir, "GCODE_temp")
+            temp_dir = self._temp_store.temp_dir
             
             # Check if temp directory exists
             if not os.path.exists(temp_dir):
@@ -521,6 +1414,17 @@ class LayerPreviewWidget(QWidget):
                 deleted_count = 0
                 failed_files = []
                 
+                # 等待背景寫入完成，避免刪到寫了一半的檔案
+                for thread in list(self._save_threads):
+                    thread.wait()
+                
+                # 已載入的暫存檔仍被 mmap 佔用（Windows 無法刪除），先釋放
+                loaded_path = self._loadedFilePath()
+                if loaded_path and os.path.dirname(os.path.abspath(loaded_path)) == os.path.abspath(temp_dir):
+                    self.closeGcodeFile()
+                    self.gcode_path_label.setText("GCODE File Path: Not selected")
+                    self.gcode_model.setMessage("Please select a GCODE file first")
+                
                 # Delete each file
                 for file in temp_files:
                     try:
@@ -556,109 +1460,636 @@ class LayerPreviewWidget(QWidget):
             QMessageBox.critical(self, "Error", "Error deleting temporary GCODE files:\n{}".format(str(e)))
     
     def loadGcodeFile(self, file_path):
-        """Load GCODE file"""
+        """Load GCODE file, indexing runs in a background thread"""
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                self.gcode_lines = f.readlines()
-            
-            Logger.log("i", "Successfully loaded GCODE file, {} lines".format(len(self.gcode_lines)))
-            self.gcode_display.setPlainText("GCODE file loaded successfully, {} lines".format(len(self.gcode_lines)))
+            self.closeGcodeFile()
+            self._stopFollowingPlates()
+            self.loadGcodeStore(openGcodeStore(file_path))
+        except Exception as e:
+            Logger.log("e", "Error loading GCODE file: {}".format(e))
+            self.closeGcodeFile()
+            self.gcode_model.setMessage("Failed to load GCODE file:\n{}".format(str(e)))
+            self.status_label.setText("Failed to load GCODE file")
+    
+    def loadGcodeStore(self, store, plate=None):
+        """Show an unindexed IndexedGcodeLines, indexing runs in a background thread
+        
+        plate is (build plate, gcode list, chunk count) for the slice of a
+        build plate; its engine is kept in the plate index cache.
+        """
+        try:
+            self.closeGcodeFile()
+            thread = GcodeLoadThread(store, self._index_cache)
+            thread.plate = plate
+            thread.progressChanged.connect(self.onGcodeLoadProgress)
+            thread.loadFinished.connect(lambda store, thread=thread: self.onGcodeLoaded(thread, store))
+            thread.loadFailed.connect(lambda message, thread=thread: self.onGcodeLoadFailed(thread, message))
+            thread.finished.connect(thread.deleteLater)
+            self._load_thread = thread
+            self._load_started = time.perf_counter()
+            thread.start()
+            
+            self.cancel_load_button.setVisible(True)
+            self.gcode_model.setMessage("Indexing GCODE file...")
+            self.status_label.setText("Indexing GCODE file... 0%")
             
         except Exception as e:
             Logger.log("e", "Error loading GCODE file: {}".format(e))
-            self.gcode_display.setPlainText("Failed to load GCODE file:\n{}".format(str(e)))
+            self.closeGcodeFile()
+            self.gcode_model.setMessage("Failed to load GCODE file:\n{}".format(str(e)))
             self.status_label.setText("Failed to load GCODE file")
     
-    def updateGcodeDisplay(self, current_layer, current_step):
-        """根據當前圖層和步驟更新 GCODE 指令顯示"""
+    def onGcodeLoadProgress(self, percent):
+        """Show indexing progress"""
+        self.status_label.setText("Indexing GCODE file... {}%".format(percent))
+    
+    def onGcodeLoaded(self, thread, engine):
+        """Swap in the finished index"""
+        if thread is not self._load_thread:
+            # 已被新的載入取代
+            engine.close()
+            return
+        self._load_thread = None
+        self.cancel_load_button.setVisible(False)
+        self._diagnostics.record("load_cached" if thread.from_cache else "load", time.perf_counter() - self._load_started)
+        self._engine = engine
+        self.gcode_lines, self.layer_index = engine.store, engine.layer_index
+        self._watchFile(engine.file_path)
+        if thread.plate is not None:
+            self._plate_indexes.setInUse(engine)
+            self._plate_indexes.put(thread.plate[0], thread.plate[1], engine)
+        
+        Logger.log("i", "Successfully loaded GCODE file, {} lines, {} layers{}".format(
+            len(self.gcode_lines), len(self.layer_index), " (index cache hit)" if thread.from_cache else ""))
+        self.gcode_model.setMessage("GCODE file loaded successfully, {} lines".format(len(self.gcode_lines)))
+        self.status_label.setText("GCODE file loaded from index cache" if thread.from_cache else "GCODE file loaded")
+        
+        # 立即顯示目前圖層
+        if self.auto_scroll_checkbox.isChecked():
+            self.updateGcodeDisplay(self._state.current_layer, self._state.current_step)
+        self._startLayerStats()
+        self.updatePreviewInfo()
+        self._enforceMemoryBudget()
+    
+    def onGcodeLoadFailed(self, thread, message):
+        """Report an indexing error"""
+        if thread is not self._load_thread:
+            return
+        self._load_thread = None
+        self.cancel_load_button.setVisible(False)
+        if thread.plate is not None:
+            # 不再自動重試這個切片
+            self._follow_plates = False
+        Logger.log("e", "Error loading GCODE file: {}".format(message))
+        self.gcode_model.setMessage("Failed to load GCODE file:\n{}".format(message))
+        self.status_label.setText("Failed to load GCODE file")
+    
+    def _watchFile(self, file_path):
+        """Watch only file_path, nothing when it is None"""
+        watched = self._file_watcher.files()
+        if watched:
+            self._file_watcher.removePaths(watched)
+        if file_path:
+            self._file_watcher.addPath(file_path)
+    
+    def onGcodeFileChanged(self, file_path):
+        """The loaded file was modified, replaced or removed"""
+        engine = self._engine
+        if engine is None or file_path != engine.file_path:
+            return
+        # 以新檔案取代舊檔案時監看會失效，重新加入
+        if file_path not in self._file_watcher.files() and os.path.exists(file_path):
+            self._file_watcher.addPath(file_path)
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            size = None
+        if size is not None and size < engine.store.getFileSize() and not self._engine_stale:
+            # 就地截短的檔案不能再從 mmap 讀取超過結尾的部分
+            self._stale_view = self._captureView()
+            self._engine_stale = True
+            self._stopPrefetch()
+            self._last_drawn = None
+            self.gcode_model.setMessage("GCODE file changed on disk, re-indexing...")
+        self.status_label.setText("GCODE file changed on disk, re-indexing...")
+        self._refresh_timer.start()
+    
+    def _captureView(self):
+        """(shown layer or None, highlighted rows, scroll position) of the loaded file"""
+        store, layer_num = self.gcode_model.shownLayer()
+        if self._engine is None or store is not self._engine.store:
+            layer_num = None
+        return layer_num, self.gcode_model.highlightRange(), self.gcode_display.verticalScrollBar().value()
+    
+    def _restoreView(self, shown_layer, highlight, scroll_value):
+        """Show the layer again after the index or the filter changed"""
+        if self.auto_scroll_checkbox.isChecked():
+            self.updateGcodeDisplay(self._state.current_layer, self._state.current_step)
+        elif shown_layer is not None and self._engine.hasLayer(shown_layer):
+            # 不自動捲動時重建目前顯示的圖層，保留高亮與捲動位置
+            command_lines, _ = self._layerRenderData(self._engine, shown_layer)
+            self.gcode_model.setLayer(self._engine.store, shown_layer, command_lines)
+            self.gcode_model.setHighlight(*highlight)
+            self.gcode_display.verticalScrollBar().setValue(scroll_value)
+    
+    def onViewFilterChanged(self, index):
+        """Show other lines of the layer, the index already has everything needed"""
+        self._view_filter = self.filter_combo.itemData(index) or DEFAULT_VIEW_FILTER
+        if self._engine is None or self._engine_stale:
+            return
+        shown_layer = self._captureView()[0]
+        if shown_layer is None:
+            # 目前顯示的是訊息（例如沒有符合篩選的行），改用預覽位置的圖層
+            shown_layer = self._state.current_layer
+        self._stopPrefetch()
+        self._render_cache.clear()
+        self._last_drawn = None
+        self.gcode_model.setMessage("")
+        self._restoreView(shown_layer, (0, 0), 0)
+    
+    def startSearch(self):
+        """Search the loaded GCODE for the text in the search bar"""
+        text = self.search_edit.text().strip()
+        if not text:
+            self.clearSearch()
+            return
+        if self._engine is None or self._load_thread is not None:
+            self.status_label.setText("Load a GCODE file before searching")
+            return
+        use_regex = self.regex_checkbox.isChecked()
         try:
-            if not self.gcode_lines:
+            compileQuery(text, use_regex)
+        except re.error as e:
+            self.status_label.setText("Invalid regular expression: {}".format(e))
+            return
+        self._cancelSearch()
+        self.search_model.reset(self._engine)
+        self.search_results_view.setVisible(True)
+        thread = GcodeSearchThread(self._engine, text, use_regex)
+        thread.resultsFound.connect(lambda lines, thread=thread: self.onSearchResults(thread, lines))
+        thread.searchFinished.connect(lambda total, thread=thread: self.onSearchFinished(thread, total))
+        thread.searchFailed.connect(lambda message, thread=thread: self.onSearchFailed(thread, message))
+        thread.finished.connect(thread.deleteLater)
+        self._search_thread = thread
+        self._search_started = time.perf_counter()
+        thread.start()
+        self.status_label.setText("Searching for '{}'...".format(text))
+    
+    def onSearchResults(self, thread, lines):
+        if thread is self._search_thread:
+            self.search_model.appendLines(lines)
+    
+    def onSearchFinished(self, thread, total):
+        if thread is not self._search_thread:
+            return
+        self._search_thread = None
+        self._diagnostics.record("search", time.perf_counter() - self._search_started)
+        limit_text = " (search stopped at {})".format(MAX_SEARCH_RESULTS) if total >= MAX_SEARCH_RESULTS else ""
+        self.status_label.setText("{} lines match '{}'{}".format(total, thread.text, limit_text))
+        self._enforceMemoryBudget()
+    
+    def onSearchFailed(self, thread, message):
+        if thread is not self._search_thread:
+            return
+        self._search_thread = None
+        Logger.log("w", "GCODE search failed: {}".format(message))
+        self.status_label.setText("Search failed: {}".format(message))
+    
+    def _cancelSearch(self):
+        """Stop the running search, it reads the loaded store"""
+        if self._search_thread is not None:
+            thread = self._search_thread
+            self._search_thread = None
+            thread.cancel()
+            thread.wait()
+    
+    def clearSearch(self):
+        self._cancelSearch()
+        self.search_model.reset()
+        self.search_results_view.setVisible(False)
+    
+    def onSearchResultClicked(self, index):
+        if index.isValid():
+            self.jumpToLine(self.search_model.lineAt(index.row()))
+    
+    def jumpToLine(self, line_number):
+        """Show the layer containing a line and select that line"""
+        engine = self._engine
+        if engine is None or self._engine_stale:
+            return
+        layer_num = engine.layerOfLine(line_number)
+        if layer_num is None:
+            self.status_label.setText("Line {} is outside every layer".format(line_number + 1))
+            return
+        command_lines, _ = self._layerRenderData(engine, layer_num)
+        if not self.gcode_model.isShowingLayer(engine.store, layer_num):
+            self.gcode_model.setLayer(engine.store, layer_num, command_lines)
+        # 被篩選掉的行跳到下一個顯示的行
+        row = min(self.gcode_model.rowRange(line_number - 1, line_number)[0], max(self.gcode_model.rowCount() - 1, 0))
+        self.gcode_model.setHighlight(row, row + 1)
+        if self.gcode_model.rowCount():
+            self.gcode_display.scrollTo(self.gcode_model.index(row), QAbstractItemView.PositionAtCenter)
+        # 下一次 SimulationView 更新會重新顯示目前位置
+        self._last_drawn = None
+        self.gcode_commands_label.setText("GCODE Commands for Layer {} (Line {}):".format(layer_num, line_number + 1))
+        self.status_label.setText("Line {} in layer {}".format(line_number + 1, layer_num))
+    
+    def selectCompareFile(self):
+        """Choose a GCODE file to compare the loaded one with"""
+        if self._engine is None or self._engine_stale or self._load_thread is not None:
+            self.status_label.setText("Load a GCODE file or the current slice before comparing")
+            return
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "Compare With GCODE File", "", "GCODE Files (*.gcode *.gcode.gz);;All Files (*)")
+        if file_path:
+            self.startCompare(file_path)
+    
+    def startCompare(self, file_path):
+        """Index file_path in the background and list the layers that differ from the loaded GCODE"""
+        self.closeCompare()
+        thread = GcodeCompareThread(self._engine, file_path, self._index_cache)
+        thread.compareFinished.connect(lambda diff, thread=thread: self.onCompareFinished(thread, diff))
+        thread.compareFailed.connect(lambda message, thread=thread: self.onCompareFailed(thread, message))
+        thread.finished.connect(thread.deleteLater)
+        self._compare_thread = thread
+        thread.start()
+        self.status_label.setText("Comparing with {}...".format(os.path.basename(file_path)))
+    
+    def onCompareFinished(self, thread, diff):
+        if thread is not self._compare_thread:
+            diff.other.close()
+            return
+        self._compare_thread = None
+        self._layer_diff = diff
+        self._diagnostics.record("compare", thread.elapsed)
+        changed = diff.changedLayers()
+        for layer_num in changed:
+            self.change_combo.addItem("Layer {} ({})".format(layer_num, diff.changes[layer_num]), layer_num)
+        if not changed:
+            self.change_combo.addItem("No layer differs")
+        self._setCompareControlsVisible(True)
+        self.diff_view.setVisible(False)
+        name = os.path.basename(thread.file_path)
+        Logger.log("i", "Compared with {}: {} of {} layers differ ({:.2f} s)".format(
+            thread.file_path, len(changed), diff.layer_count, thread.elapsed))
+        self.status_label.setText("{} of {} layers differ from {}".format(len(changed), diff.layer_count, name))
+        self.updatePreviewInfo()
+        self._enforceMemoryBudget()
+    
+    def onCompareFailed(self, thread, message):
+        if thread is not self._compare_thread:
+            return
+        self._compare_thread = None
+        Logger.log("w", "Cannot compare with {}: {}".format(thread.file_path, message))
+        self.status_label.setText("Compare failed: {}".format(message))
+    
+    def closeCompare(self):
+        """Leave compare mode and release the compared file"""
+        if self._compare_thread is not None:
+            thread = self._compare_thread
+            self._compare_thread = None
+            thread.cancel()
+            thread.wait()
+        self._stopLineDiff()
+        if self._layer_diff is not None:
+            self._layer_diff.other.close()
+            self._layer_diff = None
+        self.change_combo.clear()
+        self.diff_view.clear()
+        self._setCompareControlsVisible(False)
+    
+    def _stopLineDiff(self):
+        if self._line_diff_thread is not None:
+            thread = self._line_diff_thread
+            self._line_diff_thread = None
+            # difflib 無法中斷；MAX_DIFF_LINES 限制了等待時間
+            thread.wait()
+    
+    def _comparedFilePath(self):
+        if self._compare_thread is not None:
+            return self._compare_thread.file_path
+        return self._layer_diff.other.file_path if self._layer_diff is not None else None
+    
+    def _setCompareControlsVisible(self, visible):
+        for widget in (self.prev_change_button, self.change_combo, self.next_change_button,
+                       self.close_compare_button, self.diff_view):
+            widget.setVisible(visible)
+    
+    def onChangeMarkerActivated(self, index):
+        layer_num = self.change_combo.itemData(index)
+        if layer_num is not None:
+            self.showLayerDiff(layer_num)
+    
+    def jumpToNextChange(self, direction):
+        """Open the changed layer after (1) or before (-1) the layer shown"""
+        if self._layer_diff is None:
+            return
+        shown_layer = self.gcode_model.shownLayer()[1]
+        if shown_layer is None:
+            shown_layer = self._state.current_layer
+        layer_num = self._layer_diff.nextChange(shown_layer, direction)
+        if layer_num is None:
+            self.status_label.setText("No changed layer {} layer {}".format("after" if direction > 0 else "before", shown_layer))
+            return
+        self.showLayerDiff(layer_num)
+    
+    def showLayerDiff(self, layer_num):
+        """Show a changed layer and compute its line diff in the background"""
+        diff = self._layer_diff
+        if diff is None:
+            return
+        self.change_combo.setCurrentIndex(max(0, self.change_combo.findData(layer_num)))
+        if self._engine.hasLayer(layer_num):
+            self.jumpToLine(self._engine.layerRange(layer_num)[0])
+        self._stopLineDiff()
+        self.diff_view.setPlainText("Comparing the lines of layer {}...".format(layer_num))
+        self.diff_view.setVisible(True)
+        thread = LineDiffThread(diff, layer_num)
+        thread.diffReady.connect(lambda layer_num, lines, thread=thread: self.onLineDiffReady(thread, layer_num, lines))
+        thread.diffFailed.connect(lambda message, thread=thread: self.onLineDiffFailed(thread, message))
+        thread.finished.connect(thread.deleteLater)
+        self._line_diff_thread = thread
+        thread.start()
+    
+    def onLineDiffReady(self, thread, layer_num, lines):
+        if thread is not self._line_diff_thread:
+            return
+        self._line_diff_thread = None
+        removed = sum(1 for line in lines if line.startswith("-"))
+        added = sum(1 for line in lines if line.startswith("+"))
+        self.diff_view.setPlainText("\n".join(lines) if lines else "Layer {} is the same in both files".format(layer_num))
+        self.status_label.setText("Layer {} ({}): {} lines only in the other file, {} lines only in this one".format(
+            layer_num, self._layer_diff.changes.get(layer_num, "unchanged"), removed, added))
+    
+    def onLineDiffFailed(self, thread, message):
+        if thread is not self._line_diff_thread:
+            return
+        self._line_diff_thread = None
+        self.diff_view.setPlainText("Cannot compare the lines of this layer:\n{}".format(message))
+    
+    def refreshGcodeFile(self):
+        """Re-index the loaded file in the background, unchanged layers keep their index"""
+        engine = self._engine
+        if engine is None or engine.file_path is None or self._load_thread is not None:
+            return
+        if self._refresh_thread is not None:
+            self._refresh_pending = True
+            return
+        try:
+            store = openGcodeStore(engine.file_path)
+        except OSError as e:
+            Logger.log("w", "Cannot reload {}: {}".format(engine.file_path, e))
+            self.status_label.setText("GCODE file is no longer available")
+            return
+        thread = GcodeLoadThread(store, self._index_cache, engine)
+        thread.loadFinished.connect(lambda new_engine, thread=thread: self.onGcodeRefreshed(thread, new_engine))
+        thread.loadFailed.connect(lambda message, thread=thread: self.onGcodeRefreshFailed(thread, message))
+        thread.finished.connect(thread.deleteLater)
+        self._refresh_thread = thread
+        self._refresh_started = time.perf_counter()
+        thread.start()
+    
+    def onGcodeRefreshed(self, thread, engine):
+        """Swap in the new index, keeping the shown layer, step and scroll position"""
+        if thread is not self._refresh_thread:
+            engine.close()
+            return
+        self._refresh_thread = None
+        self._diagnostics.record("refresh", time.perf_counter() - self._refresh_started)
+        old_engine = self._engine
+        shown_layer, highlight, scroll_value = self._stale_view if self._engine_stale else self._captureView()
+        self._stopLayerStats()
+        self._stopPrefetch()
+        
+        self._engine = engine
+        self.gcode_lines, self.layer_index = engine.store, engine.layer_index
+        self._engine_stale = False
+        self._stale_view = None
+        self._render_cache.clear()
+        self._last_drawn = None
+        self._restoreView(shown_layer, highlight, scroll_value)
+        # 舊的行儲存即將關閉，畫面不能再參照它
+        if self.gcode_model.shownLayer()[0] is old_engine.store:
+            self.gcode_model.setMessage("GCODE file changed on disk")
+        rerun_search = not self.search_results_view.isHidden()
+        self._cancelSearch()
+        self.search_model.reset()
+        # 比對結果參照舊的 engine，以新版本重新比對
+        compare_path = self._comparedFilePath()
+        self.closeCompare()
+        old_engine.close()
+        self._startLayerStats()
+        self.updatePreviewInfo()
+        if rerun_search:
+            self.startSearch()
+        if compare_path:
+            self.startCompare(compare_path)
+        
+        if engine.from_cache:
+            detail = "index cache"
+        elif engine.reindexed_bytes is not None:
+            detail = "re-indexed {:.1f} of {:.1f} MB".format(engine.reindexed_bytes / 1048576.0, engine.store.getSize() / 1048576.0)
+        else:
+            detail = "full re-index"
+        Logger.log("i", "Reloaded changed GCODE file {} ({}), {} lines, {} layers".format(
+            engine.file_path, detail, len(self.gcode_lines), len(self.layer_index)))
+        self.status_label.setText("GCODE file reloaded ({})".format(detail))
+        
+        if self._refresh_pending:
+            self._refresh_pending = False
+            self._refresh_timer.start()
+    
+    def onGcodeRefreshFailed(self, thread, message):
+        if thread is not self._refresh_thread:
+            return
+        self._refresh_thread = None
+        Logger.log("w", "Error reloading GCODE file: {}".format(message))
+        self.status_label.setText("Failed to reload the changed GCODE file")
+        if self._refresh_pending:
+            self._refresh_pending = False
+            self._refresh_timer.start()
+    
+    def _showPlate(self, plate, gcode_list):
+        """Show the slice of a build plate, from the plate index cache when it is still current"""
+        self._follow_plates = True
+        self._shown_plate = plate
+        engine = self._plate_indexes.get(plate, gcode_list)
+        if engine is None:
+            self.loadGcodeStore(GcodeSliceStore(gcode_list, "Build plate {}".format(plate)), (plate, gcode_list, len(gcode_list)))
+            self.gcode_path_label.setText("GCODE File Path: Current slice, build plate {} (not saved)".format(plate))
+            return
+        if engine is self._engine:
+            return
+        self.closeGcodeFile(keep=engine)
+        self._engine = engine
+        self.gcode_lines, self.layer_index = engine.store, engine.layer_index
+        self.gcode_path_label.setText("GCODE File Path: Current slice, build plate {} (not saved)".format(plate))
+        self.gcode_model.setMessage("")
+        self.status_label.setText("Switched to build plate {}".format(plate))
+        if self.auto_scroll_checkbox.isChecked():
+            self.updateGcodeDisplay(self._state.current_layer, self._state.current_step)
+        if engine.layer_stats is None:
+            self._startLayerStats()
+    
+    def _syncPlate(self, *args):
+        """Follow the active build plate and re-index a plate that was sliced again"""
+        # 步驟數來自目前列印平台的 LayerData，即使顯示的是檔案也要重新讀取
+        self._step_counts_dirty = True
+        if not self._follow_plates:
+            return
+        try:
+            plate, gcode_list = self._activePlateGcode()
+        except Exception as e:
+            self._diagnostics.debugLog("plate.lookup_failed", "Cannot read the active build plate: {}".format(e))
+            return
+        if not gcode_list:
+            if plate != self._shown_plate:
+                self.closeGcodeFile()
+                self._shown_plate = plate
+                self.gcode_path_label.setText("GCODE File Path: Current slice, build plate {} (not sliced)".format(plate))
+                self.gcode_model.setMessage("Build plate {} has no GCODE content, please slice it first".format(plate))
+            return
+        if self._load_thread is not None and self._load_thread.plate is not None:
+            current = self._load_thread.plate
+            if current[0] == plate and current[1] is gcode_list and current[2] == len(gcode_list):
+                return
+        elif plate == self._shown_plate and self._plate_indexes.isCurrent(plate, gcode_list):
+            return
+        self._showPlate(plate, gcode_list)
+    
+    def _stopFollowingPlates(self):
+        """A file replaces the slice, the plate indexes are released"""
+        self._follow_plates = False
+        self._shown_plate = None
+        self._plate_indexes.clear()
+    
+    def cancelGcodeLoading(self):
+        """Cancel the running background load"""
+        if self._load_thread is None:
+            return
+        Logger.log("i", "Cancelled loading GCODE: {}".format(self._load_thread.store.getDisplayName()))
+        self.closeGcodeFile()
+        self._stopFollowingPlates()
+        self.gcode_path_label.setText("GCODE File Path: Not selected")
+        self.gcode_model.setMessage("Loading cancelled, please select a GCODE file")
+        self.status_label.setText("Loading cancelled")
+    
+    def hasGcode(self):
+        """True when a GCODE file is loaded or being indexed"""
+        return bool(self.gcode_lines) or self._load_thread is not None
+    
+    def closeGcodeFile(self, keep=None):
+        """Release the currently loaded GCODE file and stop any running load
+        
+        keep is the plate engine shown next; it stays marked in use so the
+        plate index cache cannot evict it while the old file is released.
+        """
+        if self._load_thread is not None:
+            thread = self._load_thread
+            self._load_thread = None
+            self.cancel_load_button.setVisible(False)
+            # 執行緒在下一個區塊前就會停止，等待時間很短
+            thread.cancel()
+            thread.wait()
+            thread.store.close()
+        self._refresh_timer.stop()
+        self._refresh_pending = False
+        if self._refresh_thread is not None:
+            thread = self._refresh_thread
+            self._refresh_thread = None
+            thread.cancel()
+            thread.wait()
+            thread.store.close()
+        self._watchFile(None)
+        self._stopLayerStats()
+        self._stopPrefetch()
+        self._cancelSearch()
+        self.search_model.reset()
+        self.closeCompare()
+        self._plate_indexes.setInUse(keep)
+        # 列印平台的索引留在快取中，切回該平台時直接使用
+        if self._engine is not None and not self._plate_indexes.owns(self._engine):
+            self._engine.close()
+        self._engine = None
+        self._engine_stale = False
+        self._stale_view = None
+        self.gcode_lines = []
+        self.layer_index = {}
+        self._render_cache.clear()
+        self._last_drawn = None
+        self._settle_timer.stop()
+        self._deferred_texts = {}
+        self._enforceMemoryBudget()
+    
+    def updateGcodeDisplay(self, current_layer, current_step, deadline=None):
+        """根據當前圖層和步驟更新 GCODE 指令顯示；超過 deadline 時延後文字更新"""
+        try:
+            if not self.hasGcode():
                 return
             
             # Check if auto scroll is enabled before updating display
             if not self.auto_scroll_checkbox.isChecked():
-                Logger.log("d", "Auto scroll disabled, skipping GCODE display update")
+                self._diagnostics.debugLog("display.auto_scroll_disabled", "Auto scroll disabled, skipping GCODE display update")
                 return
             
-            # 步驟1：先讀取該層有多少 STEP
-            layer_commands = self.findLayerCommands(current_layer, 0)  # 獲取該層所有指令
-            if not layer_commands or len(layer_commands) == 0:
-                self.gcode_display.setPlainText("No GCODE commands found for layer {}".format(current_layer))
-                self.status_label.setText("No GCODE commands found for layer {}".format(current_layer))
+            # 檔案、圖層、步驟都沒變時不做任何事
+            lookup_started = time.perf_counter()
+            engine, message = self._layerSource(current_layer)
+            gcode_lines = engine.store
+            draw_key = (gcode_lines, current_layer, current_step)
+            if draw_key == self._last_drawn:
                 return
+            previous_drawn, self._last_drawn = self._last_drawn, None
             
-            # 步驟2：獲取該層的實際步驟數
-            total_commands = len(layer_commands)
-            total_steps = self.getLayerStepCount(current_layer)
-            
-            # 如果無法獲取步驟數，使用備用方法
-            if total_steps <= 0:
-                # 根據 GCODE 指令數量估算步驟數
-                # 假設每 5-10 個指令為一個步驟
-                total_steps = max(1, total_commands // 8)  # 平均每8個指令一個步驟
-                Logger.log("d", "無法獲取圖層 {} 的實際步驟數，使用估算值: {}".format(current_layer, total_steps))
-            
-            # 計算每個步驟對應的指令範圍
-            commands_per_step = max(1, total_commands // max(1, total_steps))
-            
-            # 步驟3：拉動時依照指令編號來高亮與跳到對應行號
-            if current_step > 0 and current_step <= total_steps:
-                # 計算當前步驟對應的指令範圍
-                start_idx = (current_step - 1) * commands_per_step
-                end_idx = min(start_idx + commands_per_step, total_commands)
-            else:
-                start_idx = 0
-                end_idx = total_commands
-            
-            # 調試信息
-            Logger.log("d", "圖層 {} 步驟 {} - 總指令: {}, 總步驟: {}, 每步驟指令: {}, 範圍: {}-{}".format(
-                current_layer, current_step, total_commands, total_steps, commands_per_step, start_idx + 1, end_idx))
-            
-            # Use HTML format for display with highlighting support
-            html_text = "<h3>GCODE Commands for Layer {} Step {}:</h3><br>".format(current_layer, current_step)
-            
-            # 添加指令，當前步驟的指令用高亮顯示
-            for i, command in enumerate(layer_commands):
-                command_number = i + 1  # 指令編號從1開始
-                if start_idx <= i < end_idx:
-                    # 當前步驟的指令 - 高亮顯示（黃色背景）
-                    html_text += '<div id="highlight-{}" style="background-color: #ffff00; padding: 4px; margin: 2px; border-radius: 4px; font-weight: bold; border-left: 4px solid #ff6b00;">{}</div>'.format(i, command)
-                else:
-                    # 其他指令 - 正常顯示（淺灰色背景）
-                    html_text += '<div style="background-color: #f0f0f0; padding: 4px; margin: 2px; border-radius: 4px; color: #666;">{}</div>'.format(command)
-            
-            # Add step information
-            html_text += '<br><div style="background-color: #e3f2fd; padding: 8px; border-radius: 4px; font-size: 12px; color: #1976d2;">'
-            html_text += 'Display range: Commands {} - {} (Total: {} commands)'.format(start_idx + 1, end_idx, total_commands)
-            html_text += '</div>'
-            
-            # Store current scroll position if auto scroll is disabled
-            current_scroll_position = 0
-            if not self.auto_scroll_checkbox.isChecked():
-                scrollbar = self.gcode_display.verticalScrollBar()
-                if scrollbar:
-                    current_scroll_position = scrollbar.value()
-                    Logger.log("d", "Storing current scroll position: {}".format(current_scroll_position))
-            
-            self.gcode_display.setHtml(html_text)
+            if message:
+                self.gcode_model.setMessage(message)
+                self._showText(self.status_label, message, deadline)
+                return
             
-            # Restore scroll position if auto scroll is disabled
-            if not self.auto_scroll_checkbox.isChecked() and current_scroll_position > 0:
-                def restoreScrollPosition():
-                    scrollbar = self.gcode_display.verticalScrollBar()
-                    if scrollbar:
-                        scrollbar.setValue(current_scroll_position)
-                        Logger.log("d", "Restored scroll position to: {}".format(current_scroll_position))
-                from PyQt5.QtCore import QTimer
-                QTimer.singleShot(100, restoreScrollPosition)  # Small delay to ensure HTML is rendered
+            # 步驟1：由索引取得該層的指令行號，以及每個路徑對應的行號
+            command_lines, step_lines = self._layerRenderData(engine, current_layer)
+            step_range = engine.stepLineRange(current_layer, current_step, step_lines)
+            render_started = time.perf_counter()
+            self._diagnostics.record("lookup", render_started - lookup_started)
+            
+            # 步驟2：切換圖層時才重建清單，同一圖層只更新高亮
+            if not self.gcode_model.isShowingLayer(gcode_lines, current_layer):
+                if len(command_lines) == 0:
+                    if self._view_filter == DEFAULT_VIEW_FILTER:
+                        message = "No GCODE commands found for layer {}".format(current_layer)
+                    else:
+                        message = "No lines of layer {} match the filter".format(current_layer)
+                    self.gcode_model.setMessage(message)
+                    self._showText(self.status_label, message, deadline)
+                    return
+                self.gcode_model.setLayer(gcode_lines, current_layer, command_lines)
+            total_commands = self.gcode_model.rowCount()
+            
+            # 步驟3：高亮該步驟的移動指令及其前面的非移動指令
+            if step_range is not None:
+                start_idx, end_idx = self.gcode_model.rowRange(*step_range)
+                step_text = "Line {} (Path {}/{}) - Display commands {}-{}".format(
+                    step_range[1] + 1, min(current_step, len(step_lines)), len(step_lines), start_idx + 1, end_idx)
+            else:
+                start_idx, end_idx = 0, 0
+                step_text = "No path selected ({} paths)".format(len(step_lines))
             
-            # Update status bar
-            self.status_label.setText("Layer {} Step {} - Display commands {}-{} (Total: {})".format(
-                current_layer, current_step, start_idx + 1, end_idx, total_commands))
+            self.gcode_model.setHighlight(start_idx, end_idx)
+            self._diagnostics.record("render", time.perf_counter() - render_started)
             
             # Auto scroll to highlighted line only if checkbox is checked
             if self.auto_scroll_checkbox.isChecked():
                 self.autoScrollToHighlight(start_idx, total_commands)
+            
+            # 標題與狀態列只是說明文字，時間不夠時等停止捲動再更新
+            self._showText(self.gcode_commands_label,
+                           "GCODE Commands for Layer {} Step {}:".format(current_layer, current_step), deadline)
+            self._showText(self.status_label, "Layer {} Step {} - {} (Total: {})".format(
+                current_layer, current_step, step_text, total_commands), deadline)
+            
+            if previous_drawn is None or previous_drawn[1] != current_layer:
+                self._schedulePrefetch(engine, current_layer)
+            self._last_drawn = draw_key
                 
         except Exception as e:
             Logger.log("e", "Error updating GCODE display: {}".format(e))
@@ -669,127 +2100,110 @@ class LayerPreviewWidget(QWidget):
         try:
             # Check if auto scroll is enabled before proceeding
             if not self.auto_scroll_checkbox.isChecked():
-                Logger.log("d", "Auto scroll disabled, skipping scroll operation")
+                self._diagnostics.debugLog("scroll.auto_scroll_disabled", "Auto scroll disabled, skipping scroll operation")
                 return
-                
-            from PyQt5.QtCore import QTimer
-            from PyQt5.QtGui import QTextCursor
-            
-            def scrollToPosition():
-                try:
-                    # Triple check auto scroll status before executing
-                    if not self.auto_scroll_checkbox.isChecked():
-                        Logger.log("d", "Auto scroll was disabled during delay, cancelling scroll")
-                        return
-                    
-                    # Additional check to ensure the widget is still valid
-                    if not hasattr(self, 'gcode_display') or self.gcode_display is None:
-                        Logger.log("d", "GCODE display widget no longer valid, cancelling scroll")
-                        return
-                        
-                    if total_commands > 0 and start_idx < total_commands:
-                        # Method 1: Use scrollbar for precise scrolling
-                        scrollbar = self.gcode_display.verticalScrollBar()
-                        if scrollbar and self.auto_scroll_checkbox.isChecked():  # Final check
-                            estimated_line_height = 35  # pixels
-                            target_position = start_idx * estimated_line_height
-                            max_scroll = scrollbar.maximum()
-                            target_position = min(target_position, max_scroll)
-                            scrollbar.setValue(target_position)
-                            Logger.log("d", "Scrolled to position: {} (command index: {}, max: {})".format(target_position, start_idx, max_scroll))
-                            
-                            # Method 2: Use cursor as backup (only if auto scroll is still enabled)
-                            if self.auto_scroll_checkbox.isChecked():
-                                try:
-                                    cursor = self.gcode_display.textCursor()
-                                    cursor.movePosition(QTextCursor.Start)
-                                    for i in range(start_idx + 2):  # +2 for title and empty line
-                                        cursor.movePosition(QTextCursor.Down)
-                                    self.gcode_display.setTextCursor(cursor)
-                                    self.gcode_display.ensureCursorVisible()
-                                    Logger.log("d", "Used cursor to scroll to line: {}".format(start_idx + 2))
-                                except Exception as e:
-                                    Logger.log("d", "Cursor scroll failed: {}".format(e))
-                except Exception as e:
-                    Logger.log("d", "Error during auto scroll: {}".format(e))
             
-            # Only set up the timer if auto scroll is still enabled
-            if self.auto_scroll_checkbox.isChecked():
-                QTimer.singleShot(500, scrollToPosition)
-            else:
-                Logger.log("d", "Auto scroll disabled before timer setup, cancelling")
+            # 列高固定，直接跳到目標列
+            if total_commands > 0 and start_idx < total_commands:
+                with self._diagnostics.measure("scroll"):
+                    self.gcode_display.scrollTo(self.gcode_model.index(start_idx), QAbstractItemView.PositionAtTop)
         except Exception as e:
-            Logger.log("e", "Error setting up auto scroll: {}".format(e))
+            Logger.log("e", "Error during auto scroll: {}".format(e))
+    
+    def copySelectedCommands(self):
+        """Copy the selected rows to the clipboard"""
+        rows = sorted(index.row() for index in self.gcode_display.selectionModel().selectedIndexes())
+        if rows:
+            text = "\n".join(self.gcode_model.data(self.gcode_model.index(row)) for row in rows)
+            QApplication.clipboard().setText(text)
+    
+    def _layerRenderData(self, engine, layer_num):
+        """(指令行號, 路徑行號)，最近看過的圖層直接取自快取"""
+        render_data = self._render_cache.get((layer_num, self._view_filter))
+        if render_data is None:
+            render_data = (engine.filteredLines(layer_num, self._view_filter), engine.stepLines(layer_num))
+            self._render_cache.put((layer_num, self._view_filter), render_data)
+        return render_data
+    
+    def _schedulePrefetch(self, engine, layer_num):
+        """Prepare the layers the slider is likely to reach next"""
+        if engine is not self._engine or self._engine_stale or self._load_thread is not None:
+            return
+        if self._memory.headroom() < self._render_cache.getMaxBytes() // 2:
+            # 預取的圖層只會再被釋放掉
+            self._stopPrefetch()
+            return
+        thread = self._prefetch_thread
+        if thread is None or thread.engine is not engine or thread.view_filter != self._view_filter:
+            self._stopPrefetch()
+            # 每輪最多用掉一半的快取，不會擠掉剛排入的鄰近圖層
+            thread = LayerPrefetchThread(engine, self._view_filter, self._render_cache.getMaxBytes() // 2)
+            thread.layerPrepared.connect(lambda layer_num, render_data, elapsed, thread=thread:
+                                         self.onLayerPrefetched(thread, layer_num, render_data, elapsed))
+            thread.prefetchFailed.connect(lambda message, thread=thread: self.onPrefetchFailed(thread, message))
+            thread.finished.connect(thread.deleteLater)
+            self._prefetch_thread = thread
+            self._prefetch_layers = [layer for layer, _, _ in engine.layerRanges()]
+            self._prefetch_planner.reset()
+            thread.start()
+        planner = self._prefetch_planner
+        planner.max_ahead = max(planner.min_ahead, self._render_cache.getMaxSize() // 2 - 1)
+        layers = planner.plan(self._prefetch_layers, layer_num)
+        thread.schedule([layer for layer in layers if (layer, self._view_filter) not in self._render_cache])
+    
+    def _stopPrefetch(self):
+        if self._prefetch_thread is not None:
+            thread = self._prefetch_thread
+            self._prefetch_thread = None
+            # 最多等目前這一層準備完
+            thread.cancel()
+            thread.wait()
     
+    def onLayerPrefetched(self, thread, layer_num, render_data, elapsed):
+        if thread is not self._prefetch_thread:
+            return
+        self._diagnostics.record("prefetch", elapsed)
+        key = (layer_num, thread.view_filter)
+        if key not in self._render_cache:
+            self._render_cache.put(key, render_data, prefetched=True)
+    
+    def onPrefetchFailed(self, thread, message):
+        if thread is not self._prefetch_thread:
+            return
+        self._prefetch_thread = None
+        self._diagnostics.debugLog("prefetch_failed", "Layer prefetch stopped: {}".format(message))
+    
+    def _layerSource(self, layer_num):
+        """(GcodeEngine, 訊息)；索引進行中只提供已完成的圖層"""
+        engine = self._engine
+        if self._engine_stale:
+            return engine, "GCODE file changed on disk, re-indexing..."
+        if self._load_thread is not None:
+            engine = self._load_thread.engine
+            if not engine.hasLayer(layer_num):
+                return engine, "Layer {} is still being indexed ({}%)".format(layer_num, self._load_thread.progress)
+        if not engine.hasLayer(layer_num):
+            return engine, "No layer {} marker found".format(layer_num)
+        return engine, None
     
     def findLayerCommands(self, layer_num, step_num):
         """尋找指定圖層的 GCODE 指令"""
+        with self._diagnostics.measure("find_commands"):
+            return self._findLayerCommands(layer_num, step_num)
+    
+    def _findLayerCommands(self, layer_num, step_num):
         try:
-            commands = []
-            layer_start_found = False
-            
-            # 尋找圖層開始標記
-            layer_marker = ";LAYER:{}".format(layer_num)
-            layer_start_index = -1
-            
-            for i, line in enumerate(self.gcode_lines):
-                if layer_marker in line:
-                    layer_start_index = i
-                    layer_start_found = True
-                    break
-            
-            if not layer_start_found:
-                # 如果沒找到標準的圖層標記，嘗試其他格式
-                for i, line in enumerate(self.gcode_lines):
-                    if "; LAYER:{}".format(layer_num) in line or "LAYER:{}".format(layer_num) in line:
-                        layer_start_index = i
-                        layer_start_found = True
-                        break
-            
-            if not layer_start_found:
-                return ["No layer {} marker found".format(layer_num)]
-            
-            # 從圖層開始位置尋找指令
-            start_line = max(0, layer_start_index)
-            end_line = min(len(self.gcode_lines), layer_start_index + 200)  # 增加搜尋範圍
-            
-            # 收集所有 G 和 M 指令
-            all_commands = []
-            for i in range(start_line, end_line):
-                line = self.gcode_lines[i].strip()
-                
-                # 跳過空行和註釋
-                if not line or line.startswith(';'):
-                    continue
-                
-                # 檢查是否到達下一個圖層
-                if i > layer_start_index and (";LAYER:" in line or "; LAYER:" in line):
-                    break
-                
-                # 收集 G 和 M 指令
-                if line.startswith('G') or line.startswith('M'):
-                    all_commands.append("( Layer {} / Step {} ) {}".format(layer_num, i + 1, line))
-            
+            # 直接從載入時建立的圖層索引取得範圍；索引進行中只讀取已完成的圖層
+            engine, message = self._layerSource(layer_num)
+            if message:
+                return [message]
+            
+            # 指定步驟時只取該步驟的指令（step_num 為 0 時返回整層）
+            all_commands = ["( Layer {} / Step {} ) {}".format(layer_num, line + 1, command)
+                            for line, command in engine.layerCommands(layer_num, step_num)]
             if not all_commands:
                 return ["No GCODE commands found in layer {}".format(layer_num)]
-            
-            # 如果 step_num 為 0，返回所有指令
-            if step_num == 0:
-                return all_commands
-            
-            # 如果指定了步驟數，返回該步驟的指令
-            total_commands = len(all_commands)
-            if step_num > 0 and total_commands > 0:
-                # 計算每個步驟的指令數量
-                commands_per_step = max(1, total_commands // step_num)
-                start_idx = (step_num - 1) * commands_per_step
-                end_idx = min(start_idx + commands_per_step, total_commands)
-                
-                # 返回當前步驟的指令
-                return all_commands[start_idx:end_idx]
-            else:
-                # 如果沒有指定步驟，返回所有指令
-                return all_commands
+            return all_commands
             
         except Exception as e:
             Logger.log("e", "Error finding layer commands: {}".format(e))
@@ -801,21 +2215,89 @@ class LayerPreviewPlugin(Extension):
     def __init__(self):
         super().__init__()
         self._preview_widget = None
-        self._current_layer = 0
-        self._current_step = 0
-        self._total_layers = 0
-        self._total_steps = 0
+        self._state = LayerPreviewState()
+        self._simulation_view = None  # SimulationView whose signals are connected
+        self._polling_fallback_logged = False
+        self._diagnostics = Diagnostics(Logger.log)  # timing counters shown in the preview window
         
         # Add menu item
         self.addMenuItem("Show Layer Preview", self.showPreviewWindow)
         
-        # Setup timer
+        preferences = CuraApplication.getInstance().getPreferences()
+        preferences.addPreference(RENDER_CACHE_SIZE_PREFERENCE, DEFAULT_RENDER_CACHE_SIZE)
+        preferences.addPreference(INDEX_CACHE_SIZE_PREFERENCE, DEFAULT_INDEX_CACHE_SIZE_MB)
+        preferences.addPreference(TEMP_GCODE_SIZE_PREFERENCE, DEFAULT_TEMP_GCODE_SIZE_MB)
+        preferences.addPreference(TEMP_GCODE_AGE_PREFERENCE, DEFAULT_TEMP_GCODE_MAX_AGE_DAYS)
+        preferences.addPreference(PREFETCH_MEMORY_PREFERENCE, DEFAULT_PREFETCH_MEMORY_MB)
+        preferences.addPreference(PLATE_INDEX_MEMORY_PREFERENCE, DEFAULT_PLATE_INDEX_MEMORY_MB)
+        preferences.addPreference(MEMORY_LIMIT_PREFERENCE, DEFAULT_MEMORY_LIMIT_MB)
+        preferences.addPreference(VERBOSE_LOGGING_PREFERENCE, False)
+        self._readVerboseLogging()
+        preferences.preferenceChanged.connect(self._onPreferenceChanged)
+        
+        # 後備輪詢：只在 SimulationView 沒有變更訊號時，且視窗顯示中才啟動
         self.update_timer = QTimer()
-        self.update_timer.timeout.connect(self._updatePreviewInfo)
-        self.update_timer.start(500)  # Update every 500ms
+        self.update_timer.setInterval(500)  # Update every 500ms
+        self.update_timer.timeout.connect(self._onPollTimer)
+        
+        # SimulationView 可能比本插件晚載入，等引擎建立後再連接訊號
+        CuraApplication.getInstance().engineCreatedSignal.connect(self._connectSimulationView)
         
         Logger.log("i", "pz_cura_gcode_preview plugin initialized")
     
+    def _readVerboseLogging(self):
+        value = CuraApplication.getInstance().getPreferences().getValue(VERBOSE_LOGGING_PREFERENCE)
+        # 偏好設定檔中的值可能是字串
+        self._diagnostics.verbose = value is True or str(value).lower() == "true"
+    
+    def _onPreferenceChanged(self, key):
+        if key == VERBOSE_LOGGING_PREFERENCE:
+            self._readVerboseLogging()
+    
+    def _connectSimulationView(self):
+        """Subscribe to SimulationView change signals, returns False when unavailable"""
+        if self._simulation_view is not None:
+            return True
+        try:
+            app = CuraApplication.getInstance()
+            simulation_view = app.getPluginRegistry().getPluginObject("SimulationView")
+            if not simulation_view:
+                return False
+            
+            signals = [getattr(simulation_view, name, None) for name in SIMULATION_VIEW_SIGNALS]
+            if not all(hasattr(signal, "connect") for signal in signals):
+                if not self._polling_fallback_logged:
+                    self._polling_fallback_logged = True
+                    Logger.log("w", "SimulationView has no change signals, falling back to polling")
+                return False
+            
+            for signal in signals:
+                signal.connect(self._onSimulationViewChanged)
+            self._simulation_view = simulation_view
+            Logger.log("i", "Connected to SimulationView change signals")
+            
+            self._updatePreviewInfo()
+            return True
+            
+        except Exception as e:
+            self._diagnostics.debugLog("connect_failed", "連接 SimulationView 訊號失敗: {}".format(e))
+            return False
+    
+    def _onSimulationViewChanged(self, *args):
+        """SimulationView layer/path changed"""
+        self._updatePreviewInfo()
+    
+    def _onPollTimer(self):
+        """Fallback polling for Cura versions without SimulationView signals"""
+        # 訊號可用後就不再輪詢
+        if self._connectSimulationView():
+            self.update_timer.stop()
+            return
+        if not (self._preview_widget and self._preview_widget.isVisible()):
+            self.update_timer.stop()
+            return
+        self._updatePreviewInfo()
+    
     def _updatePreviewInfo(self):
         """Update preview information - Simplified version"""
         try:
@@ -824,26 +2306,12 @@ class LayerPreviewPlugin(Extension):
                 return
                 
             # 獲取當前圖層和步驟
-            current_layer, current_step = self._getCurrentPreviewLayerAndStep()
-            total_layers, total_steps = self._getTotalLayersAndSteps()
-            
-            # 更新內部狀態
-            self._current_layer = current_layer
-            self._current_step = current_step
-            self._total_layers = total_layers
-            self._total_steps = total_steps
-                
-            # 如果預覽視窗存在且可見，更新信息
-            if self._preview_widget and self._preview_widget.isVisible():
-                try:
-                    self._preview_widget.updateLayerInfo(
-                        self._current_layer, 
-                        self._current_step, 
-                        self._total_layers, 
-                        self._total_steps
-                    )
-                except Exception as e:
-                    Logger.log("d", "更新UI時發生錯誤: {}".format(e))
+            with self._diagnostics.measure("poll"):
+                current_layer, current_step = self._getCurrentPreviewLayerAndStep()
+                total_layers, total_steps = self._getTotalLayersAndSteps()
+            
+            # 更新共用狀態；有變更時會通知預覽視窗
+            self._state.update(current_layer, current_step, total_layers, total_steps)
             
         except Exception as e:
             Logger.log("e", "更新預覽信息時發生錯誤: {}".format(e))
@@ -852,23 +2320,17 @@ class LayerPreviewPlugin(Extension):
         """Show preview window"""
         try:
             if self._preview_widget is None:
-                self._preview_widget = LayerPreviewWidget()
+                self._preview_widget = LayerPreviewWidget(self._state, self._diagnostics)
+            
+            # 立即更新一次信息
+            self._updatePreviewInfo()
+            if not self._connectSimulationView():
+                self.update_timer.start()
             
             self._preview_widget.show()
             self._preview_widget.raise_()
             self._preview_widget.activateWindow()
             
-            # 立即更新一次信息
-            try:
-                self._preview_widget.updateLayerInfo(
-                    self._current_layer, 
-                    self._current_step, 
-                    self._total_layers, 
-                    self._total_steps
-                )
-            except Exception as e:
-                Logger.log("d", "立即更新UI時發生錯誤: {}".format(e))
-            
             Logger.log("i", "顯示圖層預覽視窗")
             
         except Exception as e:
@@ -887,13 +2349,13 @@ class LayerPreviewPlugin(Extension):
                 
             # 嘗試從 SimulationView 獲取
             try:
-                simulation_view = app.getPluginRegistry().getPluginObject("SimulationView")
+                simulation_view = self._simulation_view or app.getPluginRegistry().getPluginObject("SimulationView")
                 if simulation_view:
                     current_layer = simulation_view.getCurrentLayer()
                     current_step = simulation_view.getCurrentPath()
                     return current_layer, current_step
             except Exception as e:
-                Logger.log("d", "從 SimulationView 獲取失敗: {}".format(e))
+                self._diagnostics.debugLog("poll.position_failed", "從 SimulationView 獲取失敗: {}".format(e))
             
             return 0, 0
             
@@ -910,13 +2372,13 @@ class LayerPreviewPlugin(Extension):
                 
             # 嘗試從 SimulationView 獲取
             try:
-                simulation_view = app.getPluginRegistry().getPluginObject("SimulationView")
+                simulation_view = self._simulation_view or app.getPluginRegistry().getPluginObject("SimulationView")
                 if simulation_view:
                     total_layers = simulation_view.getMaxLayers()
                     total_steps = simulation_view.getMaxPaths()
                     return total_layers, total_steps
             except Exception as e:
-                Logger.log("d", "從 SimulationView 獲取總數失敗: {}".format(e))
+                self._diagnostics.debugLog("poll.totals_failed", "從 SimulationView 獲取總數失敗: {}".format(e))
             
             return 0, 0
             
@@ -0,0 +1,99 @@
+from collections import OrderedDict
+
+
+def _valueBytes(value):
+    """render data 中所有陣列的位元組數"""
+    parts = value if isinstance(value, tuple) else (value,)
+    return sum(getattr(part, "nbytes", 0) for part in parts)
+
+
+class LayerRenderCache:
+    """Bounded LRU cache of per-layer render data
+
+    Bounded by the number of entries and, when max_bytes is set, by the
+    total size of their arrays. Entries added with prefetched=True are
+    counted: prefetch_hits when they are read, prefetch_wasted when they
+    are evicted unread.
+    """
+
+    def __init__(self, max_size=32, max_bytes=None):
+        self._max_size = max(1, int(max_size))
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._prefetched = set()  # 預取後尚未讀取的項目
+        self.prefetch_hits = 0
+        self.prefetch_wasted = 0
+
+    def get(self, key):
+        """取得快取資料並標記為最近使用，不存在時返回 None"""
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+            if key in self._prefetched:
+                self._prefetched.discard(key)
+                self.prefetch_hits += 1
+        return value
+
+    def put(self, key, value, prefetched=False):
+        """加入資料，超過上限時淘汰最久未使用的項目"""
+        self._bytes -= self._sizes.get(key, 0)
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        self._sizes[key] = _valueBytes(value)
+        self._bytes += self._sizes[key]
+        if prefetched:
+            self._prefetched.add(key)
+        else:
+            self._prefetched.discard(key)
+        self._evict()
+
+    def _evict(self):
+        # 至少保留最近加入的項目
+        while len(self._entries) > self._max_size or (
+                self._max_bytes is not None and self._bytes > self._max_bytes and len(self._entries) > 1):
+            key, _ = self._entries.popitem(last=False)
+            self._bytes -= self._sizes.pop(key)
+            if key in self._prefetched:
+                self._prefetched.discard(key)
+                self.prefetch_wasted += 1
+
+    def release(self, bytes_to_free):
+        """淘汰最久未使用的項目直到釋放 bytes_to_free，保留最近加入的項目"""
+        target = self._bytes - bytes_to_free
+        while len(self._entries) > 1 and self._bytes > target:
+            key, _ = self._entries.popitem(last=False)
+            self._bytes -= self._sizes.pop(key)
+            if key in self._prefetched:
+                self._prefetched.discard(key)
+                self.prefetch_wasted += 1
+
+    def setMaxSize(self, max_size):
+        self._max_size = max(1, int(max_size))
+        self._evict()
+
+    def getMaxSize(self):
+        return self._max_size
+
+    def setMaxBytes(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._evict()
+
+    def getMaxBytes(self):
+        return self._max_bytes
+
+    def getMemoryUsage(self):
+        return self._bytes
+
+    def clear(self):
+        self._entries.clear()
+        self._sizes.clear()
+        self._prefetched.clear()
+        self._bytes = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
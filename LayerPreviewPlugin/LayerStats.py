@@ -0,0 +1,141 @@
+import numpy
+
+from .GcodeMoveTable import GcodeMoveTable, NO_LAYER
+
+# 佔比低於此值的特徵類型不列出
+MIN_FEATURE_SHARE = 0.01
+
+
+def formatDuration(seconds):
+    """75.4 -> '1m 15s'"""
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return "{}s".format(seconds)
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return "{}m {:02d}s".format(minutes, seconds)
+    hours, minutes = divmod(minutes, 60)
+    return "{}h {:02d}m".format(hours, minutes)
+
+
+class LayerStats:
+    """Per-layer statistics computed from a GcodeMoveTable in one vectorized pass
+
+    Every statistic is an array with one entry per layer, in the order of
+    layer_numbers, so looking up a layer is a dictionary access. Distances
+    are in mm, extrusion is filament length in mm (retractions not
+    counted), feedrates are in mm/min. G2/G3 arcs are measured by their
+    chord, and the time is estimated at the programmed feedrates without
+    acceleration, so it is a lower bound of the real layer time.
+    """
+
+    def __init__(self, layer_numbers, move_count, extrusion, extrude_distance, travel_distance,
+                 min_feedrate, max_feedrate, time, feature_time, feature_names):
+        self.layer_numbers = layer_numbers
+        self.move_count = move_count
+        self.extrusion = extrusion
+        self.extrude_distance = extrude_distance  # XYZ 擠出路徑長度
+        self.travel_distance = travel_distance  # 不擠出的移動距離
+        self.min_feedrate = min_feedrate  # 沒有任何移動的圖層為 NaN
+        self.max_feedrate = max_feedrate
+        self.time = time  # 估計的秒數
+        self.feature_time = feature_time  # (圖層, 特徵) 估計的秒數
+        self.feature_names = feature_names
+        self._rows = {int(layer_num): row for row, layer_num in enumerate(layer_numbers)}
+
+    @classmethod
+    def fromMoveTable(cls, table):
+        """Compute the statistics of every layer of a GcodeMoveTable"""
+        position = numpy.stack((table.x, table.y, table.z), axis=1).astype(numpy.float64)
+        # 第一個移動的起點未知，距離視為 0
+        delta = numpy.diff(position, axis=0, prepend=position[:1])
+        distance = numpy.sqrt((delta * delta).sum(axis=1))
+        e = table.e.astype(numpy.float64)
+        feedrate = table.f.astype(numpy.float64)
+        moved = (distance > 0) | (e != 0)
+        extruding = (e > 0) & (distance > 0)
+
+        # 只有回抽/裝填的移動以 E 的長度計時
+        speed = feedrate / 60.0
+        path = numpy.where(distance > 0, distance, numpy.abs(e))
+        time = numpy.divide(path, speed, out=numpy.zeros_like(path), where=speed > 0)
+
+        in_layer = table.layer != NO_LAYER
+        layer_numbers, rows = numpy.unique(table.layer[in_layer], return_inverse=True)
+        layer_count = len(layer_numbers)
+
+        def perLayer(weights):
+            return numpy.bincount(rows, weights=weights[in_layer], minlength=layer_count)
+
+        # 最小/最大進給率：依圖層排序後分段取值，沒有移動的圖層為 NaN
+        min_feedrate = numpy.full(layer_count, numpy.nan)
+        max_feedrate = numpy.full(layer_count, numpy.nan)
+        counted = moved[in_layer] & (feedrate[in_layer] > 0)
+        counted_rows = rows[counted]
+        if len(counted_rows):
+            order = numpy.argsort(counted_rows, kind="stable")
+            sorted_rows = counted_rows[order]
+            sorted_feedrates = feedrate[in_layer][counted][order]
+            starts = numpy.flatnonzero(numpy.diff(sorted_rows, prepend=-1))
+            present = sorted_rows[starts]
+            min_feedrate[present] = numpy.minimum.reduceat(sorted_feedrates, starts)
+            max_feedrate[present] = numpy.maximum.reduceat(sorted_feedrates, starts)
+
+        feature_count = len(table.feature_names)
+        feature_time = numpy.bincount(rows * feature_count + table.feature[in_layer], weights=time[in_layer],
+                                      minlength=layer_count * feature_count).reshape(layer_count, feature_count)
+
+        return cls(
+            layer_numbers=layer_numbers.astype(numpy.int32),
+            move_count=numpy.bincount(rows, minlength=layer_count).astype(numpy.uint32),
+            extrusion=perLayer(numpy.maximum(e, 0.0)).astype(numpy.float32),
+            extrude_distance=perLayer(numpy.where(extruding, distance, 0.0)).astype(numpy.float32),
+            travel_distance=perLayer(numpy.where(extruding, 0.0, distance)).astype(numpy.float32),
+            min_feedrate=min_feedrate.astype(numpy.float32),
+            max_feedrate=max_feedrate.astype(numpy.float32),
+            time=perLayer(time).astype(numpy.float32),
+            feature_time=feature_time.astype(numpy.float32),
+            feature_names=list(table.feature_names),
+        )
+
+    @classmethod
+    def fromLines(cls, gcode_lines, progress_callback=None, is_cancelled=None, workers=1):
+        """Parse the moves of an indexed IndexedGcodeLines and compute the statistics"""
+        return cls.fromMoveTable(GcodeMoveTable.fromLines(gcode_lines, progress_callback, is_cancelled, workers))
+
+    def __len__(self):
+        return len(self.layer_numbers)
+
+    def hasLayer(self, layer_num):
+        return layer_num in self._rows
+
+    def layerStats(self, layer_num):
+        """Statistics of one layer as a dict, None for a layer without moves"""
+        row = self._rows.get(layer_num)
+        if row is None:
+            return None
+        layer_time = float(self.time[row])
+        min_feedrate, max_feedrate = float(self.min_feedrate[row]), float(self.max_feedrate[row])
+        features = []
+        if layer_time > 0:
+            for feature, seconds in enumerate(self.feature_time[row]):
+                if seconds / layer_time >= MIN_FEATURE_SHARE:
+                    features.append((self.feature_names[feature] or "(none)", float(seconds / layer_time)))
+            features.sort(key=lambda item: -item[1])
+        return {
+            "layer": layer_num,
+            "moves": int(self.move_count[row]),
+            "extrusion_mm": float(self.extrusion[row]),
+            "extrude_distance_mm": float(self.extrude_distance[row]),
+            "travel_distance_mm": float(self.travel_distance[row]),
+            "min_feedrate": None if numpy.isnan(min_feedrate) else min_feedrate,  # mm/min
+            "max_feedrate": None if numpy.isnan(max_feedrate) else max_feedrate,
+            "time_s": layer_time,
+            "features": features,  # [(特徵名稱, 時間佔比)]，依佔比排序
+        }
+
+    def getMemoryUsage(self):
+        """所有陣列佔用的位元組數"""
+        arrays = (self.layer_numbers, self.move_count, self.extrusion, self.extrude_distance, self.travel_distance,
+                  self.min_feedrate, self.max_feedrate, self.time, self.feature_time)
+        return sum(array.nbytes for array in arrays)
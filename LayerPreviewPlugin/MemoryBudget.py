@@ -0,0 +1,82 @@
+# 記憶體用量的分類：GCODE 文字、行索引（位移陣列與指令索引）、移動資料（圖層統計）、繪製資料
+CATEGORIES = ("text", "index", "moves", "render")
+
+
+def _ignoreLog(level, message):
+    pass
+
+
+class MemoryBudget:
+    """Accounts the memory held by the preview and keeps it under one limit
+
+    Consumers are added with a usage callable returning {category: bytes}
+    and a value; enforce() calls the release(bytes_to_free) of the
+    consumers with the lowest value first until the total is under
+    max_bytes. Consumers without release (the index of the shown file)
+    are only counted, so the total can stay over the limit.
+    log is called as log(level, message) with the UM.Logger levels.
+    """
+
+    def __init__(self, max_bytes, log=None):
+        self._max_bytes = max_bytes
+        self._consumers = []  # [(價值, 名稱, usage, release)]，依價值排序
+        self._log = log or _ignoreLog
+        self.released_bytes = 0
+        self.over_limit = False
+
+    def add(self, name, usage, release=None, value=0):
+        """Count usage() in the budget; release(bytes_to_free) frees memory of this consumer"""
+        self._consumers.append((value, name, usage, release))
+        self._consumers.sort(key=lambda consumer: consumer[0])
+
+    def setMaxBytes(self, max_bytes):
+        self._max_bytes = max_bytes
+
+    def getMaxBytes(self):
+        return self._max_bytes
+
+    def usage(self):
+        """{category: bytes} of all consumers"""
+        totals = dict.fromkeys(CATEGORIES, 0)
+        for _, _, usage, _ in self._consumers:
+            for category, size in usage().items():
+                totals[category] += size
+        return totals
+
+    def consumers(self):
+        """[(name, bytes)] from the least to the most valuable"""
+        return [(name, sum(usage().values())) for _, name, usage, _ in self._consumers]
+
+    def total(self):
+        return sum(self.usage().values())
+
+    def headroom(self):
+        """Bytes left before the limit, negative when over it"""
+        return self._max_bytes - self.total()
+
+    def enforce(self):
+        """Release the least valuable memory until the total is under the limit, returns the bytes freed"""
+        total = self.total()
+        freed = 0
+        for _, name, usage, release in self._consumers:
+            if total <= self._max_bytes:
+                break
+            if release is None:
+                continue
+            before = sum(usage().values())
+            if not before:
+                continue
+            release(total - self._max_bytes)
+            released = before - sum(usage().values())
+            if released > 0:
+                self._log("d", "Released {:.1f} MB of {}".format(released / 1048576.0, name))
+                freed += released
+                total -= released
+        self.released_bytes += freed
+        over_limit = total > self._max_bytes
+        if over_limit and not self.over_limit:
+            # 只在剛超過時記錄一次
+            self._log("w", "Preview memory {:.0f} MB is over the {:.0f} MB limit and nothing more can be released".format(
+                total / 1048576.0, self._max_bytes / 1048576.0))
+        self.over_limit = over_limit
+        return freed
@@ -0,0 +1,100 @@
+from collections import OrderedDict
+
+
+class PlateIndexCache:
+    """Loaded GcodeEngine of every build plate, bounded by their total memory
+
+    Each entry remembers the gcode list (scene.gcode_dict[plate]) it was
+    indexed from. Cura puts a new list there when a plate is sliced again
+    and appends to it while slicing, so an entry is only current while
+    the list is the same object with the same number of chunks; other
+    plates are not affected. Once the engines use more than max_bytes,
+    the least recently used plates are closed, except the one in use.
+    """
+
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()  # 平台編號 -> (gcode list, chunk 數, GcodeEngine)
+        self._in_use = None  # 顯示中的 engine，不會被淘汰或關閉
+
+    def get(self, plate, gcode_list):
+        """Engine of a plate indexed from gcode_list, None when missing or out of date"""
+        entry = self._entries.get(plate)
+        if entry is None or not self.isCurrent(plate, gcode_list):
+            return None
+        self._entries.move_to_end(plate)
+        return entry[2]
+
+    def isCurrent(self, plate, gcode_list):
+        entry = self._entries.get(plate)
+        return entry is not None and entry[0] is gcode_list and entry[1] == len(gcode_list)
+
+    def put(self, plate, gcode_list, engine):
+        """Add the engine of a plate, replacing (and closing) its previous engine"""
+        old = self._entries.pop(plate, None)
+        if old is not None and old[2] is not engine:
+            self._close(old[2])
+        self._entries[plate] = (gcode_list, len(gcode_list), engine)
+        self._evict()
+
+    def setInUse(self, engine):
+        """Mark the engine shown by the preview, None when a file is shown instead"""
+        self._in_use = engine
+        self._evict()
+
+    def owns(self, engine):
+        return any(entry[2] is engine for entry in self._entries.values())
+
+    def setMaxBytes(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._evict()
+
+    def getMaxBytes(self):
+        return self._max_bytes
+
+    def getMemoryUsage(self):
+        return sum(entry[2].getMemoryUsage() for entry in self._entries.values())
+
+    def getUnusedMemoryBreakdown(self):
+        """{category: bytes} of the plates that are not shown"""
+        totals = {}
+        for _, _, engine in self._entries.values():
+            if engine is not self._in_use:
+                for category, size in engine.getMemoryBreakdown().items():
+                    totals[category] = totals.get(category, 0) + size
+        return totals
+
+    def release(self, bytes_to_free):
+        """Close the least recently used plates that are not shown until bytes_to_free are freed"""
+        self._evict(self.getMemoryUsage() - bytes_to_free)
+
+    def plates(self):
+        """Plate numbers with an index, least recently used first"""
+        return list(self._entries)
+
+    def _evict(self, max_bytes=None):
+        max_bytes = self._max_bytes if max_bytes is None else max_bytes
+        usage = self.getMemoryUsage()
+        for plate in list(self._entries):
+            if usage <= max_bytes:
+                break
+            engine = self._entries[plate][2]
+            if engine is self._in_use:
+                continue
+            usage -= engine.getMemoryUsage()
+            del self._entries[plate]
+            self._close(engine)
+
+    def _close(self, engine):
+        # 顯示中的 engine 由預覽視窗換掉之後再關閉
+        if engine is not self._in_use:
+            engine.close()
+
+    def clear(self):
+        """Close every engine except the one in use"""
+        entries, self._entries = self._entries, OrderedDict()
+        for _, _, engine in entries.values():
+            self._close(engine)
+
+    def __len__(self):
+        return len(self._entries)
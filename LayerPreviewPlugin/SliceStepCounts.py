@@ -0,0 +1,67 @@
+import weakref
+
+import numpy
+
+
+def _reference(obj):
+    """不讓快取延長舊切片資料的生命週期；不支援 weakref 的物件才保留強參考"""
+    try:
+        return weakref.ref(obj)
+    except TypeError:
+        return lambda: obj
+
+
+class SliceStepCounts:
+    """Step count of every layer of Cura's LayerData, read once per slice
+
+    update() takes the LayerData objects of the scene and reads
+    lineMeshElementCount() of all their layers only when they are not
+    the objects the counts came from, i.e. after a new slice. stepCount()
+    is an array lookup. Layer numbers may be negative (raft layers). The
+    caller passes only the LayerData of the active build plate, like
+    SimulationView does; when several of them have the same layer, the
+    first one wins.
+    """
+
+    def __init__(self):
+        self._sources = []  # 計數來源 LayerData 的參考
+        self._first_layer = 0
+        self._counts = numpy.zeros(0, dtype=numpy.int64)  # -1 表示沒有這一層
+
+    def isCurrent(self, layer_datas):
+        return len(layer_datas) == len(self._sources) and all(
+            source() is layer_data for source, layer_data in zip(self._sources, layer_datas))
+
+    def update(self, layer_datas):
+        """Read the counts of layer_datas, returns False when they are already current"""
+        if self.isCurrent(layer_datas):
+            return False
+        counts = {}
+        for layer_data in layer_datas:
+            for layer_num, layer in layer_data.getLayers().items():
+                if layer_num not in counts:
+                    counts[layer_num] = layer.lineMeshElementCount()
+        self._sources = [_reference(layer_data) for layer_data in layer_datas]
+        if not counts:
+            self._first_layer, self._counts = 0, numpy.zeros(0, dtype=numpy.int64)
+            return True
+        self._first_layer = min(counts)
+        self._counts = numpy.full(max(counts) - self._first_layer + 1, -1, dtype=numpy.int64)
+        self._counts[numpy.fromiter(counts, dtype=numpy.int64, count=len(counts)) - self._first_layer] = list(counts.values())
+        return True
+
+    def stepCount(self, layer_num):
+        """Steps of a layer, None when the slice has no such layer"""
+        position = layer_num - self._first_layer
+        if not 0 <= position < len(self._counts):
+            return None
+        count = int(self._counts[position])
+        return count if count >= 0 else None
+
+    def clear(self):
+        self._sources = []
+        self._first_layer = 0
+        self._counts = numpy.zeros(0, dtype=numpy.int64)
+
+    def __len__(self):
+        return int(numpy.count_nonzero(self._counts >= 0))
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import threading
+import time
+
+# 暫存 GCODE 目錄，與索引快取同樣放在插件目錄下
+TEMP_GCODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "GCODE_temp")
+DEFAULT_TEMP_GCODE_SIZE_MB = 2048
+DEFAULT_TEMP_GCODE_MAX_AGE_DAYS = 14
+
+# 累積到這個大小才寫入一次，Cura 的切片是許多小 chunk
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+
+_PREFIX = "GCODE_temp_"
+_SUFFIX = ".gcode"
+
+
+def sliceHash(gcode_list):
+    """Hash of the UTF-8 text of a slice, as it is written to the file"""
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk in gcode_list:
+        digest.update(chunk.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class TempGcodeStore:
+    """Saved slices in GCODE_temp, one file per distinct content
+
+    Files are named after the hash of their text, so saving a slice that
+    is already stored only marks it as recently used. prune() deletes the
+    files (including ones from older versions named by timestamp) last
+    used more than max_age seconds ago, then the least recently used ones
+    while the directory holds more than max_bytes. A max_age of 0 keeps
+    files regardless of age. save() may run in worker threads; threads
+    saving the same slice end up with the same file.
+    """
+
+    def __init__(self, temp_dir, max_bytes, max_age):
+        self.temp_dir = temp_dir
+        self._max_bytes = max(0, int(max_bytes))
+        self._max_age = max(0, max_age)
+
+    def setLimits(self, max_bytes, max_age):
+        self._max_bytes = max(0, int(max_bytes))
+        self._max_age = max(0, max_age)
+
+    def filePath(self, content_hash):
+        return os.path.join(self.temp_dir, "{}{}{}".format(_PREFIX, content_hash, _SUFFIX))
+
+    def save(self, gcode_list):
+        """Store a slice, returns (file path, False when an identical file already existed)"""
+        chunks = list(gcode_list)
+        file_path = self.filePath(sliceHash(chunks))
+        created = not os.path.exists(file_path)
+        if created:
+            self._write(chunks, file_path)
+        else:
+            self._touch(file_path)
+        return file_path, created
+
+    def _write(self, chunks, file_path):
+        os.makedirs(self.temp_dir, exist_ok=True)
+        # 先寫到暫存檔再替換，中途中斷也不會留下寫了一半的檔案
+        temp_path = "{}.{}.{}.tmp".format(file_path, os.getpid(), threading.get_ident())
+        try:
+            with open(temp_path, "wb", buffering=0) as f:
+                pending, pending_size = [], 0
+                for chunk in chunks:
+                    data = chunk.encode("utf-8")
+                    pending.append(data)
+                    pending_size += len(data)
+                    if pending_size >= WRITE_BUFFER_SIZE:
+                        f.write(b"".join(pending))
+                        pending, pending_size = [], 0
+                if pending:
+                    f.write(b"".join(pending))
+            os.replace(temp_path, file_path)
+        except Exception:
+            self._remove(temp_path)
+            raise
+
+    def files(self):
+        """[(最近使用時間, 大小, 路徑)]，由舊到新"""
+        entries = []
+        try:
+            names = os.listdir(self.temp_dir)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(_SUFFIX):
+                continue
+            path = os.path.join(self.temp_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def prune(self, keep=(), now=None):
+        """Apply the retention limits, returns the deleted paths; paths in keep are never deleted"""
+        now = time.time() if now is None else now
+        keep = {os.path.normcase(os.path.abspath(path)) for path in keep if path}
+        entries = self.files()
+        total = sum(size for _, size, _ in entries)
+        removed = []
+        for mtime, size, path in entries:
+            expired = self._max_age and now - mtime > self._max_age
+            if not expired and total <= self._max_bytes:
+                continue
+            if os.path.normcase(os.path.abspath(path)) in keep:
+                continue
+            # 仍被開啟（Windows 上載入中的檔案）時刪除失敗，下次再試
+            if self._remove(path):
+                total -= size
+                removed.append(path)
+        return removed
+
+    def getUsage(self):
+        """目錄中暫存檔佔用的位元組數"""
+        return sum(size for _, size, _ in self.files())
+
+    def _touch(self, path):
+        # 修改時間作為保留期限與 LRU 的最近使用時間
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
@@ -1,10 +1,13 @@
-from UM.i18n import i18nCatalog
-i18n_catalog = i18nCatalog("LayerPreviewPlugin")
-
-from . import LayerPreviewPlugin
+try:
+    from UM.i18n import i18nCatalog
+    i18n_catalog = i18nCatalog("LayerPreviewPlugin")
+except ImportError:
+    # 在 Cura 之外（python -m LayerPreviewPlugin）只使用不依賴 Qt/Cura 的模組
+    i18n_catalog = None
 
 def getMetaData():
     return {}
 
 def register(app):
+    from . import LayerPreviewPlugin
     return {"extension": LayerPreviewPlugin.LayerPreviewPlugin()}
@@ -0,0 +1,194 @@
+"""Command line GCODE inspector, runs without Cura
+
+    python -m LayerPreviewPlugin layers FILE [--stats]
+    python -m LayerPreviewPlugin layer FILE LAYER [--step STEP]
+    python -m LayerPreviewPlugin step FILE LAYER STEP
+    python -m LayerPreviewPlugin search FILE TEXT [--regex] [--case-sensitive]
+    python -m LayerPreviewPlugin index FILE [FILE ...]
+    python -m LayerPreviewPlugin diff FILE OTHER [--layer LAYER]  (FILE is the old side, like diff)
+
+Line numbers are 1-based, as shown in the preview window. Indexes are
+read from and written to the same index cache as the plugin.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+
+from .GcodeEngine import GcodeEngine, GcodeIndexCache, DEFAULT_INDEX_CACHE_SIZE_MB, INDEX_CACHE_DIR
+from .GcodeCompare import LayerDiff, CHANGED, ADDED, REMOVED
+from .GcodeSearch import compileQuery
+from .LayerStats import formatDuration
+
+
+def _printLog(level, message):
+    print("[{}] {}".format(level, message), file=sys.stderr)
+
+
+def _layers(engine, args):
+    rows = [{"layer": layer_num, "first_line": first + 1, "last_line": last + 1, "steps": engine.stepCount(layer_num)}
+            for layer_num, first, last in engine.layerRanges()]
+    if args.stats:
+        stats = engine.buildLayerStats()
+        for row in rows:
+            row["stats"] = stats.layerStats(row["layer"])
+    if args.json:
+        return rows
+    for row in rows:
+        text = "{layer:>6}  lines {first_line}-{last_line}  {steps} steps".format(**row)
+        layer_stats = row.get("stats")
+        if layer_stats:
+            text += "  {:.1f} mm extruded  {:.1f} mm travel  ~{}".format(
+                layer_stats["extrusion_mm"], layer_stats["travel_distance_mm"], formatDuration(layer_stats["time_s"]))
+        print(text)
+
+
+def _layer(engine, args):
+    commands = engine.layerCommands(args.layer, args.step)
+    if args.json:
+        return [{"line": line + 1, "text": text} for line, text in commands]
+    for line, text in commands:
+        print("{:>9}  {}".format(line + 1, text))
+
+
+def _step(engine, args):
+    lines = engine.stepText(args.layer, args.step)
+    if args.json:
+        return [{"line": line + 1, "text": text} for line, text in lines]
+    for line, text in lines:
+        print("{:>9}  {}".format(line + 1, text))
+
+
+def _search(engine, args):
+    rows = []
+    for lines in engine.search(args.text, args.regex, not args.case_sensitive):
+        for line in lines:
+            line = int(line)
+            row = {"line": line + 1, "layer": engine.layerOfLine(line), "text": engine.store.getLine(line).rstrip("\r\n")}
+            if args.json:
+                rows.append(row)
+            else:
+                print("{:>9}  {:>6}  {}".format(row["line"], "-" if row["layer"] is None else row["layer"], row["text"]))
+    if args.json:
+        return rows
+
+
+def _diff(engine, args):
+    other = GcodeEngine.openFile(args.other, args.index_cache, args.log, workers=args.workers)
+    try:
+        # 與 diff(1) 相同，FILE 為舊版（-），OTHER 為新版（+）
+        diff = LayerDiff(other, engine)
+        diff.compare()
+        if args.layer is not None:
+            lines = diff.lineDiff(args.layer)
+            if args.json:
+                return lines
+            for line in lines:
+                print(line)
+            return
+        labels = {
+            CHANGED: "changed",
+            ADDED: "only in {}".format(os.path.basename(args.other)),
+            REMOVED: "only in {}".format(os.path.basename(args.file)),
+        }
+        rows = [{"layer": layer_num, "change": labels[diff.changes[layer_num]]} for layer_num in diff.changedLayers()]
+        if args.json:
+            return {"layers": diff.layer_count, "changed": rows}
+        print("{} of {} layers differ".format(len(rows), diff.layer_count))
+        for row in rows:
+            print("{layer:>6}  {change}".format(**row))
+    finally:
+        other.close()
+
+
+def _index(engine, args):
+    summary = {"file": engine.file_path, "lines": len(engine.store), "layers": len(engine.layer_index),
+               "from_cache": engine.from_cache}
+    if args.json:
+        return summary
+    print("{file}: {lines} lines, {layers} layers{cached}".format(cached=" (index cache)" if engine.from_cache else "", **summary))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m LayerPreviewPlugin", description="Inspect GCODE layers and steps")
+    parser.add_argument("--json", action="store_true", help="print JSON instead of text")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the index cache")
+    parser.add_argument("--cache-dir", default=INDEX_CACHE_DIR)
+    parser.add_argument("--cache-size-mb", type=int, default=DEFAULT_INDEX_CACHE_SIZE_MB)
+    parser.add_argument("--verbose", action="store_true", help="report index cache problems")
+    parser.add_argument("--workers", type=int, default=None, help="indexing and move parsing processes for large files (default: CPU count)")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    layers = commands.add_parser("layers", help="layer numbers with their line ranges and step counts")
+    layers.add_argument("file")
+    layers.add_argument("--stats", action="store_true", help="add extrusion, travel, feedrate and time estimates per layer")
+    layers.set_defaults(handler=_layers)
+
+    layer = commands.add_parser("layer", help="G/M commands of a layer, or of one step with --step")
+    layer.add_argument("file")
+    layer.add_argument("layer", type=int)
+    layer.add_argument("--step", type=int, default=0)
+    layer.set_defaults(handler=_layer)
+
+    step = commands.add_parser("step", help="all lines a SimulationView step covers")
+    step.add_argument("file")
+    step.add_argument("layer", type=int)
+    step.add_argument("step", type=int)
+    step.set_defaults(handler=_step)
+
+    search = commands.add_parser("search", help="lines containing TEXT (G/M/T codes such as M104 use the command index)")
+    search.add_argument("file")
+    search.add_argument("text")
+    search.add_argument("--regex", action="store_true", help="TEXT is a regular expression")
+    search.add_argument("--case-sensitive", action="store_true")
+    search.set_defaults(handler=_search)
+
+    index = commands.add_parser("index", help="index files into the cache so the plugin opens them without scanning")
+    index.add_argument("file", nargs="+")
+    index.set_defaults(handler=_index)
+
+    diff = commands.add_parser("diff", help="layers whose text differs between FILE (old) and OTHER (new), or the line diff of one layer")
+    diff.add_argument("file", help="old GCODE file, its lines are shown with -")
+    diff.add_argument("other", help="new GCODE file, its lines are shown with +")
+    diff.add_argument("--layer", type=int, default=None, help="print the line diff of this layer")
+    diff.set_defaults(handler=_diff)
+
+    args = parser.parse_args(argv)
+    if args.command == "search":
+        try:
+            compileQuery(args.text, args.regex)
+        except re.error as e:
+            parser.error("invalid regular expression: {}".format(e))
+    index_cache = None if args.no_cache else GcodeIndexCache(args.cache_dir, args.cache_size_mb * 1024 * 1024)
+    args.index_cache, args.log = index_cache, _printLog if args.verbose else None
+    file_paths = args.file if args.command == "index" else [args.file]
+    results = []
+    try:
+        for file_path in file_paths:
+            try:
+                engine = GcodeEngine.openFile(file_path, index_cache, args.log, workers=args.workers)
+            except OSError as e:
+                print("Cannot open {}: {}".format(file_path, e), file=sys.stderr)
+                return 1
+            try:
+                if args.command in ("layer", "step") and not engine.hasLayer(args.layer):
+                    print("No layer {} marker found".format(args.layer), file=sys.stderr)
+                    return 1
+                results.append(args.handler(engine, args))
+            finally:
+                engine.close()
+        if args.json:
+            json.dump(results if args.command == "index" else results[0], sys.stdout, indent=2, ensure_ascii=False)
+            print()
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # 輸出接到 head 等提早結束的程式，不算錯誤
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""Minimal stand-ins for the UM and cura modules so the plugin can run without Cura
+
+install() must be called before LayerPreviewPlugin is imported.
+"""
+
+import sys
+import types
+
+
+class Signal:
+    """Synchronous UM.Signal replacement"""
+
+    def __init__(self):
+        self._slots = []
+
+    def connect(self, slot):
+        self._slots.append(slot)
+
+    def disconnect(self, slot):
+        self._slots.remove(slot)
+
+    def emit(self, *args):
+        for slot in list(self._slots):
+            slot(*args)
+
+
+class Logger:
+    """UM.Logger replacement, keeps warnings and errors so the benchmark can report them"""
+
+    messages = []
+
+    @classmethod
+    def log(cls, level, message):
+        if level in ("w", "e"):
+            cls.messages.append((level, message))
+
+
+class Extension:
+    def __init__(self):
+        self.menu_items = []
+
+    def addMenuItem(self, name, callback):
+        self.menu_items.append((name, callback))
+
+
+class i18nCatalog:
+    def __init__(self, name):
+        self.name = name
+
+
+class Preferences:
+    def __init__(self):
+        self._values = {}
+        self.preferenceChanged = Signal()
+
+    def addPreference(self, key, default):
+        self._values.setdefault(key, default)
+
+    def getValue(self, key):
+        return self._values.get(key)
+
+    def setValue(self, key, value):
+        self._values[key] = value
+        self.preferenceChanged.emit(key)
+
+
+class SimulationView:
+    """SimulationView with the layer/path getters and change signals the plugin uses"""
+
+    def __init__(self):
+        self._current_layer = 0
+        self._current_path = 0
+        self._max_layers = 0
+        self._max_paths = 0
+        self.currentLayerNumChanged = Signal()
+        self.currentPathNumChanged = Signal()
+        self.maxLayersChanged = Signal()
+        self.maxPathsChanged = Signal()
+
+    def getCurrentLayer(self):
+        return self._current_layer
+
+    def getCurrentPath(self):
+        return self._current_path
+
+    def getMaxLayers(self):
+        return self._max_layers
+
+    def getMaxPaths(self):
+        return self._max_paths
+
+    def setLayer(self, layer_num):
+        self._current_layer = layer_num
+        self.currentLayerNumChanged.emit()
+
+    def setPath(self, path_num):
+        self._current_path = path_num
+        self.currentPathNumChanged.emit()
+
+    def setMaxLayers(self, max_layers):
+        self._max_layers = max_layers
+        self.maxLayersChanged.emit()
+
+    def setMaxPaths(self, max_paths):
+        self._max_paths = max_paths
+        self.maxPathsChanged.emit()
+
+
+class _PluginRegistry:
+    def __init__(self):
+        self.plugins = {}
+
+    def getPluginObject(self, name):
+        return self.plugins.get(name)
+
+
+class _SceneNode:
+    def getChildren(self):
+        return []
+
+
+class _Scene:
+    def __init__(self):
+        self.gcode_dict = {}
+        self._root = _SceneNode()
+
+    def getRoot(self):
+        return self._root
+
+
+class _Controller:
+    def __init__(self):
+        self._scene = _Scene()
+
+    def getScene(self):
+        return self._scene
+
+
+class _MultiBuildPlateModel:
+    activeBuildPlate = 0
+
+
+class CuraApplication:
+    """Singleton with the parts of cura.CuraApplication the plugin touches"""
+
+    _instance = None
+
+    def __init__(self):
+        self._preferences = Preferences()
+        self._registry = _PluginRegistry()
+        self._controller = _Controller()
+        self._build_plates = _MultiBuildPlateModel()
+        self.engineCreatedSignal = Signal()
+
+    @classmethod
+    def getInstance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def getPreferences(self):
+        return self._preferences
+
+    def getPluginRegistry(self):
+        return self._registry
+
+    def getController(self):
+        return self._controller
+
+    def getMultiBuildPlateModel(self):
+        return self._build_plates
+
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+
+def install():
+    """Register the stub modules, returns the stub CuraApplication"""
+    _module("UM")
+    _module("UM.Logger", Logger=Logger)
+    _module("UM.Extension", Extension=Extension)
+    _module("UM.i18n", i18nCatalog=i18nCatalog)
+    _module("UM.Signal", Signal=Signal)
+    _module("cura")
+    _module("cura.CuraApplication", CuraApplication=CuraApplication)
+    return CuraApplication.getInstance()
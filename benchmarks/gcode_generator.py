@@ -0,0 +1,139 @@
+"""Synthetic Cura-style GCODE for benchmarks
+
+Usage: python benchmarks/gcode_generator.py OUTPUT --lines 1000000 --layers 200
+"""
+
+import argparse
+import math
+import random
+
+FEATURE_TYPES = ("WALL-OUTER", "WALL-INNER", "SKIN", "FILL")
+
+HEADER = """;FLAVOR:Marlin
+;TIME:{time}
+;Filament used: {filament}m
+;Layer height: 0.2
+;MINX:10
+;MINY:10
+;MINZ:0.2
+;MAXX:210
+;MAXY:210
+;MAXZ:{max_z}
+;Generated with LayerPreviewPlugin benchmarks
+M140 S60
+M105
+M190 S60
+M104 S200
+M105
+M109 S200
+M82 ;absolute extrusion mode
+G28 ;Home
+G92 E0
+G1 Z2.0 F3000
+G1 X0.1 Y20 Z0.3 F5000.0
+G1 X0.1 Y200.0 Z0.3 F1500.0 E15
+G92 E0
+G1 Z2.0 F3000
+M107
+;LAYER_COUNT:{layers}
+"""
+
+FOOTER = """;TIME_ELAPSED:{time}
+G1 F2700 E{retract:.5f}
+M140 S0
+M107
+G91
+G1 E-2 F2700
+G1 E-2 Z0.2 F2400
+G1 X5 Y5 F3000
+G1 Z10
+G90
+G1 X0 Y235
+M106 S0
+M104 S0
+M84 X Y E
+M82 ;absolute extrusion mode
+M104 S0
+;End of Gcode
+"""
+
+
+def generateGcode(file_path, lines=100000, layers=100, crlf=False, seed=0):
+    """Write a Cura-style GCODE file of about `lines` lines spread over `layers` layers
+
+    Every layer has ;LAYER: and ;TYPE: markers, travel moves with
+    retractions, extrusion moves in absolute E and fan/temperature
+    commands, like a real slice. Returns the number of lines written.
+    """
+    rng = random.Random(seed)
+    newline = "\r\n" if crlf else "\n"
+    header = HEADER.format(time=layers * 60, filament=layers * 0.05, max_z=layers * 0.2, layers=layers)
+    footer_lines = FOOTER.count("\n")
+    body_lines = max(layers * 8, lines - header.count("\n") - footer_lines)
+    per_layer = body_lines // layers
+
+    written = 0
+    e = 0.0
+    with open(file_path, "w", encoding="utf-8", newline="") as f:
+        buffer = [header.replace("\n", newline)]
+        written += header.count("\n")
+        for layer in range(layers):
+            out = [";LAYER:{}".format(layer)]
+            if layer == 1:
+                out.append("M106 S255")
+            out.append("G0 F6000 X{:.3f} Y{:.3f} Z{:.1f}".format(rng.uniform(20, 200), rng.uniform(20, 200), 0.2 * (layer + 1)))
+            # 每層剩下的行平均分給各種特徵
+            remaining = per_layer - len(out) - 1
+            feature = 0
+            while remaining > 0:
+                out.append(";TYPE:{}".format(FEATURE_TYPES[feature % len(FEATURE_TYPES)]))
+                remaining -= 1
+                moves = min(remaining, rng.randint(20, 400))
+                cx, cy, radius = rng.uniform(60, 160), rng.uniform(60, 160), rng.uniform(5, 50)
+                i = 0
+                while i < moves:
+                    if i and i % 50 == 0 and moves - i > 4:
+                        # 空跑：回抽、移動、回填
+                        out.append("G1 F2700 E{:.5f}".format(e - 5))
+                        out.append("G0 F6000 X{:.3f} Y{:.3f}".format(rng.uniform(20, 200), rng.uniform(20, 200)))
+                        out.append("G1 F2700 E{:.5f}".format(e))
+                        i += 3
+                        continue
+                    angle = i * 2 * math.pi / max(moves, 1)
+                    x = cx + radius * math.cos(angle)
+                    y = cy + radius * math.sin(angle)
+                    e += rng.uniform(0.01, 0.08)
+                    if i == 0:
+                        out.append("G1 F1500 X{:.3f} Y{:.3f} E{:.5f}".format(x, y, e))
+                    else:
+                        out.append("G1 X{:.3f} Y{:.3f} E{:.5f}".format(x, y, e))
+                    i += 1
+                remaining -= moves
+                feature += 1
+            out.append(";TIME_ELAPSED:{:.6f}".format((layer + 1) * 60.0))
+            written += len(out)
+            buffer.append(newline.join(out) + newline)
+            if len(buffer) > 64:
+                f.write("".join(buffer))
+                buffer = []
+        footer = FOOTER.format(time=layers * 60, retract=e - 6.5)
+        buffer.append(footer.replace("\n", newline))
+        written += footer_lines
+        f.write("".join(buffer))
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic Cura-style GCODE")
+    parser.add_argument("output")
+    parser.add_argument("--lines", type=int, default=100000)
+    parser.add_argument("--layers", type=int, default=100)
+    parser.add_argument("--crlf", action="store_true", help="Windows line endings")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    written = generateGcode(args.output, args.lines, args.layers, args.crlf, args.seed)
+    print("Wrote {} lines to {}".format(written, args.output))
+
+
+if __name__ == "__main__":
+    main()
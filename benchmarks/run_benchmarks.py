@@ -0,0 +1,319 @@
+"""Headless benchmarks for LayerPreviewPlugin
+
+Generates synthetic GCODE files, loads them through the real preview
+widget (with UM/cura replaced by benchmarks/cura_stubs.py and Qt running
+offscreen) and times loading, indexing, layer lookup, step mapping and
+display updates. Results are written as JSON; pass a previous result as
+--baseline to fail on regressions.
+
+Usage:
+    python benchmarks/run_benchmarks.py --sizes 10k,100k,1M --output results.json
+    python benchmarks/run_benchmarks.py --sizes 1M --baseline results.json --tolerance 0.25
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+import numpy
+
+import cura_stubs
+from gcode_generator import generateGcode
+
+# 比較基準時使用的欄位；差距小於 MIN_REGRESSION_MS 的視為雜訊
+COMPARED_FIELD = "p50_ms"
+MIN_REGRESSION_MS = 0.1
+
+SIZE_SUFFIXES = {"k": 1000, "m": 1000000}
+
+
+def parseSize(text):
+    """'10k' -> 10000, '20M' -> 20000000"""
+    text = text.strip().lower()
+    if text and text[-1] in SIZE_SUFFIXES:
+        return int(float(text[:-1]) * SIZE_SUFFIXES[text[-1]])
+    return int(text)
+
+
+def defaultLayerCount(lines):
+    """Roughly the lines per layer of a real slice"""
+    return min(2000, max(10, lines // 10000))
+
+
+def summarize(samples):
+    """Timings in seconds -> statistics in milliseconds"""
+    values = numpy.asarray(samples, dtype=numpy.float64) * 1000.0
+    return {
+        "count": len(values),
+        "mean_ms": round(float(values.mean()), 4),
+        "p50_ms": round(float(numpy.percentile(values, 50)), 4),
+        "p99_ms": round(float(numpy.percentile(values, 99)), 4),
+        "max_ms": round(float(values.max()), 4),
+    }
+
+
+def timeCalls(function, arguments):
+    """Call function(*args) for each entry, returns the timing summary"""
+    samples = []
+    for args in arguments:
+        start = time.perf_counter()
+        function(*args)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+class Benchmark:
+    """Runs every measurement against one plugin/widget instance"""
+
+    def __init__(self, app, qt_app, plugin_module, repeat, lookups, seed, workers=1):
+        self.app = app
+        self.workers = workers
+        self.qt_app = qt_app
+        self.plugin_module = plugin_module
+        self.repeat = repeat
+        self.lookups = lookups
+        self.rng = random.Random(seed)
+
+        self.simulation_view = cura_stubs.SimulationView()
+        self.plugin = plugin_module.LayerPreviewPlugin()
+        self._setSimulationView(True)
+        app.engineCreatedSignal.emit()
+        self.plugin.showPreviewWindow()
+        self.widget = self.plugin._preview_widget
+
+    def _setSimulationView(self, available):
+        plugins = self.app.getPluginRegistry().plugins
+        if available:
+            plugins["SimulationView"] = self.simulation_view
+        else:
+            plugins.pop("SimulationView", None)
+
+    def _waitForLoad(self):
+        while self.widget._load_thread is not None:
+            self.qt_app.processEvents()
+            time.sleep(0.001)
+
+    def _load(self, file_path):
+        start = time.perf_counter()
+        self.widget.loadGcodeFile(file_path)
+        self._waitForLoad()
+        elapsed = time.perf_counter() - start
+        if not self.widget.layer_index:
+            raise RuntimeError("loading {} failed: {}".format(file_path, self.widget.status_label.text()))
+        return elapsed
+
+    def run(self, file_path):
+        widget = self.widget
+        results = {}
+
+        # 載入：沒有快取時完整建立索引，再次開啟時讀取索引快取
+        cold, warm = [], []
+        for _ in range(self.repeat):
+            widget._index_cache.clear()
+            cold.append(self._load(file_path))
+            warm.append(self._load(file_path))
+        results["load_cold"] = summarize(cold)
+        results["load_cached"] = summarize(warm)
+
+        store_class = type(widget.gcode_lines)
+        samples = []
+        for _ in range(self.repeat):
+            store = store_class(file_path)
+            start = time.perf_counter()
+            store.buildIndex()
+            samples.append(time.perf_counter() - start)
+            store.close()
+        results["build_index"] = summarize(samples)
+
+        # 多個工作行程（檔案小於 PARALLEL_INDEX_MIN_SIZE 時仍為單一行程）
+        if self.workers > 1:
+            samples = []
+            for _ in range(self.repeat):
+                store = store_class(file_path)
+                start = time.perf_counter()
+                store.buildIndex(workers=self.workers)
+                samples.append(time.perf_counter() - start)
+                store.close()
+            results["build_index_parallel"] = summarize(samples)
+
+        store, layer_index = widget.gcode_lines, widget.layer_index
+        layers = sorted(layer_index)
+        picks = [self.rng.choice(layers) for _ in range(self.lookups)]
+        step_counts = {layer: len(store.stepLines(layer)) for layer in set(picks)}
+        steps = [(layer, self.rng.randint(1, max(1, step_counts[layer]))) for layer in picks]
+
+        # 圖層查詢與步驟對應
+        results["find_layer_commands"] = timeCalls(widget.findLayerCommands, [(layer, 0) for layer in picks])
+        results["find_step_commands"] = timeCalls(widget.findLayerCommands, steps)
+        results["step_line_range"] = timeCalls(store.stepLineRange, steps)
+
+        # 步驟數：經由 SimulationView（方法1）以及只靠 GCODE 索引（方法3）
+        results["get_layer_step_count"] = timeCalls(widget.getLayerStepCount, [(layer,) for layer in picks])
+        self._setSimulationView(False)
+        try:
+            results["get_layer_step_count_gcode"] = timeCalls(widget.getLayerStepCount, [(layer,) for layer in picks])
+        finally:
+            self._setSimulationView(True)
+
+        # 畫面更新：換層（渲染快取未命中）、同層換步驟、重繪同一位置
+        def switchLayer(layer, step):
+            widget._render_cache.clear()
+            widget.updateGcodeDisplay(layer, step)
+
+        results["update_display_layer"] = timeCalls(switchLayer, steps)
+        layer = picks[0]
+        widget.updateGcodeDisplay(layer, 1)
+        same_layer = [(layer, self.rng.randint(1, max(1, step_counts[layer]))) for _ in range(self.lookups)]
+        results["update_display_step"] = timeCalls(widget.updateGcodeDisplay, same_layer)
+        results["update_display_unchanged"] = timeCalls(widget.updateGcodeDisplay, [same_layer[-1]] * self.lookups)
+
+        # 端對端：SimulationView 訊號 -> 插件 -> 視窗
+        simulation_view = self.simulation_view
+        simulation_view._max_layers = len(layers)
+
+        def scrub(layer, step):
+            simulation_view._current_path = step
+            simulation_view.setLayer(layer)
+
+        results["simulation_view_signal"] = timeCalls(scrub, steps)
+
+        from LayerPreviewPlugin.GcodeMoveTable import GcodeMoveTable
+        samples = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            move_table = GcodeMoveTable.fromLines(store)
+            samples.append(time.perf_counter() - start)
+        results["move_table"] = summarize(samples)
+
+        from LayerPreviewPlugin.LayerStats import LayerStats
+        samples = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            layer_stats = LayerStats.fromMoveTable(move_table)
+            samples.append(time.perf_counter() - start)
+        results["layer_stats"] = summarize(samples)
+        results["layer_stats_lookup"] = timeCalls(layer_stats.layerStats, [(layer,) for layer in picks])
+
+        results["memory"] = {
+            "line_index_bytes": int(store.getMemoryUsage()),
+            "move_table_bytes": int(move_table.getMemoryUsage()),
+            "layer_stats_bytes": int(layer_stats.getMemoryUsage()),
+            "index_cache_bytes": int(widget._index_cache.getUsage()),
+        }
+        results["file"] = {
+            "bytes": os.path.getsize(file_path),
+            "lines": len(store),
+            "layers": len(layers),
+            "moves": len(move_table),
+        }
+        widget.closeGcodeFile()
+        return results
+
+
+def compareWithBaseline(results, baseline, tolerance):
+    """Returns ["size metric: old -> new"] for every metric slower than baseline by more than tolerance"""
+    regressions = []
+    for size, metrics in results["results"].items():
+        base_metrics = baseline.get("results", {}).get(size, {})
+        for name, values in metrics.items():
+            old = base_metrics.get(name, {}).get(COMPARED_FIELD)
+            new = values.get(COMPARED_FIELD)
+            if old is None or new is None or old <= 0:
+                continue
+            if new > old * (1.0 + tolerance) and new - old > MIN_REGRESSION_MS:
+                regressions.append("{} {}: {:.3f} ms -> {:.3f} ms ({:+.0%})".format(size, name, old, new, new / old - 1.0))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LayerPreviewPlugin without Cura")
+    parser.add_argument("--sizes", default="10k,100k,1M", help="comma separated line counts, e.g. 10k,1M,20M")
+    parser.add_argument("--layers", type=int, default=None, help="layer count of generated files (default: scaled with size)")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions of the load/index measurements")
+    parser.add_argument("--lookups", type=int, default=200, help="random layers/steps per lookup measurement")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes for the parallel indexing measurement")
+    parser.add_argument("--crlf", action="store_true", help="generate files with Windows line endings")
+    parser.add_argument("--work-dir", default=None, help="where generated GCODE is kept and reused (default: temporary)")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None, help="previous results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    app = cura_stubs.install()
+    from PyQt5.QtWidgets import QApplication
+    qt_app = QApplication.instance() or QApplication(sys.argv[:1])
+    from LayerPreviewPlugin import LayerPreviewPlugin as plugin_module
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="layer_preview_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    # 索引快取放在工作目錄，不影響插件目錄
+    plugin_module.INDEX_CACHE_DIR = os.path.join(work_dir, "GCODE_cache")
+
+    output = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": numpy.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "workers": args.workers,
+            "repeat": args.repeat,
+            "lookups": args.lookups,
+            "seed": args.seed,
+        },
+        "results": {},
+    }
+    try:
+        benchmark = Benchmark(app, qt_app, plugin_module, args.repeat, args.lookups, args.seed, args.workers)
+        for size_text in args.sizes.split(","):
+            lines = parseSize(size_text)
+            layers = args.layers or defaultLayerCount(lines)
+            file_path = os.path.join(work_dir, "bench_{}_{}{}.gcode".format(lines, layers, "_crlf" if args.crlf else ""))
+            if not os.path.exists(file_path):
+                print("Generating {} lines, {} layers...".format(lines, layers), flush=True)
+                generateGcode(file_path, lines, layers, args.crlf, args.seed)
+            print("Benchmarking {}...".format(os.path.basename(file_path)), flush=True)
+            results = benchmark.run(file_path)
+            output["results"][size_text.strip()] = results
+            for name, values in results.items():
+                if COMPARED_FIELD in values:
+                    print("  {:<28} p50 {:>10.3f} ms  p99 {:>10.3f} ms".format(name, values["p50_ms"], values["p99_ms"]))
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output["log"] = ["{}: {}".format(level, message) for level, message in cura_stubs.Logger.messages]
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(output, f, indent=2)
+    print("Results written to {}".format(args.output))
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compareWithBaseline(output, baseline, args.tolerance)
+        if regressions:
+            print("Regressions against {}:".format(args.baseline))
+            for regression in regressions:
+                print("  " + regression)
+            return 1
+        print("No regressions against {}".format(args.baseline))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())